@@ -0,0 +1,54 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares sequential and concurrent observation requests against
+a stand-in AI Module server with artificial latency."""
+
+import click
+import time
+
+from pyage2.env.age2_env import observation_facts
+from pyage2.lib.configs import MAX_SLOTS
+from pyage2.lib.expert import ExpertClient
+from pyage2.lib.testing import FakeExpertServicer, serve_fake_expert
+
+def _timeit(fn, steps: int) -> float:
+    start = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    return (time.perf_counter() - start) / steps
+
+@click.command()
+@click.option("--players", default=MAX_SLOTS, type=int)
+@click.option("--latency", default=0.02, type=float, help="Artificial server latency in seconds.")
+@click.option("--steps", default=50, type=int)
+def entry_point(players, latency, steps):
+    servicer = FakeExpertServicer(latency=latency)
+    server, port = serve_fake_expert(servicer, max_workers=players)
+    client = ExpertClient("127.0.0.1", port)
+    try:
+        facts = observation_facts()
+        plans = [client.compile(player_id, facts) for player_id in range(1, players+1)]
+
+        sequential = _timeit(lambda: [client.query(plan) for plan in plans], steps)
+        concurrent = _timeit(lambda: client.query_many(plans), steps)
+
+        print(f"players={players} facts={len(facts)} latency={latency*1000:.1f}ms steps={steps}")
+        print(f"sequential: {sequential*1000:.1f}ms/step")
+        print(f"concurrent: {concurrent*1000:.1f}ms/step ({sequential/concurrent:.2f}x)")
+    finally:
+        client.close()
+        server.stop(None)
+
+if __name__ == "__main__":
+    entry_point()
@@ -16,7 +16,8 @@
 import click
 import logging
 
-from pyage2.env import Age2Env, Age2ProcessError, Step, Agent
+from pyage2.env import Age2Env, Age2ProcessError, Agent
+from pyage2.env.agent_runner import PROCESS, THREAD, AgentRunner, play_episode
 from pyage2.lib import actions, bot
 from pyage2.lib.configs import *
 from pyage2.lib.cli import EnumChoice
@@ -31,10 +32,12 @@ logging.basicConfig(format='%(asctime)-15s %(message)s', level=logging.DEBUG)
 @click.option("--civilization1", default=PlayerCivilization.RANDOM, type=EnumChoice(PlayerCivilization))
 @click.option("--team1", default=PlayerTeam.NO_TEAM, type=PlayerTeam)
 @click.option("--color1", default=None, type=int)
+@click.option("--executor1", default=THREAD, type=click.Choice([THREAD, PROCESS]))
 @click.option("--agent2")
 @click.option("--civilization2", default=PlayerCivilization.RANDOM, type=EnumChoice(PlayerCivilization))
 @click.option("--team2", default=PlayerTeam.NO_TEAM, type=PlayerTeam)
 @click.option("--color2", default=None, type=int)
+@click.option("--executor2", default=THREAD, type=click.Choice([THREAD, PROCESS]))
 @click.option("--map-type", default=MapType.BLACK_FOREST, type=EnumChoice(MapType))
 @click.option("--map-size", default=MapSize.TINY, type=EnumChoice(MapSize))
 @click.option("--game-difficulty", default=GameDifficulty.HARD, type=EnumChoice(GameDifficulty))
@@ -52,11 +55,14 @@ logging.basicConfig(format='%(asctime)-15s %(message)s', level=logging.DEBUG)
 @click.option("--exec-path", default=None)
 @click.option("--autogame-dll-path", default=None)
 @click.option("--aimodule-dll-path", default=None)
+@click.option("--map-cache-dir", default=None, help="Directory to cache decoded scenario map tiles between episodes.")
+@click.option("--agent-time-budget", default=None, type=float, help="Seconds each agent has to decide on actions, no-op when exceeded.")
 def entry_point(**kwargs):
 	run_config = RunConfig.create(
 		exec_path=kwargs.get('exec_path'),
 		autogame_dll=kwargs.get('autogame_dll_path'),
 		aimodule_dll=kwargs.get('aimodule_dll_path'),
+		map_cache_dir=kwargs.get('map_cache_dir'),
 	)
 
 	game_config = GameConfig(
@@ -99,38 +105,25 @@ def entry_point(**kwargs):
 
 	logging.info("Agents setup: %s", agents)
 
-	with Age2Env(run_config, game_config) as env:
-		for agent in agents:
-			agent.instance.setup(env.observation_spec(), env.action_spec())
-			agent.instance.reset()
-		reward, done = 0, False
-		obs, info = env.reset()
-		while not done:
-			# xxx(okachaiev): should totally run this in separate threads
-			actions = []
-			for agent in agents:
-				agent_obs = obs[agent.player_id-1]
-				agent_obs.update(info)
-				agent_actions = agent.instance.step(Step(
-					observation=agent_obs,
-					reward=reward,
-					discount=0.,
-				))
-				actions.append((agent.player_id, agent_actions))
-			# xxx(okachaiev): what would be the most flexible way
-			# to define reward? a callback? weights?
-			try:
-				obs, reward, done, info = env.step(actions)
-			except Age2ProcessError as e:
-				logging.error(str(e))
-				done = True
-			else:
-				if info['episode_steps'] % 100 == 0:
-					print(obs)
-					print(info)
-		logging.info("Game if finished.")
-		print(obs)
-		print(info)
+	runner = AgentRunner(
+		agents,
+		time_budget=kwargs.get("agent_time_budget"),
+		executors={agent.player_id: kwargs.get(f"executor{agent.player_id}") or THREAD for agent in agents},
+	)
+	def print_progress(obs, info):
+		if info['episode_steps'] % 100 == 0:
+			print(obs)
+			print(info)
+
+	with Age2Env(run_config, game_config) as env, runner:
+		try:
+			obs, info = play_episode(env, runner, on_step=print_progress)
+		except Age2ProcessError as e:
+			logging.error(str(e))
+		else:
+			logging.info("Game if finished.")
+			print(obs)
+			print(info)
 
 if __name__ == "__main__":
 	entry_point()
\ No newline at end of file
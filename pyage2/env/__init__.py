@@ -12,5 +12,37 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
+
 from .core import BaseEnv, Step, Agent
-from .age2_env import Age2Env, Age2LaunchError, Age2ProcessError
\ No newline at end of file
+from .age2_env import Age2Env, Age2LaunchError, Age2ProcessError, GameStatus
+from .async_age2_env import AsyncAge2Env
+from .observations import DeltaDecoder, ObservationBatch, ObservationDelta
+from .polling import PollSchedule
+from pyage2.lib.process import Age2ProcessPool
+
+# these are imported from their submodules on first access, as they need
+# Python 3.8+ (shared memory) or optional dependencies
+_LAZY_ATTRIBUTES = {
+    'AgentRunner': 'agent_runner',
+    'ClusterCoordinator': 'cluster',
+    'ClusterWorker': 'cluster',
+    'ClusterWorkerServer': 'cluster',
+    'EpisodeResult': 'cluster',
+    'EpisodeSpec': 'cluster',
+    'RemoteClusterWorker': 'cluster',
+    'ObservationSlot': 'realtime',
+    'RealTimeAge2Env': 'realtime',
+    'Age2EnvServer': 'remote',
+    'RemoteAge2Env': 'remote',
+    'ActionDecoder': 'spaces',
+    'FlatObservationEncoder': 'spaces',
+    'Age2EnvPool': 'vec_env',
+    'Age2VecEnv': 'vec_env',
+}
+
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{module}", __name__), name)
\ No newline at end of file
@@ -14,38 +14,174 @@
 """Age of Empire II environment."""
 
 from enum import Enum
+from dataclasses import dataclass
 import logging
 import msgpackrpc
-import subprocess
+import msgpackrpc.error
+import numpy as np
 import time
-from typing import List
+from typing import FrozenSet, List, Optional, Tuple
 
 from pyage2.env.core import BaseEnv
-from pyage2.lib import LibraryInjector
+from pyage2.env.observations import DeltaEncoder, ObservationBatch
+from pyage2.env.polling import PollSchedule
+from pyage2.env.research import ResearchTracker
 from pyage2.lib.bot import DEFAULT_NOOP_BOT_NAME
-from pyage2.lib.configs import GameConfig, PlayerCivilization, PlayerType, RunConfig
-from pyage2.lib.expert import ExpertAPIError, ExpertClient, MapTiles, ObjectType, Resource, TechType
+from pyage2.lib.configs import GameConfig, GameType, PlayerCivilization, PlayerType, RunConfig
+from pyage2.lib.expert import (ExpertAPIError, ExpertClient, Facts, MapTiles, ObjectType, ObservationLayout,
+                               QueryPlan, Resource, TechType)
 from pyage2.lib import actions
+from pyage2.lib.consts import ConstResolver, version_fingerprint
+from pyage2.lib.process import Age2LaunchError, Age2ProcessPool, LocalProcessBackend, ProcessBackend
+from pyage2.lib.tiles_cache import MapTilesCache, find_scenario
 
 import pyage2.expert.action.action_pb2 as action
 import pyage2.expert.fact.fact_pb2 as fact
 
-class Age2LaunchError(Exception):
-    pass
-
 class Age2ProcessError(Exception):
     pass
 
+@dataclass
+class GameStatus:
+    """Snapshot of the game state reported by autogame."""
+    running: bool
+    game_time: float
+    winning_players: List[int]
+    # indexed by player_id-1
+    alive: List[bool]
+    # episode step when `winning_players` and `alive` were fetched
+    refreshed_at: int
+
 class Age2EnvState(Enum):
     START = 0
     RUNNING = 1
     DONE = 2
 
+def observation_facts() -> Facts:
+    """Lists all facts collected as observations for each player.
+
+    The list is static, so it should be built once and compiled into
+    `QueryPlan` per player rather than re-created on each step."""
+    generic_facts = [
+        ('current_age', fact.CurrentAge(), fact.CurrentAgeResult),
+        ('current_age_time', fact.CurrentAgeTime(), fact.CurrentAgeTimeResult),
+        ('score', fact.CurrentScore(), fact.CurrentScoreResult),
+        # xxxx(okachaiev): it seems i can collect all of those observations
+        # into a single array (either population* or features* with all generic counters)
+        ('population', fact.Population(), fact.PopulationResult),
+        ('population_cap', fact.PopulationCap(), fact.PopulationCapResult),
+        ('population_headroom', fact.PopulationHeadroom(), fact.PopulationHeadroomResult),
+        ('civilian_population', fact.CivilianPopulation(), fact.CivilianPopulationResult),
+        ('military_population', fact.MilitaryPopulation(), fact.MilitaryPopulationResult),
+        ('housing_headroom', fact.HousingHeadroom(), fact.HousingHeadroomResult),
+        ('idle_farm_count', fact.IdleFarmCount(), fact.IdleFarmCountResult),
+        ('soldier_count', fact.SoldierCount(), fact.SoldierCountResult),
+        ('attack_soldier_count', fact.AttackSoldierCount(), fact.AttackSoldierCountResult),
+        ('defend_soldier_count', fact.DefendSoldierCount(), fact.DefendSoldierCountResult),
+        ('warboat_count', fact.WarboatCount(), fact.WarboatCountResult),
+        ('attack_warboat_count', fact.AttackWarboatCount(), fact.AttackWarboatCountResult),
+        ('defend_warboat_count', fact.DefendWarboatCount(), fact.DefendWarboatCountResult),
+
+        # resources
+        ('resources.0', fact.FoodAmount(), fact.FoodAmountResult),
+        ('resources.1', fact.WoodAmount(), fact.WoodAmountResult),
+        ('resources.2', fact.GoldAmount(), fact.GoldAmountResult),
+        ('resources.3', fact.StoneAmount(), fact.StoneAmountResult),
+    ]
+
+    resource_found_facts = [
+        (f"resource_found.{i}", fact.ResourceFound(inConstResource=resource.value), fact.ResourceFoundResult)
+        for i, resource in enumerate(Resource)
+    ]
+
+    dropsite_min_distance_facts = [
+        (f"dropsite_min_distance.{i}", fact.DropsiteMinDistance(inConstResource=resource.value), fact.DropsiteMinDistanceResult)
+        for i, resource in enumerate(Resource)
+    ]
+
+    escrow_facts = [
+        (f"escrow.{i}", fact.EscrowAmount(inConstResource=resource.value), fact.EscrowAmountResult)
+        for i, resource in enumerate(Resource)
+    ]
+
+    object_count_facts = [
+        (f"object_count.{i}", fact.UnitTypeCount(inConstUnitId=object_type.value), fact.UnitTypeCountResult)
+        for i, object_type in enumerate(ObjectType)
+    ]
+
+    can_train_facts = [
+        (f"can_train.{i}", fact.CanTrain(inConstUnitId=unit_id.value), fact.CanTrainResult)
+        for i, unit_id in enumerate(ObjectType)
+    ]
+
+    can_build_facts = [
+        (f"can_build.{i}", fact.CanBuild(inConstBuildingId=building_id.value), fact.CanBuildResult)
+        for i, building_id in enumerate(ObjectType)
+    ]
+
+    can_research_facts = [
+        (f"can_research.{i}", fact.CanResearch(inConstTechId=tech_id.value), fact.CanResearchResult)
+        for i, tech_id in enumerate(TechType)
+    ]
+
+    # pending research is tracked with `UpResearchStatus` by `ResearchTracker`
+    # (see `track_research`), which only re-polls techs that might change
+
+    all_facts = generic_facts + \
+        resource_found_facts + \
+        dropsite_min_distance_facts + \
+        escrow_facts + \
+        object_count_facts + \
+        can_research_facts + \
+        can_train_facts + \
+        can_build_facts
+
+    return all_facts
+
 class Age2Env(BaseEnv):
     """Age of Empire II environment."""
 
-    def __init__(self, run_config: RunConfig, game_config: GameConfig):
-        """Creates Age of Empire II environment."""
+    def __init__(self,
+                 run_config: RunConfig,
+                 game_config: GameConfig,
+                 *,
+                 delta_snapshot_interval: Optional[int] = None,
+                 poll_schedule: Optional[PollSchedule] = None,
+                 track_research: bool = False,
+                 visibility_refresh_interval: Optional[int] = None,
+                 combined_step: bool = False,
+                 status_refresh_interval: int = 1,
+                 process_pool: Optional[Age2ProcessPool] = None,
+                 process_backend: Optional[ProcessBackend] = None):
+        """Creates Age of Empire II environment.
+
+        When `delta_snapshot_interval` is set, `reset` and `step` return
+        `ObservationDelta` with only changed values (and a full snapshot
+        each `delta_snapshot_interval` steps) instead of `ObservationBatch`.
+        Use `DeltaDecoder` on the receiving side to reconstruct batches.
+
+        `poll_schedule` allows to query slow-changing fields less often,
+        serving them from the previous observation in between polls (see
+        `ObservationBatch.age` for how stale each field is).
+
+        `track_research` replaces polling `can_research` for every tech on
+        each step with `ResearchTracker`, and adds `research_status` field
+        to observations.
+
+        `visibility_refresh_interval` refreshes visibility of map tiles each
+        given number of steps (see `refresh_visibility`).
+
+        `combined_step` sends each player's actions together with observation
+        facts in a single `CommandList`, halving number of RPCs per step.
+
+        `status_refresh_interval` defines how often (in steps) slow-changing
+        parts of `GameStatus` (alive and winning players) are re-fetched.
+
+        `process_pool` allows to lease already launched game process instead
+        of launching a new one, the process is returned to the pool on `close`.
+        Otherwise the process is launched by `process_backend` (local game
+        executable by default).
+        """
         self._run_config = run_config
         self._game_config = game_config.validate()
 
@@ -55,19 +191,46 @@ class Age2Env(BaseEnv):
         # self._num_agents = sum(1 for p in game_config.players if p.player_type == PlayerType.AGENT)
         self._num_agents = len(game_config.players)
 
-        self._proc = None
-        self._injector = None
+        self._process = None
         self._autogame_client = None
         self._expert_client = None
 
-        # launch game process
-        self._launch_process(self._run_config)
-
-        # inject DLL for running game programmatically
-        self._init_autogame(self._run_config)
-
-        # inject DLL to interact with expert facts and actions
-        self._init_expert_api(self._run_config)
+        self._observation_facts = observation_facts()
+        self._query_plans = {}
+        self._consts = None
+        self._tiles_cache = None
+        if run_config.map_cache_dir is not None:
+            self._tiles_cache = MapTilesCache(run_config.map_cache_dir)
+        self._facts_by_field = {}
+        for result_key, cmd, result_type in self._observation_facts:
+            name = result_key.split(".", 1)[0]
+            self._facts_by_field.setdefault(name, []).append((result_key, cmd, result_type))
+        self._visibility_refresh_interval = visibility_refresh_interval
+        self._combined_step = combined_step
+        assert status_refresh_interval > 0, "status_refresh_interval should be positive"
+        self._status_refresh_interval = status_refresh_interval
+        self._game_status = None
+        self._research_tracker = None
+        self._research_plans = {}
+        if track_research:
+            # `can_research` facts are managed by the tracker
+            self._research_tracker = ResearchTracker(self._num_agents, self._facts_by_field.pop('can_research'))
+            self._observation_facts = [f for facts in self._facts_by_field.values() for f in facts]
+        self._observation_layout = ObservationLayout(self.observation_spec())
+        self._poll_schedule = poll_schedule
+        self._last_batch = None
+        self._delta_encoder = None
+        if delta_snapshot_interval is not None:
+            self._delta_encoder = DeltaEncoder(delta_snapshot_interval)
+
+        # launched game process with both DLLs injected and connected
+        self._process_pool = process_pool
+        if process_pool is not None:
+            self._process = process_pool.lease()
+        else:
+            self._process = (process_backend or LocalProcessBackend()).launch(self._run_config)
+        self._autogame_client = self._process.autogame_client
+        self._expert_client = self._process.expert_client
 
         # create game based on the configuration given
         self._run_game(self._game_config)
@@ -77,99 +240,75 @@ class Age2Env(BaseEnv):
 
         logging.info("Environment is ready.")
 
-    # xxx(okachaiev): move this functionality to a separate module
-    # xxx(okachaiev): what if I want to run game on one machine and
-    # connect to it from a different one? should be possible if
-    # there's a flag to skip "run process & inject DLLs" step
-    def _launch_process(self, run_config: RunConfig):
-        try:
-            logging.debug(f"Launching game process %s", run_config.exec_path)
-
-            # xxx(okachaiev): assume i also need to run a background thread
-            # to poll from it periodically to make sure we can close env
-            # properly if the process was killed externally
-            # curious if there's an API to just provide on_close callback or something
-            self._proc = subprocess.Popen(run_config.exec_path)
-            # xxx(okachaiev): i should just have a "remote process" abstraction
-            # with Popen, on_close callback, and DLL injector (all together)
-            # in this case it should be much easier to reimplement for other platforms
-            self._injector = LibraryInjector(self._proc.pid)
-
-            logging.debug(f"Game process PID: %s", self._proc.pid)
-        except OSError:
-            logging.exception("Failed to launch game process.")
-            raise Age2LaunchError(f"Failed to launch {run_config.exec_path}")
-
-    def _init_autogame(self, run_config: RunConfig):
-        assert self._injector
-
-        self._injector.load_library(run_config.autogame_dll)
-
-        logging.debug("Connecting to autogame Msgpack RPC on %s:%s", run_config.host, run_config.autogame_port)
-
-        if run_config.autogame_connect_delay > 0:
-            time.sleep(run_config.autogame_connect_delay)
-        address = msgpackrpc.Address(run_config.host, run_config.autogame_port)
-        self._autogame_client = msgpackrpc.Client(
-            address,
-            timeout=run_config.autogame_timeout,
-            reconnect_limit=run_config.autogame_reconnect_limit
-        )
-
-    def _init_expert_api(self, run_config: RunConfig):
-        assert self._injector
-
-        if run_config.aimodule_load_delay > 0:
-            time.sleep(run_config.aimodule_load_delay)
-        self._injector.load_library(run_config.aimodule_dll)
-
-        logging.debug("Connecting to aimodule gRPC on %s:%s", run_config.host, run_config.aimodule_port)
-
-        self._expert_client = ExpertClient(run_config.host, run_config.aimodule_port)
-
     def _run_game(self, game_config: GameConfig):
         assert self._autogame_client, "Autogame client is not initialized."
         assert not self.running, "Game is already in progress."
 
-        # for the sake of safety...
+        # for the sake of safety... (has to be applied before everything else)
         self._autogame_client.call('ResetGameSettings')
 
+        _, errors = self._call_many(self._game_setup_calls(game_config))
+        if errors:
+            raise Age2LaunchError("Failed to configure the game: " + "; ".join(errors))
+
+        return self._autogame_client.call('StartGame')
+
+    def _game_setup_calls(self, game_config: GameConfig) -> List[Tuple]:
+        """Lists autogame calls (method name and args) to configure the game."""
         # general game configuration
-        self._autogame_client.call('SetGameMapType', game_config.map_type.value)
-        self._autogame_client.call('SetGameMapSize', game_config.map_size.value)
-        self._autogame_client.call('SetGameDifficulty', game_config.game_difficulty.value)
-        self._autogame_client.call('SetGameStartingAge', game_config.starting_age.value)
-        self._autogame_client.call('SetGameStartingResources', game_config.starting_resources.value)
-        self._autogame_client.call('SetGameType', game_config.game_type.value)
-        self._autogame_client.call('SetGameRevealMap', game_config.reveal_map.value)
-        # xxx(okachaiev): additional configuration should be handled properly
-        self._autogame_client.call('SetGameVictoryType', game_config.victory_type.value, 0)
+        calls = [
+            ('SetGameMapType', game_config.map_type.value),
+            ('SetGameMapSize', game_config.map_size.value),
+            ('SetGameDifficulty', game_config.game_difficulty.value),
+            ('SetGameStartingAge', game_config.starting_age.value),
+            ('SetGameStartingResources', game_config.starting_resources.value),
+            ('SetGameType', game_config.game_type.value),
+            ('SetGameRevealMap', game_config.reveal_map.value),
+            # xxx(okachaiev): additional configuration should be handled properly
+            ('SetGameVictoryType', game_config.victory_type.value, 0),
+        ]
         if game_config.scenario_name:
-            self._autogame_client.call('SetScenarioName', game_config.scenario_name)
+            calls.append(('SetScenarioName', game_config.scenario_name))
 
         # running configuration
-        self._autogame_client.call('SetRunFullSpeed', game_config.full_speed)
-        self._autogame_client.call('SetRunUnfocused', game_config.run_unfocused)
-        self._autogame_client.call('SetWindowMinimized', game_config.minimized_window)
-        self._autogame_client.call('SetGameRecorded', game_config.save_replay)
+        calls += [
+            ('SetRunFullSpeed', game_config.full_speed),
+            ('SetRunUnfocused', game_config.run_unfocused),
+            ('SetWindowMinimized', game_config.minimized_window),
+            ('SetGameRecorded', game_config.save_replay),
+        ]
 
         # configure players
-        self._autogame_client.call('SetGameTeamsLocked', True)
+        calls.append(('SetGameTeamsLocked', True))
         for i, player in enumerate(game_config.players):
             player_id = i+1
             if player.is_human:
-                self._autogame_client.call('SetPlayerHuman', player_id)
+                calls.append(('SetPlayerHuman', player_id))
             elif player.is_agent:
-                self._autogame_client.call('SetPlayerComputer', player_id, DEFAULT_NOOP_BOT_NAME)
+                calls.append(('SetPlayerComputer', player_id, DEFAULT_NOOP_BOT_NAME))
             else:
-                self._autogame_client.call('SetPlayerComputer', player_id, player.agent)
+                calls.append(('SetPlayerComputer', player_id, player.agent))
             civilization = player.civilization or PlayerCivilization.RANDOM
-            self._autogame_client.call('SetPlayerCivilization', player_id, civilization.value)
-            self._autogame_client.call('SetPlayerTeam', player_id, player.team.value)
+            calls.append(('SetPlayerCivilization', player_id, civilization.value))
+            calls.append(('SetPlayerTeam', player_id, player.team.value))
             if player.color is not None:
-                self._autogame_client.call('SetPlayerColor', player_id, player.color)
-
-        return self._autogame_client.call('StartGame')
+                calls.append(('SetPlayerColor', player_id, player.color))
+
+        return calls
+
+    def _call_many(self, calls: List[Tuple]) -> Tuple[List, List[str]]:
+        """Pipelines autogame calls: all requests are sent at once, responses
+        are awaited together. Returns results (`None` for failed calls) and
+        the list of errors, one per failed call."""
+        futures = [self._autogame_client.call_async(method, *args) for method, *args in calls]
+        results, errors = [], []
+        for (method, *args), future in zip(calls, futures):
+            try:
+                results.append(future.get())
+            except msgpackrpc.error.RPCError as e:
+                results.append(None)
+                errors.append(f"{method}{tuple(args)}: {e}")
+        return results, errors
 
     def _prepare(self):
         self._last_score = [0] * self._num_agents
@@ -186,6 +325,16 @@ class Age2Env(BaseEnv):
             # do not need to restart for the first episode
             self._restart()
 
+        self._start_episode()
+        self._tiles = self.map_tiles
+
+        self._info = None
+        self._observe_game()
+
+        self._reset_observations()
+        return self._encode_observations(self._observe_agents()), self._info
+
+    def _start_episode(self):
         self._state = Age2EnvState.RUNNING
         self._episode_start_time = time.time()
         self._episode_count += 1
@@ -193,12 +342,7 @@ class Age2Env(BaseEnv):
 
         self._last_score = [0] * self._num_agents
         self._winning = [0] * self._num_agents
-        self._tiles = self.map_tiles
-
-        self._info = None
-        self._observe_game()
-
-        return self._observe_agents(), self._info
+        self._game_status = None
 
     @property
     def map_tiles(self):
@@ -208,11 +352,61 @@ class Age2Env(BaseEnv):
         assert self._expert_client, "AI Module DLL client is not initialized."
 
         try:
-            return self._expert_client.map_tiles()
+            key = self._map_tiles_key() if self._tiles_cache is not None else None
+            if key is None:
+                return self._expert_client.map_tiles()
+            tiles = self._tiles_cache.load(key)
+            if tiles is None:
+                tiles = self._expert_client.map_tiles()
+                self._tiles_cache.store(key, tiles)
+            return tiles
+        except ExpertAPIError as e:
+            logging.exception("Expert API call failed.")
+            raise Age2ProcessError() from e
+
+    @property
+    def consts(self) -> ConstResolver:
+        """Resolver for symbolic game constants, cached per game/DLL version."""
+        assert self._expert_client, "AI Module DLL client is not initialized."
+        if self._consts is None:
+            version = version_fingerprint(self._run_config.exec_path, self._run_config.aimodule_dll)
+            self._consts = ConstResolver(self._expert_client, version, self._run_config.const_cache_dir)
+        return self._consts
+
+    def refresh_visibility(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Updates visibility of the map tiles in place (the same `MapTiles`
+        object is shared by all observations in the episode). Returns (ys, xs)
+        of tiles with visibility changed since the last refresh.
+
+        xxx(okachaiev): `ModMapTiles` does not allow to query a subset of
+        tile attributes, so the whole map is still transferred, only decoding
+        and merging are incremental.
+        """
+        assert self._expert_client, "AI Module DLL client is not initialized."
+        try:
+            return self._tiles.update_visibility(self._expert_client.visibility())
         except ExpertAPIError as e:
             logging.exception("Expert API call failed.")
             raise Age2ProcessError() from e
 
+    def _visibility_due(self) -> bool:
+        return self._visibility_refresh_interval is not None \
+            and self._episode_steps % self._visibility_refresh_interval == 0
+
+    def _map_tiles_key(self) -> Optional[str]:
+        """Cache key for the map of the current game, `None` when the map
+        can't be identified. Only scenarios produce the same map every time,
+        autogame has no way to fix the seed of a random map."""
+        config = self._game_config
+        if config.game_type != GameType.SCENARIO or not config.scenario_name:
+            return None
+        path = find_scenario(self._run_config.exec_path, config.scenario_name)
+        if path is None:
+            logging.debug("Scenario file for %s is not found, map tiles are not cached.", config.scenario_name)
+            return None
+        # hashing the file content, so edited scenario never loads stale tiles
+        return MapTilesCache.key(
+            config.scenario_name, version_fingerprint(str(path)), config.reveal_map, len(config.players))
 
     def step(self, actions):
         """Apply actions, step the world forward, and return observations."""
@@ -229,15 +423,23 @@ class Age2Env(BaseEnv):
             raise Age2ProcessError("'Age of Empires II' process was terminated.")
 
         # xxx(okachaiev): this is not exactly true when dealing with real-time game :thinking:
+        # (`RealTimeAge2Env` ticks on its own and lets agents act whenever ready)
         self._total_steps += 1
         self._episode_steps += 1
 
         try:
-            # issue actions into the game
-            self._expert_client.actions(actions)
-            # get observations from the game
-            self._observe_game()
-            agents_obs = self._observe_agents()
+            if self._combined_step:
+                # actions are issued together with observation facts
+                self._observe_game()
+                agents_obs = self._encode_observations(self._observe_agents(actions))
+            else:
+                # issue actions into the game
+                self._expert_client.actions(actions)
+                # get observations from the game
+                self._observe_game()
+                agents_obs = self._encode_observations(self._observe_agents())
+            if self._visibility_due():
+                self._tiles.update_visibility(self._expert_client.visibility())
         except ExpertAPIError as e:
             logging.exception("Expert API call failed.")
             raise Age2ProcessError() from e
@@ -245,7 +447,7 @@ class Age2Env(BaseEnv):
         # observation, reward, done, info
         # xxx(okachaiev): i'm curious what's the best approach to let agent to
         # determine it's own reward and do we even need it here? :thinking:
-        return agents_obs, 0, not self.running, self._info
+        return agents_obs, 0, not self._game_status.running, self._info
 
     @property
     def game_time(self):
@@ -267,118 +469,130 @@ class Age2Env(BaseEnv):
 
     @property
     def process_running(self):
-        return self._proc is not None and self._proc.poll() is None 
-
-    def _observe_agents(self):
-        """Returns an array of observations for each agent."""
-        # xxx(okachaiev): ideally, we need to do this in parallel
-        return [self._observe_agent(index+1) for index in range(self._num_agents)]
-
-    def _observe_agent(self, player_id: int):
-        """Collects observartions for a specific agent (or bot)."""
-        # xxx(okachaiev): need to think about how the agent can get
-        # access to the information about enemies (where allowed)
-        generic_facts = [
-            ('current_age', fact.CurrentAge(), fact.CurrentAgeResult),
-            ('current_age_time', fact.CurrentAgeTime(), fact.CurrentAgeTimeResult),
-            ('score', fact.CurrentScore(), fact.CurrentScoreResult),
-            # xxxx(okachaiev): it seems i can collect all of those observations
-            # into a single array (either population* or features* with all generic counters)
-            ('population', fact.Population(), fact.PopulationResult),
-            ('population_cap', fact.PopulationCap(), fact.PopulationCapResult),
-            ('population_headroom', fact.PopulationHeadroom(), fact.PopulationHeadroomResult),
-            ('civilian_population', fact.CivilianPopulation(), fact.CivilianPopulationResult),
-            ('military_population', fact.MilitaryPopulation(), fact.MilitaryPopulationResult),
-            ('housing_headroom', fact.HousingHeadroom(), fact.HousingHeadroomResult),
-            ('idle_farm_count', fact.IdleFarmCount(), fact.IdleFarmCountResult),
-            ('soldier_count', fact.SoldierCount(), fact.SoldierCountResult),
-            ('attack_soldier_count', fact.AttackSoldierCount(), fact.AttackSoldierCountResult),
-            ('defend_soldier_count', fact.DefendSoldierCount(), fact.DefendSoldierCountResult),
-            ('warboat_count', fact.WarboatCount(), fact.WarboatCountResult),
-            ('attack_warboat_count', fact.AttackWarboatCount(), fact.AttackWarboatCountResult),
-            ('defend_warboat_count', fact.DefendWarboatCount(), fact.DefendWarboatCountResult),
-
-            # resources
-            ('resources.0', fact.FoodAmount(), fact.FoodAmountResult),
-            ('resources.1', fact.WoodAmount(), fact.WoodAmountResult),
-            ('resources.2', fact.GoldAmount(), fact.GoldAmountResult),
-            ('resources.3', fact.StoneAmount(), fact.StoneAmountResult),
-        ]
-
-        resource_found_facts = [
-            (f"resource_found.{i}", fact.ResourceFound(inConstResource=resource.value), fact.ResourceFoundResult)
-            for i, resource in enumerate(Resource)
-        ]
-
-        dropsite_min_distance_facts = [
-            (f"dropsite_min_distance.{i}", fact.DropsiteMinDistance(inConstResource=resource.value), fact.DropsiteMinDistanceResult)
-            for i, resource in enumerate(Resource)
-        ]
-
-        escrow_facts = [
-            (f"escrow.{i}", fact.EscrowAmount(inConstResource=resource.value), fact.EscrowAmountResult)
-            for i, resource in enumerate(Resource)
-        ]
-
-        object_count_facts = [
-            (f"object_count.{i}", fact.UnitTypeCount(inConstUnitId=object_type.value), fact.UnitTypeCountResult)
-            for i, object_type in enumerate(ObjectType)
-        ]
-
-        can_train_facts = [
-            (f"can_train.{i}", fact.CanTrain(inConstUnitId=unit_id.value), fact.CanTrainResult)
-            for i, unit_id in enumerate(ObjectType)
-        ]
-
-        can_build_facts = [
-            (f"can_build.{i}", fact.CanBuild(inConstBuildingId=building_id.value), fact.CanBuildResult)
-            for i, building_id in enumerate(ObjectType)
-        ]
-
-        can_research_facts = [
-            (f"can_research.{i}", fact.CanResearch(inConstTechId=tech_id.value), fact.CanResearchResult)
-            for i, tech_id in enumerate(TechType)
-        ]
-
-        # xxx(okachaiev): there are 2 options for how we can track pending research
-        # 1. keep track of requested researches and only update them
-        # 2. use `UpResearchStatus` fact for all tech ids
-        # the former yields much better performance but want be suitable for bots &
-        # replay files (as we don't have access to requests)
-        # maybe there's a way to find all pending researches using scripting API...
-
-        all_facts = generic_facts + \
-            resource_found_facts + \
-            dropsite_min_distance_facts + \
-            escrow_facts + \
-            object_count_facts + \
-            can_research_facts + \
-            can_train_facts + \
-            can_build_facts
-
-        expert_obs = self._expert_client.player_facts(player_id, all_facts)
-
-        expert_obs.update({
-            'alive': self._autogame_client.call('GetPlayerAlive', player_id),
-            'winning': self._winning[player_id-1],
-            'tiles': self._tiles,
-        })
+        return self._process is not None and self._process.running
+
+    def _observe_agents(self, actions=None) -> ObservationBatch:
+        """Returns observations for all agents as a single batch. When given,
+        actions are issued within the same requests right before facts."""
+        plans = self._query_plans_for_step()
+        # requests for all players are issued concurrently
+        responses = self._expert_client.execute_many(plans, actions)
+        return self._observation_batch(plans, responses, self._game_status.alive)
+
+    def _reset_observations(self):
+        self._last_batch = None
+        if self._poll_schedule is not None:
+            self._poll_schedule.reset()
+        if self._research_tracker is not None:
+            self._research_tracker.reset()
+        if self._delta_encoder is not None:
+            self._delta_encoder.reset()
+
+    def _query_plans_for_step(self) -> List[QueryPlan]:
+        due_fields = None
+        if self._poll_schedule is not None:
+            due_fields = self._poll_schedule.due(
+                self._facts_by_field.keys(), self._episode_steps, self._info['game_time'])
+            # full plan is cached separately, no need to compile it twice
+            if len(due_fields) == len(self._facts_by_field):
+                due_fields = None
+        plans = [self._query_plan(index+1, due_fields) for index in range(self._num_agents)]
+        if self._research_tracker is not None:
+            plans = [self._with_research_plan(plan) for plan in plans]
+        return plans
+
+    def _with_research_plan(self, plan: QueryPlan) -> QueryPlan:
+        """Extends the plan with facts requested by research tracker."""
+        research_plan = self._research_tracker.plan(plan.player_id, self._observation_layout)
+        cached = self._research_plans.get(plan.player_id)
+        if cached is None or cached[0] is not plan or cached[1] is not research_plan:
+            cached = (plan, research_plan, plan + research_plan)
+            self._research_plans[plan.player_id] = cached
+        return cached[2]
+
+    def _encode_observations(self, batch: ObservationBatch):
+        if self._delta_encoder is None:
+            return batch
+        return self._delta_encoder.encode(batch)
+
+    def _observation_batch(self, plans: List[QueryPlan], responses, alive: List[int]) -> ObservationBatch:
+        batch = ObservationBatch.decode(self._observation_layout, plans, responses, self._tiles, self._last_batch)
+        batch['alive'][:] = alive
+        batch['winning'][:] = self._winning
+        if self._research_tracker is not None:
+            self._research_tracker.observe(batch)
+        if self._poll_schedule is not None:
+            batch.age = {
+                name: self._poll_schedule.age(name, self._episode_steps)
+                for name in self._facts_by_field
+            }
+            self._last_batch = batch
+        return batch
+
+    def _query_plan(self, player_id: int, fields: Optional[FrozenSet[str]] = None) -> QueryPlan:
+        """Returns pre-compiled observation facts for a given player,
+        optionally limited to a given set of fields (`None` means all)."""
+        plan = self._query_plans.get((player_id, fields))
+        if plan is None:
+            if fields is None:
+                facts = self._observation_facts
+            else:
+                facts = [fact for name in fields for fact in self._facts_by_field[name]]
+            plan = QueryPlan(player_id, facts, self._observation_layout)
+            self._query_plans[(player_id, fields)] = plan
+        return plan
 
-        return expert_obs
+    @property
+    def game_status(self) -> Optional[GameStatus]:
+        """Game state as of the last step."""
+        return self._game_status
 
     def _observe_game(self):
         """Collects general informatio about the state of the game."""
+        self._update_game_info(self._fetch_game_status())
+
+    def _fetch_game_status(self) -> GameStatus:
+        """Fetches all autogame state for the step with a single pipelined
+        batch of calls. Alive and winning players are re-used from the
+        previous snapshot unless `status_refresh_interval` has passed."""
+        previous = self._game_status
+        refresh = previous is None or \
+            self._episode_steps - previous.refreshed_at >= self._status_refresh_interval
+        calls = [('GetGameInProgress',), ('GetGameTime',)]
+        if refresh:
+            calls.append(('GetWinningPlayers',))
+            calls += [('GetPlayerAlive', index+1) for index in range(self._num_agents)]
+        results, errors = self._call_many(calls)
+        if errors:
+            raise Age2ProcessError("Failed to fetch game status: " + "; ".join(errors))
+        if refresh:
+            winning_players, alive, refreshed_at = results[2], results[3:], self._episode_steps
+        else:
+            winning_players, alive, refreshed_at = previous.winning_players, previous.alive, previous.refreshed_at
+        self._game_status = GameStatus(
+            # xxx(okachaiev): in some cases (not sure how to reproduce),
+            # this call returns True for the game that already finished
+            running=bool(results[0]),
+            game_time=float(results[1]),
+            winning_players=list(winning_players),
+            alive=list(alive),
+            refreshed_at=refreshed_at,
+        )
+        return self._game_status
+
+    def _update_game_info(self, status: GameStatus):
         # update information on winning players
         self._winning = [0] * self._num_agents
         # xxx(okachaiev): as of now, this call returns all players
         # even when game is finished
-        for player_id in self._autogame_client.call('GetWinningPlayers'):
+        for player_id in status.winning_players:
             self._winning[player_id-1] = 1
+        game_time = status.game_time
 
         # better be a dataclass though in this case it wouldn't
         # be possible to merge different observations
         self._info = {
-            "game_time": self.game_time,
+            "game_time": game_time,
             "wall_time": time.time() - self._episode_start_time,
             "episode": self._episode_count,
             "episode_steps": self._episode_steps,
@@ -393,11 +607,10 @@ class Age2Env(BaseEnv):
     def observation_spec(self):
         """Defines the observations provided by the environment."""
         num_objects = len(ObjectType)
-        # xxx(okachaiev): replace with more performant data structure
-        return {
-            # xxx(okachaiev): it seems like would be better to have
-            # feature in "object of arrays" rather than "array of objects"
-            # in this case, dimensionality would be (num_players, 1)
+        num_techs = len(TechType)
+        spec = {
+            # per player shapes, `ObservationBatch` stacks them
+            # into (num_players, *shape) arrays
             'current_age': (1,),
             'current_age_time': (1,),
             'score': (1,),
@@ -419,11 +632,14 @@ class Age2Env(BaseEnv):
             'dropsite_min_distance': (4,),
             'escrow': (4,),
             'object_count': (num_objects,),
-            'can_research': (num_objects,),
+            'can_research': (num_techs,),
             'can_train': (num_objects,),
             'can_build': (num_objects,),
             'tiles': MapTiles,
         }
+        if self._research_tracker is not None:
+            spec['research_status'] = (num_techs,)
+        return spec
 
     def action_spec(self):
         """Defines the actions that could be provided to `step` method."""
@@ -442,18 +658,12 @@ class Age2Env(BaseEnv):
         """Frees up any resources associated with the environment (e.g. external
         processes). The method could be used directly or via a context manager.
         """
-        if self._injector is not None:
-            self._injector.close()
-            self._injector = None
-
-        if self._autogame_client is not None:
-            self._autogame_client.close()
-            self._autogame_client = None
-
-        if self._expert_client is not None:
-            self._expert_client.close()
-            self._expert_client = None
+        self._autogame_client = None
+        self._expert_client = None
 
-        if self.process_running:
-            self._proc.terminate()
-            self._proc = None
+        if self._process is not None:
+            if self._process_pool is not None:
+                self._process_pool.release(self._process)
+            else:
+                self._process.close()
+            self._process = None
@@ -0,0 +1,246 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stepping agents concurrently, each within its own time budget."""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError, wait
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pyage2.env.core import Agent, Step
+
+THREAD = "thread"
+PROCESS = "process"
+
+# agent instance living in a dedicated worker process, together with map
+# tiles of the current episode (sent once rather than with every step)
+_process_agent = None
+_process_tiles = None
+
+def _init_process_agent(player_id: int, player_config):
+    global _process_agent
+    _process_agent = Agent.for_player(player_id, player_config)
+
+def _call_process_agent(method: str, *args):
+    return getattr(_process_agent.instance, method)(*args)
+
+def _set_process_tiles(tiles):
+    global _process_tiles
+    _process_tiles = tiles
+
+def _update_process_visibility(visibility: np.ndarray):
+    _process_tiles.update_visibility(visibility)
+
+def _step_process_agent(step: Step):
+    step.observation['tiles'] = _process_tiles
+    return _process_agent.instance.step(step)
+
+class _AgentSlot:
+    """Agent together with the executor it runs on."""
+
+    def __init__(self, agent: Agent, executor_type: str, time_budget: Optional[float]):
+        self.agent = agent
+        self.player_id = agent.player_id
+        self.executor_type = executor_type
+        self.time_budget = time_budget
+        self.pending = None
+        # when the pending step was submitted
+        self.started = None
+        self.timeouts = 0
+        # tiles (and their visibility) as known to the agent process
+        self._tiles = None
+        self._visibility = None
+        self.executor = self._new_executor()
+
+    def _new_executor(self):
+        if self.executor_type == PROCESS:
+            # instance is re-created within the process from its config
+            return ProcessPoolExecutor(
+                max_workers=1,
+                initializer=_init_process_agent,
+                initargs=(self.agent.player_id, self.agent.config),
+            )
+        if self.executor_type == THREAD:
+            return ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"agent-{self.player_id}")
+        raise ValueError(f"Unknown executor type {self.executor_type}")
+
+    def submit(self, method: str, *args):
+        if self.executor_type == PROCESS:
+            return self.executor.submit(_call_process_agent, method, *args)
+        return self.executor.submit(getattr(self.agent.instance, method), *args)
+
+    def submit_step(self, step: Step):
+        self.started = time.monotonic()
+        if self.executor_type != PROCESS:
+            return self.executor.submit(self.agent.instance.step, step)
+        # tiles are sent to the process once per episode, afterwards
+        # only visibility is sent and only when it has changed
+        tiles = step.observation.pop('tiles', None)
+        if tiles is not self._tiles:
+            self.executor.submit(_set_process_tiles, tiles)
+            self._tiles = tiles
+            self._visibility = None if tiles is None else tiles.visibility.copy()
+        elif tiles is not None and not np.array_equal(self._visibility, tiles.visibility):
+            self.executor.submit(_update_process_visibility, tiles.visibility)
+            self._visibility = tiles.visibility.copy()
+        return self.executor.submit(_step_process_agent, step)
+
+    def remaining_budget(self) -> Optional[float]:
+        if self.time_budget is None:
+            return None
+        return max(0.0, self.started + self.time_budget - time.monotonic())
+
+    def abandon(self):
+        """Leaves the pending call to finish on its own and switches to
+        a fresh executor. Agents in processes lose their state."""
+        self.pending.cancel()
+        self.pending = None
+        self.executor.shutdown(wait=False)
+        self.executor = self._new_executor()
+        self._tiles = None
+        self._visibility = None
+
+class AgentRunner:
+    """Steps all agents in parallel, each in a thread or in a separate
+    process (`executors` maps player id to "thread" or "process").
+
+    An agent that does not return actions within its time budget is given
+    no-op for this step. Its late actions are dropped, and it is not stepped
+    again until it catches up, so a slow agent never stalls the game. On
+    `reset`, late steps get the largest remaining budget to finish, agents
+    still stepping after that are abandoned (see `_AgentSlot.abandon`).
+    """
+
+    def __init__(self,
+                 agents: List[Agent],
+                 time_budget: Optional[float] = None,
+                 budgets: Optional[Dict[int, float]] = None,
+                 executors: Optional[Dict[int, str]] = None):
+        budgets = budgets or {}
+        executors = executors or {}
+        self._slots = [
+            _AgentSlot(
+                agent,
+                executors.get(agent.player_id, THREAD),
+                budgets.get(agent.player_id, time_budget),
+            )
+            for agent in agents
+        ]
+        self._setup_args = None
+
+    @property
+    def timeouts(self) -> Dict[int, int]:
+        """Number of steps each agent has missed its time budget."""
+        return {slot.player_id: slot.timeouts for slot in self._slots}
+
+    def _call_all(self, method: str, *args):
+        futures = [slot.submit(method, *args) for slot in self._slots]
+        for future in futures:
+            future.result()
+
+    def setup(self, obs_spec, action_spec):
+        self._setup_args = (obs_spec, action_spec)
+        self._call_all('setup', obs_spec, action_spec)
+
+    def reset(self):
+        late = [slot for slot in self._slots if slot.pending is not None]
+        if late:
+            budgets = [slot.remaining_budget() for slot in late]
+            timeout = None if None in budgets else max(budgets)
+            wait([slot.pending for slot in late], timeout=timeout)
+        for slot in late:
+            if slot.pending.done():
+                slot.pending = None
+                continue
+            logging.warning("Agent %s is still stepping after its time budget, abandoned.", slot.player_id)
+            slot.abandon()
+            if slot.executor_type == PROCESS and self._setup_args is not None:
+                # fresh process has a fresh agent instance
+                slot.submit('setup', *self._setup_args).result()
+        self._call_all('reset')
+
+    def step(self, obs, info: Dict, reward: Any = 0) -> List[Tuple[int, List]]:
+        """Returns actions of all agents as a list of (player id, actions)."""
+        start = time.monotonic()
+        submitted = []
+        for slot in self._slots:
+            if slot.pending is not None and not slot.pending.done():
+                # still thinking on one of the previous steps
+                slot.timeouts += 1
+                continue
+            agent_obs = obs[slot.player_id-1]
+            agent_obs.update(info)
+            slot.pending = slot.submit_step(Step(
+                observation=agent_obs,
+                reward=reward,
+                discount=0.,
+            ))
+            submitted.append(slot)
+
+        actions = []
+        for slot in submitted:
+            timeout = None
+            if slot.time_budget is not None:
+                timeout = max(0.0, start + slot.time_budget - time.monotonic())
+            try:
+                agent_actions = slot.pending.result(timeout=timeout)
+            except TimeoutError:
+                logging.warning("Agent %s exceeded time budget of %ss, no-op.", slot.player_id, slot.time_budget)
+                slot.timeouts += 1
+                continue
+            except Exception:
+                logging.exception("Agent %s failed to step, no-op.", slot.player_id)
+                slot.pending = None
+                continue
+            slot.pending = None
+            actions.append((slot.player_id, agent_actions))
+        return actions
+
+    def close(self):
+        for slot in self._slots:
+            slot.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _exception_traceback):
+        self.close()
+
+def play_episode(env,
+                 runner: AgentRunner,
+                 max_steps: Optional[int] = None,
+                 stop: Optional[threading.Event] = None,
+                 on_step: Optional[Callable[[Any, Dict], None]] = None) -> Tuple[Any, Dict]:
+    """Plays a single episode with agents of the runner, returns the last
+    observation and info. Stops early when `stop` is set or after
+    `max_steps`, `on_step(obs, info)` is called after each step."""
+    runner.setup(env.observation_spec(), env.action_spec())
+    runner.reset()
+    reward, done = 0, False
+    obs, info = env.reset()
+    while not done:
+        if stop is not None and stop.is_set():
+            break
+        actions = runner.step(obs, info, reward)
+        # xxx(okachaiev): what would be the most flexible way
+        # to define reward? a callback? weights?
+        obs, reward, done, info = env.step(actions)
+        if on_step is not None:
+            on_step(obs, info)
+        if max_steps is not None and info['episode_steps'] >= max_steps:
+            break
+    return obs, info
@@ -0,0 +1,156 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Age of Empire II environment with asyncio-native API."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import logging
+
+from pyage2.env.age2_env import Age2Env, Age2EnvState, Age2ProcessError
+from pyage2.lib.configs import GameConfig, RunConfig
+from pyage2.lib.expert import AsyncExpertClient, ExpertAPIError
+
+class AsyncAge2Env(Age2Env):
+    """Age of Empire II environment with `reset` and `step` being coroutines.
+
+    Many environments (and agents) could share a single event loop. The game
+    process is still launched synchronously within the constructor, use
+    `AsyncAge2Env.create` to avoid blocking the loop while doing so.
+    """
+
+    def __init__(self, run_config: RunConfig, game_config: GameConfig, **kwargs):
+        self._async_expert_client = None
+        # msgpack-rpc client is blocking and not thread-safe, all calls
+        # are offloaded to a single dedicated thread
+        self._autogame_executor = ThreadPoolExecutor(max_workers=1)
+        super().__init__(run_config, game_config, **kwargs)
+
+    @classmethod
+    async def create(cls, run_config: RunConfig, game_config: GameConfig, **kwargs) -> 'AsyncAge2Env':
+        """Launches the game process without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(cls, run_config, game_config, **kwargs))
+
+    async def _autogame(self, method: str, *args):
+        assert self._autogame_client, "Autogame DLL client is not initialized."
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._autogame_client.call, method, *args)
+        return await loop.run_in_executor(self._autogame_executor, call)
+
+    def _async_expert(self) -> AsyncExpertClient:
+        # gRPC aio channel is bound to the loop, so it is created
+        # lazily from the first coroutine that needs it
+        if self._async_expert_client is None:
+            self._async_expert_client = AsyncExpertClient(self._process.host, self._process.aimodule_port)
+        return self._async_expert_client
+
+    async def reset(self):
+        """Starts a new episode."""
+        self._episode_steps = 0
+        if self._episode_count > 0:
+            # do not need to restart for the first episode
+            await self._autogame('RestartGame')
+
+        self._start_episode()
+        try:
+            self._tiles = await self._map_tiles()
+        except ExpertAPIError as e:
+            logging.exception("Expert API call failed.")
+            raise Age2ProcessError() from e
+
+        self._info = None
+        await self._observe_game()
+
+        self._reset_observations()
+        return self._encode_observations(await self._observe_agents()), self._info
+
+    async def _map_tiles(self):
+        key = self._map_tiles_key() if self._tiles_cache is not None else None
+        if key is None:
+            return await self._async_expert().map_tiles()
+        tiles = self._tiles_cache.load(key)
+        if tiles is None:
+            tiles = await self._async_expert().map_tiles()
+            self._tiles_cache.store(key, tiles)
+        return tiles
+
+    async def step(self, actions):
+        """Apply actions, step the world forward, and return observations."""
+        if self._state == Age2EnvState.START:
+            await self.reset()
+
+        if not self.process_running:
+            raise Age2ProcessError("'Age of Empires II' process was terminated.")
+
+        self._total_steps += 1
+        self._episode_steps += 1
+
+        try:
+            if self._combined_step:
+                await self._observe_game()
+                agents_obs = self._encode_observations(await self._observe_agents(actions))
+            else:
+                await self._async_expert().actions(actions)
+                await self._observe_game()
+                agents_obs = self._encode_observations(await self._observe_agents())
+            if self._visibility_due():
+                await self.refresh_visibility()
+        except ExpertAPIError as e:
+            logging.exception("Expert API call failed.")
+            raise Age2ProcessError() from e
+
+        return agents_obs, 0, not self._game_status.running, self._info
+
+    async def refresh_visibility(self):
+        """Coroutine version of `Age2Env.refresh_visibility`."""
+        try:
+            return self._tiles.update_visibility(await self._async_expert().visibility())
+        except ExpertAPIError as e:
+            logging.exception("Expert API call failed.")
+            raise Age2ProcessError() from e
+
+    async def _observe_agents(self, actions=None):
+        """Returns observations for all agents as a single batch."""
+        plans = self._query_plans_for_step()
+        responses = await self._async_expert().execute_many(plans, actions)
+        return self._observation_batch(plans, responses, self._game_status.alive)
+
+    async def _observe_game(self):
+        """Collects general informatio about the state of the game."""
+        loop = asyncio.get_running_loop()
+        status = await loop.run_in_executor(self._autogame_executor, self._fetch_game_status)
+        self._update_game_info(status)
+
+    async def aclose(self):
+        """Closes async gRPC channel and frees up all other resources."""
+        if self._async_expert_client is not None:
+            await self._async_expert_client.close()
+            self._async_expert_client = None
+        self.close()
+
+    def close(self):
+        # channel is going to be dropped together with the loop,
+        # use `aclose` to shutdown it gracefully
+        self._async_expert_client = None
+        super().close()
+        if self._autogame_executor is not None:
+            self._autogame_executor.shutdown(wait=False)
+            self._autogame_executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, _exception_type, _exception_value, _exception_traceback):
+        await self.aclose()
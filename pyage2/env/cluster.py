@@ -0,0 +1,567 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Scheduling episodes across many game hosts.
+
+`ClusterWorker` runs on each game host and plays episodes with local
+environments. `ClusterCoordinator` keeps the queue of episodes, assigns them
+to registered workers based on their capacity and observed step rate, moves
+episodes away from hosts that died or slowed down, and streams results back.
+
+Workers could live in the same process (handy for testing with fake game
+backends) or be served over msgpack-rpc with `ClusterWorkerServer` and
+registered on the coordinator as `RemoteClusterWorker`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+from dataclasses import dataclass, field
+import logging
+import queue
+import statistics
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterator, List, Optional
+import uuid
+
+import msgpackrpc
+
+from pyage2.env.age2_env import Age2Env
+from pyage2.env.agent_runner import AgentRunner, play_episode
+from pyage2.env.core import Agent
+from pyage2.lib.configs import (GameConfig, GameDifficulty, GameType, MapSize, MapType, PlayerCivilization,
+                                PlayerConfig, PlayerTeam, PlayerType, RevealMap, StartingAge,
+                                StartingResources, VictoryType)
+from pyage2.lib.rpc import RpcServer, decode_strings
+
+DEFAULT_POLL_INTERVAL_SECONDS = 1.0
+DEFAULT_HEARTBEAT_TIMEOUT_SECONDS = 30.0
+DEFAULT_SLOW_FACTOR = 0.5
+# slow worker gets its full capacity back only above this ratio of the median
+DEFAULT_RECOVER_FACTOR = 0.8
+# episodes younger than that are never cancelled by rebalancing
+DEFAULT_MIN_EPISODE_SECONDS = 60.0
+DEFAULT_MAX_ATTEMPTS = 3
+# weight of the latest measurement in step rate moving average
+STEP_RATE_SMOOTHING = 0.3
+CANCELLED = "cancelled"
+
+@dataclass
+class EpisodeSpec:
+    """Episode to be played somewhere in the cluster."""
+    game_config: GameConfig
+    # player id -> agent class (e.g. "pyage2.agents.RandomAgent"),
+    # overrides players configuration from `game_config`
+    agents: Dict[int, str] = field(default_factory=dict)
+    max_steps: Optional[int] = None
+    episode_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+
+    def resolved_game_config(self) -> GameConfig:
+        players = list(self.game_config.players)
+        for player_id, agent in self.agents.items():
+            player = players[player_id-1]
+            players[player_id-1] = dataclasses.replace(player, player_type=PlayerType.AGENT, agent=agent)
+        return dataclasses.replace(self.game_config, players=players)
+
+@dataclass
+class EpisodeResult:
+    episode_id: str
+    worker_id: str
+    steps: int = 0
+    game_time: float = 0.0
+    wall_time: float = 0.0
+    winning_players: List[int] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+@dataclass
+class WorkerStatus:
+    worker_id: str
+    capacity: int
+    # episode id -> steps played so far
+    running: Dict[str, int]
+    # steps per second across all running episodes since the previous poll
+    step_rate: float
+    # episodes finished since the previous poll
+    results: List[EpisodeResult]
+
+ENUM_FIELDS = {
+    'map_type': MapType,
+    'game_difficulty': GameDifficulty,
+    'starting_age': StartingAge,
+    'starting_resources': StartingResources,
+    'game_type': GameType,
+    'reveal_map': RevealMap,
+    'victory_type': VictoryType,
+}
+
+def encode_game_config(game_config: GameConfig) -> Dict:
+    """Converts `GameConfig` into plain dict, suitable for msgpack or JSON."""
+    payload = dataclasses.asdict(game_config)
+    for name in ENUM_FIELDS:
+        payload[name] = payload[name].value
+    if isinstance(game_config.map_size, MapSize):
+        payload['map_size'] = game_config.map_size.value
+    else:
+        payload['map_size'] = list(game_config.map_size)
+    for player in payload['players']:
+        player['player_type'] = player['player_type'].value
+        player['team'] = player['team'].value
+        if player['civilization'] is not None:
+            player['civilization'] = player['civilization'].value
+    return payload
+
+def decode_game_config(payload: Dict) -> GameConfig:
+    payload = dict(payload)
+    for name, enum_cls in ENUM_FIELDS.items():
+        payload[name] = enum_cls(payload[name])
+    map_size = payload['map_size']
+    payload['map_size'] = tuple(map_size) if isinstance(map_size, (list, tuple)) else MapSize(map_size)
+    players = []
+    for player in payload['players']:
+        civilization = player['civilization']
+        players.append(PlayerConfig(
+            player_type=PlayerType(player['player_type']),
+            agent=player['agent'],
+            civilization=PlayerCivilization(civilization) if civilization is not None else None,
+            team=PlayerTeam(player['team']),
+            color=player['color'],
+        ))
+    payload['players'] = players
+    return GameConfig(**payload)
+
+def encode_episode(spec: EpisodeSpec) -> Dict:
+    return {
+        'episode_id': spec.episode_id,
+        'game_config': encode_game_config(spec.game_config),
+        'agents': {str(player_id): agent for player_id, agent in spec.agents.items()},
+        'max_steps': spec.max_steps,
+        'attempts': spec.attempts,
+    }
+
+def decode_episode(payload: Dict) -> EpisodeSpec:
+    return EpisodeSpec(
+        game_config=decode_game_config(payload['game_config']),
+        agents={int(player_id): agent for player_id, agent in payload['agents'].items()},
+        max_steps=payload['max_steps'],
+        episode_id=payload['episode_id'],
+        attempts=payload['attempts'],
+    )
+
+class ClusterWorker:
+    """Plays up to `capacity` episodes at once, each in its own environment
+    created with `env_fn(game_config)`."""
+
+    def __init__(self, worker_id: str, env_fn: Callable[[GameConfig], Age2Env], capacity: int = 1):
+        assert capacity > 0, "Capacity should be positive"
+        self.worker_id = worker_id
+        self.capacity = capacity
+        self._env_fn = env_fn
+        self._executor = ThreadPoolExecutor(max_workers=capacity, thread_name_prefix=f"worker-{worker_id}")
+        self._lock = threading.Lock()
+        self._running = {}
+        self._stops = {}
+        self._results = []
+        self._steps = 0
+        self._polled_steps = 0
+        self._polled_at = time.monotonic()
+
+    def submit(self, spec: EpisodeSpec) -> bool:
+        """Starts the episode, returns `False` when the worker is full."""
+        with self._lock:
+            if len(self._running) >= self.capacity:
+                return False
+            self._running[spec.episode_id] = 0
+            self._stops[spec.episode_id] = threading.Event()
+        self._executor.submit(self._play, spec)
+        return True
+
+    def cancel(self, episode_id: str):
+        with self._lock:
+            stop = self._stops.get(episode_id)
+        if stop is not None:
+            stop.set()
+
+    def _on_step(self, episode_id: str, _obs, info: Dict):
+        with self._lock:
+            self._running[episode_id] = info['episode_steps']
+            self._steps += 1
+
+    def _play(self, spec: EpisodeSpec):
+        result = EpisodeResult(episode_id=spec.episode_id, worker_id=self.worker_id)
+        start = time.monotonic()
+        stop = self._stops[spec.episode_id]
+        try:
+            game_config = spec.resolved_game_config()
+            agents = [Agent.for_player(i+1, p) for i, p in enumerate(game_config.players) if p.is_agent]
+            with self._env_fn(game_config) as env, AgentRunner(agents) as runner:
+                _, info = play_episode(
+                    env,
+                    runner,
+                    spec.max_steps,
+                    stop,
+                    lambda obs, info: self._on_step(spec.episode_id, obs, info),
+                )
+                result.steps = info.get('episode_steps', 0)
+                result.game_time = info.get('game_time', 0.0)
+                if env.game_status is not None:
+                    result.winning_players = list(env.game_status.winning_players)
+            if stop.is_set():
+                result.error = CANCELLED
+        except Exception:
+            logging.exception("Episode %s failed on worker %s.", spec.episode_id, self.worker_id)
+            result.error = traceback.format_exc()
+        result.wall_time = time.monotonic() - start
+        with self._lock:
+            self._running.pop(spec.episode_id, None)
+            self._stops.pop(spec.episode_id, None)
+            self._results.append(result)
+
+    def poll(self) -> WorkerStatus:
+        """Reports progress and hands over results finished since the
+        previous poll."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._polled_at, 1e-6)
+            step_rate = (self._steps - self._polled_steps) / elapsed
+            self._polled_steps, self._polled_at = self._steps, now
+            results, self._results = self._results, []
+            return WorkerStatus(
+                worker_id=self.worker_id,
+                capacity=self.capacity,
+                running=dict(self._running),
+                step_rate=step_rate,
+                results=results,
+            )
+
+    def close(self):
+        with self._lock:
+            stops = list(self._stops.values())
+        for stop in stops:
+            stop.set()
+        self._executor.shutdown(wait=True)
+
+class _WorkerHandler:
+    """msgpack-rpc dispatcher, every public method is an RPC."""
+
+    def __init__(self, worker: ClusterWorker):
+        self._worker = worker
+
+    def submit(self, payload):
+        return self._worker.submit(decode_episode(decode_strings(payload)))
+
+    def cancel(self, episode_id):
+        self._worker.cancel(decode_strings(episode_id))
+
+    def poll(self):
+        return dataclasses.asdict(self._worker.poll())
+
+class ClusterWorkerServer(RpcServer):
+    """Serves `ClusterWorker` over msgpack-rpc, to be registered on the
+    coordinator as `RemoteClusterWorker`."""
+
+    def __init__(self, worker: ClusterWorker, host: str = "127.0.0.1", port: Optional[int] = None):
+        self.worker = worker
+        super().__init__(_WorkerHandler(worker), host, port)
+
+    def close(self):
+        super().close()
+        self.worker.close()
+
+class RemoteClusterWorker:
+    """Client side of `ClusterWorkerServer` with the same interface as
+    `ClusterWorker` (`submit`, `cancel`, `poll`, `close`)."""
+
+    def __init__(self, host: str, port: int, timeout: int = 10):
+        self._client = msgpackrpc.Client(msgpackrpc.Address(host, port), timeout=timeout, reconnect_limit=1)
+
+    def submit(self, spec: EpisodeSpec) -> bool:
+        return bool(self._client.call('submit', encode_episode(spec)))
+
+    def cancel(self, episode_id: str):
+        self._client.call('cancel', episode_id)
+
+    def poll(self) -> WorkerStatus:
+        payload = decode_strings(self._client.call('poll'))
+        payload['results'] = [EpisodeResult(**result) for result in payload['results']]
+        return WorkerStatus(**payload)
+
+    def close(self):
+        self._client.close()
+
+@dataclass
+class _WorkerState:
+    worker_id: str
+    worker: object
+    capacity: int
+    # reduced capacity of a slow worker, `None` when not limited
+    limit: Optional[int] = None
+    # worker refused an episode, no more submits till the next poll
+    busy: bool = False
+    # episode id -> spec for episodes assigned to the worker
+    assigned: Dict[str, EpisodeSpec] = field(default_factory=dict)
+    # episode id -> time when the episode was assigned
+    assigned_at: Dict[str, float] = field(default_factory=dict)
+    # episode id -> steps played as of the last poll
+    progress: Dict[str, int] = field(default_factory=dict)
+    # smoothed steps per second per stepping episode, `None` until measured
+    episode_rate: Optional[float] = None
+    last_seen: float = field(default_factory=time.monotonic)
+
+    @property
+    def effective_capacity(self) -> int:
+        return self.capacity if self.limit is None else min(self.capacity, self.limit)
+
+    @property
+    def free_slots(self) -> int:
+        if self.busy:
+            return 0
+        return self.effective_capacity - len(self.assigned)
+
+    def assign(self, spec: EpisodeSpec):
+        self.assigned[spec.episode_id] = spec
+        self.assigned_at[spec.episode_id] = time.monotonic()
+
+    def unassign(self, episode_id: str) -> Optional[EpisodeSpec]:
+        self.assigned_at.pop(episode_id, None)
+        self.progress.pop(episode_id, None)
+        return self.assigned.pop(episode_id, None)
+
+class ClusterCoordinator:
+    """Schedules episodes across registered workers.
+
+    New episodes go to the worker with a free slot and the highest step rate
+    per episode. Rates only count episodes that already made steps, so
+    episodes that are still launching don't drag a worker down. A worker
+    slower than `slow_factor` of the cluster median gets its capacity
+    reduced in proportion, and gets it back once it is above
+    `recover_factor` of the median. Extra episodes of a limited worker are
+    cancelled there and re-queued, the least advanced ones first, and only
+    when they have run for at least `min_episode_seconds`. A worker that fails to respond for
+    `heartbeat_timeout` seconds is dropped and all its episodes are
+    re-queued (up to `max_attempts` times each). Results are streamed with
+    `results`.
+    """
+
+    def __init__(self,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL_SECONDS,
+                 heartbeat_timeout: float = DEFAULT_HEARTBEAT_TIMEOUT_SECONDS,
+                 slow_factor: float = DEFAULT_SLOW_FACTOR,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 recover_factor: float = DEFAULT_RECOVER_FACTOR,
+                 min_episode_seconds: float = DEFAULT_MIN_EPISODE_SECONDS):
+        assert slow_factor <= recover_factor, "Recover factor should not be below slow factor"
+        self.poll_interval = poll_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.slow_factor = slow_factor
+        self.recover_factor = recover_factor
+        self.min_episode_seconds = min_episode_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._workers = {}
+        self._pending = []
+        self._num_unfinished = 0
+        self._results = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def register(self, worker_id: str, worker, capacity: int):
+        """Adds a worker (`ClusterWorker` or `RemoteClusterWorker`)."""
+        with self._lock:
+            self._workers[worker_id] = _WorkerState(worker_id, worker, capacity)
+
+    def unregister(self, worker_id: str):
+        """Removes the worker, its episodes are re-queued."""
+        with self._lock:
+            state = self._workers.pop(worker_id, None)
+            if state is not None:
+                self._requeue(list(state.assigned.values()), failed=False)
+
+    def submit(self, spec: EpisodeSpec):
+        with self._lock:
+            self._pending.append(spec)
+            self._num_unfinished += 1
+
+    @property
+    def num_unfinished(self) -> int:
+        return self._num_unfinished
+
+    def _requeue(self, specs: List[EpisodeSpec], failed: bool, worker_id: str = "", error: str = ""):
+        for spec in specs:
+            if failed:
+                spec.attempts += 1
+                if spec.attempts >= self.max_attempts:
+                    self._finish(EpisodeResult(episode_id=spec.episode_id, worker_id=worker_id, error=error))
+                    continue
+            # re-queued episodes go first
+            self._pending.insert(0, spec)
+
+    def _finish(self, result: EpisodeResult):
+        self._num_unfinished -= 1
+        self._results.put(result)
+
+    def _poll(self, state: _WorkerState):
+        try:
+            status = state.worker.poll()
+        except Exception as e:
+            if time.monotonic() - state.last_seen > self.heartbeat_timeout:
+                logging.warning("Worker %s is not responding, re-scheduling its episodes.", state.worker_id)
+                del self._workers[state.worker_id]
+                self._requeue(list(state.assigned.values()), True, state.worker_id, f"worker died: {e}")
+            return
+        state.last_seen = time.monotonic()
+        state.busy = False
+        for result in status.results:
+            if result.error == CANCELLED:
+                # cancelled by the coordinator, already re-queued
+                continue
+            spec = state.unassign(result.episode_id)
+            if spec is None:
+                # episode was cancelled or moved to a different worker
+                continue
+            if result.ok:
+                self._finish(result)
+            else:
+                self._requeue([spec], True, state.worker_id, result.error)
+        for episode_id, steps in status.running.items():
+            if episode_id in state.assigned:
+                state.progress[episode_id] = steps
+        # episodes that are still launching don't make steps yet
+        stepping = sum(1 for steps in status.running.values() if steps > 0)
+        if stepping:
+            rate = status.step_rate / stepping
+            if state.episode_rate is None:
+                state.episode_rate = rate
+            else:
+                state.episode_rate += STEP_RATE_SMOOTHING * (rate - state.episode_rate)
+
+    def _rebalance(self):
+        rates = [s.episode_rate for s in self._workers.values() if s.episode_rate is not None]
+        if len(rates) < 2:
+            return
+        median = statistics.median(rates)
+        now = time.monotonic()
+        for state in self._workers.values():
+            if state.episode_rate is None or median <= 0:
+                continue
+            ratio = state.episode_rate / median
+            if ratio >= self.recover_factor:
+                state.limit = None
+                continue
+            if ratio < self.slow_factor:
+                state.limit = max(1, int(state.capacity * ratio))
+            num_extra = len(state.assigned) - state.effective_capacity
+            if num_extra <= 0:
+                continue
+            # cancel the least advanced episodes above reduced capacity,
+            # leaving alone those that didn't have a chance to run yet
+            candidates = sorted(
+                (episode_id for episode_id, assigned_at in state.assigned_at.items()
+                 if now - assigned_at >= self.min_episode_seconds),
+                key=lambda episode_id: state.progress.get(episode_id, 0),
+            )
+            extra = [state.unassign(episode_id) for episode_id in candidates[:num_extra]]
+            if extra:
+                logging.info("Worker %s is slow (%.2f of median rate), moving %s episodes.",
+                             state.worker_id, ratio, len(extra))
+            for spec in extra:
+                try:
+                    state.worker.cancel(spec.episode_id)
+                except Exception:
+                    logging.exception("Failed to cancel episode %s.", spec.episode_id)
+            self._requeue(extra, failed=False)
+
+    def _dispatch(self):
+        while self._pending:
+            candidates = [s for s in self._workers.values() if s.free_slots > 0]
+            if not candidates:
+                return
+            known = [s.episode_rate for s in self._workers.values() if s.episode_rate is not None]
+            default_rate = statistics.median(known) if known else 0.0
+            state = max(candidates, key=lambda s: (
+                s.episode_rate if s.episode_rate is not None else default_rate,
+                s.free_slots,
+            ))
+            spec = self._pending.pop(0)
+            try:
+                accepted = state.worker.submit(spec)
+            except Exception:
+                logging.exception("Failed to submit episode to worker %s.", state.worker_id)
+                accepted = False
+            if not accepted:
+                # worker is busy (or unreachable), skip it till the next tick
+                self._pending.insert(0, spec)
+                state.busy = True
+                continue
+            state.assign(spec)
+
+    def tick(self):
+        """Polls workers, rebalances and assigns queued episodes."""
+        with self._lock:
+            for state in list(self._workers.values()):
+                self._poll(state)
+            self._rebalance()
+            self._dispatch()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.tick()
+            self._stopped.wait(self.poll_interval)
+
+    def start(self) -> 'ClusterCoordinator':
+        """Runs scheduling loop in a background thread."""
+        self._thread = threading.Thread(target=self._run, name="ClusterCoordinator", daemon=True)
+        self._thread.start()
+        return self
+
+    def results(self, timeout: Optional[float] = None) -> Iterator[EpisodeResult]:
+        """Yields results as soon as episodes finish, until all submitted
+        episodes are done. Requires the coordinator to be started."""
+        while self._num_unfinished > 0 or not self._results.empty():
+            try:
+                yield self._results.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No episode finished within {timeout}s")
+
+    def run(self, specs: List[EpisodeSpec], timeout: Optional[float] = None) -> Iterator[EpisodeResult]:
+        for spec in specs:
+            self.submit(spec)
+        return self.results(timeout)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Stops scheduling and cancels episodes that are still running."""
+        self.stop()
+        with self._lock:
+            for state in self._workers.values():
+                for episode_id in state.assigned:
+                    try:
+                        state.worker.cancel(episode_id)
+                    except Exception:
+                        logging.exception("Failed to cancel episode %s.", episode_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _exception_traceback):
+        self.close()
@@ -0,0 +1,223 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Containers for observations collected from the game."""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pyage2.lib.expert import MapTiles, ObservationLayout, QueryPlan
+
+# observations reported by autogame rather than expert facts
+EXTRA_FIELDS = ('alive', 'winning')
+
+class ObservationBatch:
+    """Observations for all players in "struct of arrays" layout.
+
+    All fact results live in a single int32 buffer, where each field is
+    a contiguous array of shape (num_players, *field_shape), e.g.
+    `batch['can_train']` has shape (num_players, len(ObjectType)). Scalar
+    fields have shape (num_players,).
+
+    Indexing with an integer returns dict of observations for a single
+    player (as views into the batch), so the batch could be used anywhere
+    a list of per-player observations was expected.
+    """
+
+    def __init__(self,
+                 layout: ObservationLayout,
+                 num_players: int,
+                 tiles: Optional[MapTiles] = None,
+                 data: Optional[np.ndarray] = None):
+        self.layout = layout
+        self.num_players = num_players
+        self.tiles = tiles
+        # steps since each field was polled, empty when all fields are fresh
+        self.age = {}
+        if data is None:
+            data = np.zeros(layout.size * num_players, dtype=np.int32)
+        self.data = data
+        self.fields = {}
+        for name, (offset, shape) in layout.fields.items():
+            field_size = int(np.prod(shape))
+            field_shape = (num_players,) if shape == (1,) else (num_players,) + shape
+            start = offset * num_players
+            self.fields[name] = self.data[start:start+field_size*num_players].reshape(field_shape)
+        for name in EXTRA_FIELDS:
+            self.fields[name] = np.zeros(num_players, dtype=np.int32)
+
+    @classmethod
+    def decode(cls,
+               layout: ObservationLayout,
+               plans: List[QueryPlan],
+               responses: List[Any],
+               tiles: Optional[MapTiles] = None,
+               base: Optional['ObservationBatch'] = None) -> 'ObservationBatch':
+        """Decodes responses for all players directly into a new batch.
+        Plans are expected to be ordered by player id. When `base` is given,
+        values not covered by plans are carried over from it."""
+        data = base.data.copy() if base is not None else None
+        batch = cls(layout, len(plans), tiles, data)
+        index = layout.batch_index(len(plans))
+        for player, (plan, response) in enumerate(zip(plans, responses)):
+            batch.data[index[player, plan.offsets]] = plan.results(response)
+        return batch
+
+    def copy(self) -> 'ObservationBatch':
+        batch = ObservationBatch(self.layout, self.num_players, self.tiles, self.data.copy())
+        batch.age = dict(self.age)
+        for name in EXTRA_FIELDS:
+            batch.fields[name][:] = self.fields[name]
+        return batch
+
+    def player(self, index: int) -> Dict[str, Any]:
+        """Returns observations for a single player (0-based index)."""
+        obs = {name: values[index] for name, values in self.fields.items()}
+        obs['tiles'] = self.tiles
+        return obs
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.fields[key]
+        return self.player(key)
+
+    def __len__(self):
+        return self.num_players
+
+    def __iter__(self):
+        return (self.player(index) for index in range(self.num_players))
+
+    def __repr__(self):
+        return f"ObservationBatch[players={self.num_players}, fields={len(self.fields)}]"
+
+
+@dataclass
+class ObservationDelta:
+    """Changes in observations since the previous step.
+
+    `indices` are positions in `ObservationBatch.data` buffer that changed,
+    `values` are new values for those positions. Each `snapshot_interval`
+    steps the delta carries full `snapshot` instead, so the receiver could
+    (re)synchronize its state. Use `DeltaDecoder` to reconstruct batches.
+    """
+    step: int
+    indices: np.ndarray
+    values: np.ndarray
+    extras: Dict[str, np.ndarray] = field(default_factory=dict)
+    snapshot: Optional[ObservationBatch] = None
+
+    @property
+    def is_snapshot(self):
+        return self.snapshot is not None
+
+    def changes(self, layout: ObservationLayout, num_players: int) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Splits changes per field. Indices are given into the flattened
+        (num_players, *field_shape) array of the field."""
+        changes = {}
+        for name, (offset, shape) in layout.fields.items():
+            start = offset * num_players
+            end = start + int(np.prod(shape)) * num_players
+            lo, hi = np.searchsorted(self.indices, [start, end])
+            if lo < hi:
+                changes[name] = (self.indices[lo:hi] - start, self.values[lo:hi])
+        return changes
+
+    def __repr__(self):
+        kind = "snapshot" if self.is_snapshot else f"changes={len(self.indices)}"
+        return f"ObservationDelta[step={self.step}, {kind}]"
+
+class DeltaEncoder:
+    """Tracks the last observed batch and emits only changed values,
+    with a full snapshot every `snapshot_interval` steps."""
+
+    def __init__(self, snapshot_interval: int):
+        assert snapshot_interval > 0, "snapshot_interval should be positive"
+        self.snapshot_interval = snapshot_interval
+        self.reset()
+
+    def reset(self):
+        self._last = None
+        self._step = 0
+
+    def encode(self, batch: ObservationBatch) -> ObservationDelta:
+        extras = {name: batch.fields[name].copy() for name in EXTRA_FIELDS}
+        if self._last is None or self._step % self.snapshot_interval == 0:
+            delta = ObservationDelta(
+                step=self._step,
+                indices=np.empty(0, dtype=np.intp),
+                values=np.empty(0, dtype=np.int32),
+                extras=extras,
+                snapshot=batch,
+            )
+        else:
+            indices = np.flatnonzero(batch.data != self._last)
+            delta = ObservationDelta(
+                step=self._step,
+                indices=indices,
+                values=batch.data[indices],
+                extras=extras,
+            )
+        self._last = batch.data.copy()
+        self._step += 1
+        return delta
+
+class DeltaDecoder:
+    """Client side counterpart of `DeltaEncoder`, reconstructs full batches."""
+
+    def __init__(self):
+        self._batch = None
+
+    def apply(self, delta: ObservationDelta) -> ObservationBatch:
+        """Applies delta to the last known state, returns new batch (previously
+        returned batches are never modified)."""
+        if delta.is_snapshot:
+            batch = delta.snapshot.copy()
+        elif self._batch is None:
+            raise ValueError("Delta received before the first snapshot.")
+        else:
+            batch = self._batch.copy()
+            batch.data[delta.indices] = delta.values
+        for name, values in delta.extras.items():
+            batch.fields[name][:] = values
+        self._batch = batch
+        return batch
+
+def row_size(layout: ObservationLayout, num_players: int) -> int:
+    """Each env owns a row of the shared block: `ObservationBatch.data`
+    followed by extra (autogame) fields."""
+    return (layout.size + len(EXTRA_FIELDS)) * num_players
+
+def write_row(row: np.ndarray, batch: ObservationBatch):
+    size = batch.data.size
+    row[:size] = batch.data
+    for i, name in enumerate(EXTRA_FIELDS):
+        start = size + i*batch.num_players
+        row[start:start+batch.num_players] = batch.fields[name]
+
+class VisibilityTracker:
+    """Detects visibility refreshes, so updated tiles are only sent when
+    they have changed."""
+
+    def __init__(self):
+        self._last = None
+
+    def changed(self, batch: ObservationBatch) -> Optional[np.ndarray]:
+        if batch.tiles is None:
+            return None
+        visibility = batch.tiles.visibility
+        if self._last is not None and np.array_equal(self._last, visibility):
+            return None
+        self._last = visibility.copy()
+        return self._last
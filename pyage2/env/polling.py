@@ -0,0 +1,70 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Schedules for polling observation fields at different rates."""
+
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable
+
+@dataclass
+class PollSchedule:
+    """Defines how often each observation field should be queried from the game.
+
+    Periods are given either in env steps (`steps`) or in game seconds
+    (`game_seconds`), a field listed in both is polled when either period
+    has passed. Fields that are not listed are polled on each step. Values
+    for fields that are not due are served from the previous observation.
+
+        PollSchedule(
+            steps={'resource_found': 50, 'can_build': 10},
+            game_seconds={'current_age': 5.0},
+        )
+    """
+    steps: Dict[str, int] = field(default_factory=dict)
+    game_seconds: Dict[str, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        for name, period in self.steps.items():
+            assert period > 0, f"Poll period for '{name}' should be positive"
+        for name, period in self.game_seconds.items():
+            assert period > 0, f"Poll period for '{name}' should be positive"
+        self.reset()
+
+    def reset(self):
+        """Forgets all previous polls, so all fields become due."""
+        self._last_step = {}
+        self._last_game_time = {}
+
+    def is_due(self, name: str, step: int, game_time: float) -> bool:
+        last_step = self._last_step.get(name)
+        if last_step is None:
+            return True
+        if name not in self.steps and name not in self.game_seconds:
+            return True
+        if name in self.steps and step - last_step >= self.steps[name]:
+            return True
+        if name in self.game_seconds and game_time - self._last_game_time[name] >= self.game_seconds[name]:
+            return True
+        return False
+
+    def due(self, fields: Iterable[str], step: int, game_time: float) -> FrozenSet[str]:
+        """Returns fields that have to be polled on a given step and marks them as polled."""
+        due = frozenset(name for name in fields if self.is_due(name, step, game_time))
+        for name in due:
+            self._last_step[name] = step
+            self._last_game_time[name] = game_time
+        return due
+
+    def age(self, name: str, step: int) -> int:
+        """Number of steps since the field was polled last time."""
+        return step - self._last_step.get(name, step)
@@ -0,0 +1,261 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Non-blocking real-time mode: the game ticks on its own, agents act
+whenever they are ready."""
+
+from dataclasses import dataclass
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from pyage2.env.age2_env import Age2Env
+from pyage2.env.core import Agent, Step
+
+DEFAULT_TICK_INTERVAL_SECONDS = 0.1
+
+@dataclass
+class Snapshot:
+    """Observation published by the env at a given tick."""
+    version: int
+    observation: Any
+    info: Dict
+    game_time: float
+    done: bool = False
+    # set when the game loop or one of the agents has failed
+    error: Optional[BaseException] = None
+
+class ObservationSlot:
+    """Latest-value slot. Publishing overwrites the previous value, readers
+    always get the newest one (older values are never queued)."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._snapshot = None
+
+    def publish(self, snapshot: Snapshot):
+        with self._cond:
+            self._snapshot = snapshot
+            self._cond.notify_all()
+
+    def latest(self) -> Optional[Snapshot]:
+        with self._cond:
+            return self._snapshot
+
+    def wait(self, after_version: int = -1, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        """Waits for a snapshot newer than `after_version`, returns `None`
+        on timeout."""
+        with self._cond:
+            newer = lambda: self._snapshot is not None and self._snapshot.version > after_version
+            if not self._cond.wait_for(newer, timeout):
+                return None
+            return self._snapshot
+
+@dataclass
+class _Decision:
+    actions: List
+    # game time of the observation the decision was based on
+    observed_at: float
+
+@dataclass
+class DecisionLatency:
+    """Game-seconds between the observation and applying actions based on it."""
+    last: float = 0.0
+    total: float = 0.0
+    count: int = 0
+    max: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def add(self, latency: float):
+        self.last = latency
+        self.total += latency
+        self.count += 1
+        self.max = max(self.max, latency)
+
+class RealTimeAge2Env:
+    """Steps the environment each `tick_interval` seconds regardless of agents.
+
+    Each tick publishes observations into `slot`. Agents read the latest
+    snapshot, think as long as they need to, and `submit` actions referring
+    to the snapshot they have used. On the next tick the env applies all
+    actions that are ready (an agent that is still thinking simply skips
+    the tick), and `info['decision_latency']` reports game-seconds between
+    the observation and the moment actions were applied for each player.
+
+    When the game loop or an attached agent fails, a done snapshot carrying
+    the error is published and ticking stops. The error is re-raised from
+    the next `tick`, `join` or `close` (only once).
+    """
+
+    def __init__(self, env: Age2Env, tick_interval: float = DEFAULT_TICK_INTERVAL_SECONDS):
+        self.env = env
+        self.tick_interval = tick_interval
+        self.slot = ObservationSlot()
+        self.latency = {}
+        self._lock = threading.Lock()
+        self._decisions = {}
+        self._version = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._agent_threads = []
+        self.error = None
+        self._error_raised = False
+
+    def reset(self) -> Snapshot:
+        obs, info = self.env.reset()
+        with self._lock:
+            self._decisions = {}
+            self._version += 1
+        snapshot = Snapshot(self._version, obs, info, info['game_time'])
+        self.slot.publish(snapshot)
+        return snapshot
+
+    def submit(self, player_id: int, actions: List, snapshot: Snapshot):
+        """Queues actions decided upon `snapshot`, to be applied on the next
+        tick. Actions submitted earlier within the same tick are kept."""
+        with self._lock:
+            decision = self._decisions.get(player_id)
+            if decision is None:
+                self._decisions[player_id] = _Decision(list(actions), snapshot.game_time)
+            else:
+                decision.actions.extend(actions)
+                decision.observed_at = min(decision.observed_at, snapshot.game_time)
+
+    def _fail(self, error: BaseException):
+        """Records the first error, stops ticking and publishes a done
+        snapshot, so agents waiting for observations wake up."""
+        with self._lock:
+            if self.error is not None:
+                return
+            self.error = error
+            self._version += 1
+            version = self._version
+        self._stopped.set()
+        latest = self.slot.latest()
+        if latest is None:
+            snapshot = Snapshot(version, None, {}, 0.0, True, error)
+        else:
+            snapshot = Snapshot(version, latest.observation, latest.info, latest.game_time, True, error)
+        self.slot.publish(snapshot)
+
+    def _raise_error(self):
+        if self.error is not None and not self._error_raised:
+            self._error_raised = True
+            raise self.error
+
+    def tick(self) -> Snapshot:
+        """Applies ready actions and publishes fresh observations."""
+        self._raise_error()
+        return self._tick()
+
+    def _tick(self) -> Snapshot:
+        with self._lock:
+            decisions, self._decisions = self._decisions, {}
+        actions = [(player_id, decision.actions) for player_id, decision in decisions.items()]
+        obs, _reward, done, info = self.env.step(actions)
+        game_time = info['game_time']
+        decision_latency = {}
+        for player_id, decision in decisions.items():
+            latency = max(0.0, game_time - decision.observed_at)
+            self.latency.setdefault(player_id, DecisionLatency()).add(latency)
+            decision_latency[player_id] = latency
+        info = dict(info, decision_latency=decision_latency)
+        with self._lock:
+            self._version += 1
+            snapshot = Snapshot(self._version, obs, info, game_time, done)
+        self.slot.publish(snapshot)
+        return snapshot
+
+    def _run(self):
+        next_tick = time.monotonic()
+        try:
+            while not self._stopped.is_set():
+                snapshot = self._tick()
+                if snapshot.done:
+                    break
+                next_tick += self.tick_interval
+                self._stopped.wait(max(0.0, next_tick - time.monotonic()))
+        except Exception as e:
+            logging.exception("Real-time loop failed.")
+            self._fail(e)
+
+    def start(self) -> 'RealTimeAge2Env':
+        """Resets the env (unless already done) and starts ticking in a
+        background thread."""
+        if self.slot.latest() is None:
+            self.reset()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="RealTimeAge2Env", daemon=True)
+        self._thread.start()
+        return self
+
+    def _agent_loop(self, agent: Agent, timeout: float):
+        version, reward = 0, 0
+        try:
+            while not self._stopped.is_set():
+                snapshot = self.slot.wait(version, timeout)
+                if snapshot is None:
+                    continue
+                if snapshot.done:
+                    break
+                version = snapshot.version
+                agent_obs = snapshot.observation[agent.player_id-1]
+                agent_obs.update(snapshot.info)
+                actions = agent.instance.step(Step(observation=agent_obs, reward=reward, discount=0.))
+                self.submit(agent.player_id, actions, snapshot)
+        except Exception as e:
+            logging.exception("Agent %s failed in real-time loop.", agent.player_id)
+            self._fail(e)
+
+    def attach(self, agent: Agent, timeout: float = 1.0):
+        """Runs the agent in its own thread: it takes the latest observation,
+        decides and submits actions, then waits for a newer observation."""
+        thread = threading.Thread(
+            target=self._agent_loop,
+            args=(agent, timeout),
+            name=f"RealTimeAgent-{agent.player_id}",
+            daemon=True,
+        )
+        self._agent_threads.append(thread)
+        thread.start()
+
+    def join(self, timeout: Optional[float] = None) -> Snapshot:
+        """Waits for the game to finish, returns the last snapshot."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._raise_error()
+        return self.slot.latest()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for thread in self._agent_threads:
+            thread.join()
+        self._agent_threads = []
+
+    def close(self):
+        self.stop()
+        self.env.close()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _exception_traceback):
+        self.close()
@@ -0,0 +1,229 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Serving environments over the network and connecting to them remotely.
+
+`Age2EnvServer` runs on the game host and exposes its environments via
+msgpack-rpc, `RemoteAge2Env` mirrors `Age2Env` interface on the other end.
+Observations travel as raw int32 buffers (see `ObservationBatch.data`), map
+tiles are only sent on reset and when visibility has changed.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import msgpackrpc
+import numpy as np
+
+import pyage2.expert.action.action_pb2 as action
+from pyage2.env.age2_env import Age2Env
+from pyage2.env.core import BaseEnv
+from pyage2.env.observations import EXTRA_FIELDS, ObservationBatch, VisibilityTracker, row_size, write_row
+from pyage2.lib import actions
+from pyage2.lib.expert import MapTiles, ObservationLayout
+from pyage2.lib.rpc import RpcServer, decode_strings
+
+DEFAULT_REMOTE_TIMEOUT_SECONDS = 60
+
+ARG_TYPES = {'int': int}
+
+def _encode_array(values: np.ndarray) -> List:
+    return [values.dtype.str, list(values.shape), values.tobytes()]
+
+def _decode_array(payload) -> np.ndarray:
+    dtype, shape, data = payload
+    return np.frombuffer(data, dtype=np.dtype(decode_strings(dtype))).reshape(shape).copy()
+
+def _encode_tiles(tiles: Optional[MapTiles]) -> Optional[List]:
+    if tiles is None:
+        return None
+    return [_encode_array(tiles.height), _encode_array(tiles.terrain), _encode_array(tiles.visibility)]
+
+def _decode_tiles(payload) -> Optional[MapTiles]:
+    if payload is None:
+        return None
+    height, terrain, visibility = payload
+    return MapTiles(_decode_array(height), _decode_array(terrain), _decode_array(visibility))
+
+def _encode_actions(player_actions: List[Tuple[int, List[Any]]]) -> List:
+    return [
+        [player_id, [[type(a).DESCRIPTOR.name, a.SerializeToString()] for a in commands if a is not None]]
+        for player_id, commands in player_actions
+    ]
+
+def _decode_actions(payload) -> List[Tuple[int, List[Any]]]:
+    return [
+        (player_id, [getattr(action, decode_strings(name)).FromString(data) for name, data in commands])
+        for player_id, commands in payload
+    ]
+
+class _Handler:
+    """msgpack-rpc dispatcher, every public method is an RPC."""
+
+    def __init__(self, server: 'Age2EnvServer'):
+        self._server = server
+
+    def spec(self):
+        return self._server._spec()
+
+    def reset(self, env_ids):
+        return self._server._batch(self._server._reset, env_ids, [None] * len(env_ids))
+
+    def step(self, env_ids, player_actions):
+        return self._server._batch(self._server._step, env_ids, player_actions)
+
+class Age2EnvServer(RpcServer):
+    """Serves environments to remote clients (see `RemoteAge2Env`).
+
+    Each `reset` and `step` request carries a batch of env ids, environments
+    within the batch are stepped concurrently. Any object with `Age2Env`
+    interface could be served, e.g. an env running on a fake process backend
+    (`pyage2.lib.testing.FakeProcessBackend`).
+
+    When `port` is not given, a free one is reserved (see `reserve_ports`).
+    """
+
+    def __init__(self,
+                 envs: Sequence[Age2Env],
+                 host: str = "127.0.0.1",
+                 port: Optional[int] = None,
+                 close_envs: bool = True):
+        assert envs, "At least one environment is required"
+        self._envs = list(envs)
+        self._close_envs = close_envs
+        num_players = {len(env.game_config.players) for env in self._envs}
+        assert len(num_players) == 1, "All environments should have the same number of players"
+        self.num_players = num_players.pop()
+        self._layout = ObservationLayout(self._envs[0].observation_spec())
+        self._row_size = row_size(self._layout, self.num_players)
+        self._visibility = [VisibilityTracker() for _ in self._envs]
+        self._executor = ThreadPoolExecutor(max_workers=len(self._envs))
+        super().__init__(_Handler(self), host, port)
+        logging.info("Serving %s environments on %s:%s", len(self._envs), self.host, self.port)
+
+    def _spec(self):
+        fields = [[name, list(shape)] for name, (_, shape) in self._layout.fields.items()]
+        action_spec = [
+            [fn.__name__, [arg.__name__ for arg in args]]
+            for fn, args in self._envs[0].action_spec()
+        ]
+        return {
+            'num_envs': len(self._envs),
+            'num_players': self.num_players,
+            'fields': fields,
+            'actions': action_spec,
+        }
+
+    def _encode_observation(self, obs: ObservationBatch) -> bytes:
+        row = np.empty(self._row_size, dtype=np.int32)
+        write_row(row, obs)
+        return row.tobytes()
+
+    def _reset(self, env_id: int, _payload):
+        obs, info = self._envs[env_id].reset()
+        self._visibility[env_id] = VisibilityTracker()
+        self._visibility[env_id].changed(obs)
+        return [info, self._encode_observation(obs), _encode_tiles(obs.tiles)]
+
+    def _step(self, env_id: int, payload):
+        obs, reward, done, info = self._envs[env_id].step(_decode_actions(payload))
+        visibility = self._visibility[env_id].changed(obs)
+        if visibility is not None:
+            visibility = _encode_array(visibility)
+        return [reward, done, info, self._encode_observation(obs), visibility]
+
+    def _batch(self, fn, env_ids, payloads):
+        futures = [self._executor.submit(fn, env_id, payload) for env_id, payload in zip(env_ids, payloads)]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Stops serving, closes environments (unless `close_envs` is off)
+        and releases the port."""
+        super().close()
+        self._executor.shutdown(wait=True)
+        if self._close_envs:
+            for env in self._envs:
+                env.close()
+
+class RemoteAge2Env(BaseEnv):
+    """Client for an environment served by `Age2EnvServer`, with the same
+    interface as `Age2Env`. `reset_many` and `step_many` drive a batch of
+    environments of the server in a single request."""
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 env_id: int = 0,
+                 timeout: int = DEFAULT_REMOTE_TIMEOUT_SECONDS):
+        self._client = None
+        self._client = msgpackrpc.Client(msgpackrpc.Address(host, port), timeout=timeout)
+        self.env_id = env_id
+        spec = decode_strings(self._client.call('spec'))
+        self.num_envs = spec['num_envs']
+        assert 0 <= env_id < self.num_envs, f"Server has {self.num_envs} environments"
+        self.num_players = spec['num_players']
+        self._observation_spec = {name: tuple(shape) for name, shape in spec['fields']}
+        self._observation_spec['tiles'] = MapTiles
+        self._action_spec = [
+            (getattr(actions, name), [ARG_TYPES[arg] for arg in args])
+            for name, args in spec['actions']
+        ]
+        self._layout = ObservationLayout(self._observation_spec)
+        self._tiles = {}
+
+    def _observation(self, env_id: int, data: bytes) -> ObservationBatch:
+        row = np.frombuffer(data, dtype=np.int32)
+        size = self._layout.size * self.num_players
+        batch = ObservationBatch(self._layout, self.num_players, self._tiles.get(env_id), row[:size].copy())
+        for i, name in enumerate(EXTRA_FIELDS):
+            start = size + i*self.num_players
+            batch.fields[name][:] = row[start:start+self.num_players]
+        return batch
+
+    def reset_many(self, env_ids: Sequence[int]) -> List[Tuple[ObservationBatch, Dict]]:
+        """Resets given environments, returns (observations, info) for each."""
+        results = []
+        for env_id, (info, data, tiles) in zip(env_ids, self._client.call('reset', list(env_ids))):
+            self._tiles[env_id] = _decode_tiles(tiles)
+            results.append((self._observation(env_id, data), decode_strings(info)))
+        return results
+
+    def step_many(self, player_actions: Sequence[Any], env_ids: Sequence[int]) -> List[Tuple]:
+        """Steps given environments, returns (observations, reward, done, info)
+        for each."""
+        payload = [_encode_actions(env_actions) for env_actions in player_actions]
+        results = []
+        for env_id, (reward, done, info, data, visibility) in zip(env_ids, self._client.call('step', list(env_ids), payload)):
+            tiles = self._tiles.get(env_id)
+            if visibility is not None and tiles is not None:
+                tiles.update_visibility(_decode_array(visibility))
+            results.append((self._observation(env_id, data), reward, done, decode_strings(info)))
+        return results
+
+    def reset(self):
+        return self.reset_many([self.env_id])[0]
+
+    def step(self, actions):
+        return self.step_many([actions], [self.env_id])[0]
+
+    def observation_spec(self):
+        return self._observation_spec
+
+    def action_spec(self):
+        return self._action_spec
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
@@ -0,0 +1,142 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tracks research status for all players to avoid polling every tech on each step."""
+
+from typing import List, Optional
+
+import numpy as np
+
+from pyage2.env.observations import ObservationBatch
+from pyage2.lib.expert import Facts, ObjectType, ObservationLayout, QueryPlan, ResearchStatus, TechType
+
+import pyage2.expert.fact.fact_pb2 as fact
+
+# techs that were unavailable are re-scanned every so many steps
+DEFAULT_RESCAN_INTERVAL = 100
+
+# buildings that unlock techs, a new one triggers re-scan of unavailable techs
+RESEARCH_BUILDINGS = (
+    ObjectType.ARCHERY_RANGE,
+    ObjectType.BARRACKS,
+    ObjectType.BLACKSMITH,
+    ObjectType.CASTLE,
+    ObjectType.DOCK,
+    ObjectType.HARBOR,
+    ObjectType.LUMBER_CAMP,
+    ObjectType.MARKET,
+    ObjectType.MILL,
+    ObjectType.MINING_CAMP,
+    ObjectType.MONASTERY,
+    ObjectType.SIEGE_WORKSHOP,
+    ObjectType.STABLE,
+    ObjectType.TOWN_CENTER,
+    ObjectType.UNIVERSITY,
+)
+
+def research_status_facts() -> Facts:
+    return [
+        (f"research_status.{i}", fact.UpResearchStatus(inConstTechId=tech_id.value), fact.UpResearchStatusResult)
+        for i, tech_id in enumerate(TechType)
+    ]
+
+class ResearchTracker:
+    """Keeps track of `UpResearchStatus` for each tech and each player.
+
+    All techs are scanned at the beginning of the episode. After that,
+    techs that are available or pending are re-polled on each step, and
+    `CanResearch` is queried only for techs that are not yet researched.
+    Unavailable techs are re-scanned when `current_age` or the number of
+    buildings in `RESEARCH_BUILDINGS` changes, every `rescan_interval`
+    steps, and right after `can_research` reports them as researchable.
+
+    Reported statuses are always the ones polled from the game (possibly
+    a few steps old for techs that were not re-polled), so tracking works
+    for bots as well as for agents.
+    """
+
+    def __init__(self,
+                 num_players: int,
+                 can_research_facts: Facts,
+                 rescan_interval: Optional[int] = DEFAULT_RESCAN_INTERVAL):
+        self.num_players = num_players
+        self.rescan_interval = rescan_interval
+        self._can_research_facts = can_research_facts
+        self._status_facts = research_status_facts()
+        self._building_index = np.array(
+            [ObjectType.__members_position__[building] for building in RESEARCH_BUILDINGS])
+        self.reset()
+
+    def reset(self):
+        """Schedules full scan for all players."""
+        self.status = np.full((self.num_players, len(TechType)), ResearchStatus.UNAVAILABLE, dtype=np.int32)
+        self._rescan = np.ones((self.num_players, len(TechType)), dtype=bool)
+        self._current_age = [None] * self.num_players
+        self._buildings: List[Optional[np.ndarray]] = [None] * self.num_players
+        self._steps = 0
+        self._plans: List[Optional[QueryPlan]] = [None] * self.num_players
+        self._polled: List[np.ndarray] = [self._polled_techs(index) for index in range(self.num_players)]
+
+    def _polled_techs(self, index: int) -> np.ndarray:
+        status = self.status[index]
+        return np.flatnonzero((status != ResearchStatus.COMPLETE) & (
+            self._rescan[index] | (status == ResearchStatus.AVAILABLE) | (status == ResearchStatus.PENDING)))
+
+    def plan(self, player_id: int, layout: ObservationLayout) -> QueryPlan:
+        """Returns research facts to be queried for a given player on this step."""
+        index = player_id - 1
+        plan = self._plans[index]
+        if plan is None:
+            not_complete = np.flatnonzero(self.status[index] != ResearchStatus.COMPLETE)
+            facts = [self._status_facts[i] for i in self._polled[index]] + \
+                [self._can_research_facts[i] for i in not_complete]
+            plan = QueryPlan(player_id, facts, layout)
+            self._plans[index] = plan
+        return plan
+
+    def observe(self, batch: ObservationBatch):
+        """Updates statuses from freshly decoded batch, fills in statuses for
+        techs that were not polled on this step and schedules re-scans."""
+        research_status = batch['research_status']
+        can_research = batch['can_research']
+        current_age = batch['current_age']
+        buildings = batch['object_count'][:, self._building_index]
+        self._steps += 1
+        periodic = self.rescan_interval is not None and self._steps % self.rescan_interval == 0
+        for index in range(self.num_players):
+            status = self.status[index]
+            polled = self._polled[index]
+            status[polled] = research_status[index, polled]
+            # researched techs are dropped from the query
+            can_research[index, status == ResearchStatus.COMPLETE] = 0
+            research_status[index] = status
+
+            age_changed = self._current_age[index] is not None and self._current_age[index] != current_age[index]
+            self._current_age[index] = current_age[index]
+            buildings_changed = self._buildings[index] is not None and \
+                not np.array_equal(self._buildings[index], buildings[index])
+            self._buildings[index] = buildings[index].copy()
+
+            rescan = self._rescan[index]
+            if age_changed or buildings_changed or periodic:
+                rescan[:] = True
+            else:
+                # status of techs researchable right now is confirmed
+                # by polling them on the next step
+                rescan[:] = (can_research[index] != 0) & (status == ResearchStatus.UNAVAILABLE)
+
+            next_polled = self._polled_techs(index)
+            if self._plans[index] is None or not np.array_equal(polled, next_polled) or \
+                    np.any(status[polled] == ResearchStatus.COMPLETE):
+                self._plans[index] = None
+            self._polled[index] = next_polled
@@ -0,0 +1,251 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Gymnasium spaces and flat-vector encoding for observations and actions.
+
+`FlatObservationEncoder` works with NumPy only, `observation_space` and
+`action_space` require optional `gymnasium` dependency.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pyage2.env.observations import EXTRA_FIELDS, ObservationBatch
+from pyage2.lib.expert import AGE, ObjectType, ResearchStatus, StrategicNumber, TechType
+
+try:
+    import gymnasium
+    from gymnasium import spaces
+except ImportError:
+    gymnasium = None
+
+INT32_MIN = int(np.iinfo(np.int32).min)
+INT32_MAX = int(np.iinfo(np.int32).max)
+
+# side of the giant map, the largest one
+DEFAULT_MAX_MAP_SIZE = (240, 240)
+TILE_FIELDS = ('height', 'terrain', 'visibility')
+# tiles outside of the actual map (padding)
+TILE_PADDING = -1
+
+# (low, high) for fields with known range, everything else is int32
+FIELD_BOUNDS = {
+    'current_age': (int(min(AGE)), int(max(AGE))),
+    'can_research': (0, 1),
+    'can_train': (0, 1),
+    'can_build': (0, 1),
+    'research_status': (int(min(ResearchStatus)), int(max(ResearchStatus))),
+    'resource_found': (0, 1),
+    'alive': (0, 1),
+    'winning': (0, 1),
+    'map_size': (0, INT32_MAX),
+    'height': (TILE_PADDING, 255),
+    'terrain': (TILE_PADDING, 255),
+    'visibility': (TILE_PADDING, INT32_MAX),
+}
+
+# choices for each argument of the action, action arguments are given
+# as indices into these lists
+DEFAULT_SN_VALUES = 256
+ACTION_ARGS = {
+    'no_op': [],
+    'attack_now': [],
+    'set_strategic_number': [list(StrategicNumber), list(range(DEFAULT_SN_VALUES))],
+    'research': [list(TechType)],
+    'build': [list(ObjectType)],
+    'train': [list(ObjectType)],
+}
+
+def _require_gymnasium():
+    if gymnasium is None:
+        raise ImportError("gymnasium is required for spaces, install with `pip install pyage2[gym]`")
+
+class FlatObservationEncoder:
+    """Packs `ObservationBatch` into a single flat int32 vector.
+
+    The vector starts with `ObservationBatch.data` as is, followed by extra
+    fields, the actual map size and tiles grids padded to `max_map_size`.
+    `offsets` maps each field to (start, shape) within the vector, shapes
+    include players dimension, e.g. (num_players, len(ObjectType)).
+    """
+
+    def __init__(self,
+                 observation_spec: Dict,
+                 num_players: int,
+                 max_map_size: Tuple[int, int] = DEFAULT_MAX_MAP_SIZE,
+                 include_tiles: bool = True):
+        self.num_players = num_players
+        self.max_map_size = tuple(max_map_size)
+        self.include_tiles = include_tiles
+        self.offsets = {}
+        size = 0
+        # same order as `ObservationLayout`, so batch data is copied at once
+        for name, shape in observation_spec.items():
+            if not isinstance(shape, tuple): continue
+            field_shape = (num_players,) if shape == (1,) else (num_players,) + shape
+            self.offsets[name] = (size, field_shape)
+            size += int(np.prod(field_shape))
+        self._data_size = size
+        for name in EXTRA_FIELDS:
+            self.offsets[name] = (size, (num_players,))
+            size += num_players
+        if include_tiles:
+            self.offsets['map_size'] = (size, (2,))
+            size += 2
+            for name in TILE_FIELDS:
+                self.offsets[name] = (size, self.max_map_size)
+                size += self.max_map_size[0] * self.max_map_size[1]
+        self.size = size
+
+        self.low = np.full(size, INT32_MIN, dtype=np.int32)
+        self.high = np.full(size, INT32_MAX, dtype=np.int32)
+        for name, (start, shape) in self.offsets.items():
+            if name in FIELD_BOUNDS:
+                end = start + int(np.prod(shape))
+                self.low[start:end], self.high[start:end] = FIELD_BOUNDS[name]
+
+    def allocate(self, *batch_shape) -> np.ndarray:
+        return np.zeros(batch_shape + (self.size,), dtype=np.int32)
+
+    def encode(self, batch: ObservationBatch, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if out is None:
+            out = self.allocate()
+        out[:self._data_size] = batch.data
+        for name in EXTRA_FIELDS:
+            start, _ = self.offsets[name]
+            out[start:start+self.num_players] = batch.fields[name]
+        if self.include_tiles:
+            start, _ = self.offsets['map_size']
+            tiles = batch.tiles
+            if tiles is None:
+                out[start:start+2] = 0
+            else:
+                map_height, map_width = tiles.shape
+                assert map_height <= self.max_map_size[0] and map_width <= self.max_map_size[1], \
+                    f"Map {tiles.shape} does not fit into {self.max_map_size}"
+                out[start:start+2] = tiles.shape
+            for name in TILE_FIELDS:
+                start, shape = self.offsets[name]
+                grid = out[start:start+shape[0]*shape[1]].reshape(shape)
+                grid[:] = TILE_PADDING
+                if tiles is not None:
+                    grid[:map_height, :map_width] = getattr(tiles, name)
+        return out
+
+    def encode_many(self, batches: Sequence[ObservationBatch], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Encodes batches into rows of (len(batches), size) array."""
+        if out is None:
+            out = self.allocate(len(batches))
+        for row, batch in zip(out, batches):
+            self.encode(batch, row)
+        return out
+
+    def decode(self, flat: np.ndarray) -> Dict[str, np.ndarray]:
+        """Splits flat vector (or array of them, with any leading dimensions)
+        into fields. Arrays are views into `flat`."""
+        batch_shape = flat.shape[:-1]
+        return {
+            name: flat[..., start:start+int(np.prod(shape))].reshape(batch_shape + shape)
+            for name, (start, shape) in self.offsets.items()
+        }
+
+    def space(self):
+        """`Dict` space of `Box`es, matching `decode` output."""
+        _require_gymnasium()
+        fields = {}
+        for name, (start, shape) in self.offsets.items():
+            end = start + int(np.prod(shape))
+            fields[name] = spaces.Box(
+                low=self.low[start:end].reshape(shape),
+                high=self.high[start:end].reshape(shape),
+                dtype=np.int32,
+            )
+        return spaces.Dict(fields)
+
+    def flat_space(self):
+        """`Box` space of encoded vectors."""
+        _require_gymnasium()
+        return spaces.Box(low=self.low, high=self.high, dtype=np.int32)
+
+class ActionDecoder:
+    """Maps `MultiDiscrete` choices onto actions for `Age2Env.step`.
+
+    Each player picks [action, arg1, arg2], where action is an index into
+    `action_spec` and args are indices into argument choices (see
+    `ACTION_ARGS`). Unused arguments are ignored.
+
+    Argument columns are sized for the action with the most choices, so
+    valid range depends on the action picked (see `arg_sizes`). Indices
+    out of that range are rejected rather than wrapped onto other choices;
+    use `mask` to sample only valid arguments.
+    """
+
+    def __init__(self, action_spec: List, player_ids: Sequence[int]):
+        self.player_ids = list(player_ids)
+        self._actions = []
+        for fn, _ in action_spec:
+            self._actions.append((fn, ACTION_ARGS[fn.__name__]))
+        self.num_args = max(len(args) for _, args in self._actions)
+        self.nvec = np.ones((len(self.player_ids), 1 + self.num_args), dtype=np.int64)
+        self.nvec[:, 0] = len(self._actions)
+        for _, args in self._actions:
+            for i, choices in enumerate(args):
+                self.nvec[:, i+1] = np.maximum(self.nvec[:, i+1], len(choices))
+        # number of valid choices of each argument for each action,
+        # any index is fine for unused arguments
+        self.arg_sizes = np.tile(self.nvec[0, 1:], (len(self._actions), 1))
+        for action, (_, args) in enumerate(self._actions):
+            for i, choices in enumerate(args):
+                self.arg_sizes[action, i] = len(choices)
+
+    def decode(self, choices: np.ndarray) -> List[Tuple[int, List]]:
+        """Returns list of (player id, [action]) for `Age2Env.step`."""
+        player_actions = []
+        for player_id, player_choices in zip(self.player_ids, np.asarray(choices)):
+            fn, args = self._actions[int(player_choices[0])]
+            values = []
+            for arg, index in zip(args, player_choices[1:]):
+                if not 0 <= index < len(arg):
+                    raise ValueError(f"Argument index {index} is out of range for {fn.__name__} "
+                                     f"with {len(arg)} choices")
+                values.append(arg[int(index)])
+            player_actions.append((player_id, [fn(*values)]))
+        return player_actions
+
+    def mask(self, actions: Sequence[int]) -> Tuple:
+        """Mask for `MultiDiscrete.sample` that keeps the given action for
+        each player and allows only valid arguments for it."""
+        masks = []
+        for action in actions:
+            action_mask = np.zeros(len(self._actions), dtype=np.int8)
+            action_mask[action] = 1
+            arg_masks = tuple(
+                (np.arange(size) < valid).astype(np.int8)
+                for size, valid in zip(self.nvec[0, 1:], self.arg_sizes[action])
+            )
+            masks.append((action_mask,) + arg_masks)
+        return tuple(masks)
+
+    def space(self):
+        _require_gymnasium()
+        return spaces.MultiDiscrete(self.nvec)
+
+def observation_space(env, max_map_size: Tuple[int, int] = DEFAULT_MAX_MAP_SIZE):
+    """`Dict` observation space for the environment (see `FlatObservationEncoder`)."""
+    return FlatObservationEncoder(env.observation_spec(), len(env.game_config.players), max_map_size).space()
+
+def action_space(env):
+    """`MultiDiscrete` space of shape (num_agents, 3) for agent players."""
+    player_ids = [i+1 for i, p in enumerate(env.game_config.players) if p.is_agent]
+    return ActionDecoder(env.action_spec(), player_ids).space()
@@ -0,0 +1,401 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Vectorized environments running many games in worker processes."""
+
+import collections
+import logging
+import multiprocessing as mp
+import multiprocessing.connection
+from multiprocessing import resource_tracker, shared_memory
+import os
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from pyage2.env.age2_env import Age2Env, Age2ProcessError
+from pyage2.env.observations import EXTRA_FIELDS, ObservationBatch, VisibilityTracker, row_size, write_row
+from pyage2.lib.expert import ObservationLayout
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 attached blocks are registered with resource
+        # tracker as well, which unlinks them once the worker exits
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def _worker(index: int, env_fn: Callable[[], Age2Env], conn, auto_reset: bool):
+    env, shm, row = None, None, None
+    visibility = VisibilityTracker()
+    try:
+        env = env_fn()
+        conn.send(('ok', (env.observation_spec(), env.action_spec(), len(env.game_config.players))))
+        while True:
+            command, data = conn.recv()
+            if command == 'attach':
+                name, size = data
+                shm = _attach(name)
+                row = np.ndarray((size,), dtype=np.int32, buffer=shm.buf, offset=size*index*4)
+                conn.send(('ok', None))
+            elif command == 'reset':
+                obs, info = env.reset()
+                visibility = VisibilityTracker()
+                visibility.changed(obs)
+                write_row(row, obs)
+                conn.send(('ok', (info, obs.tiles)))
+            elif command == 'step':
+                obs, reward, done, info = env.step(data)
+                tiles = None
+                if done and auto_reset:
+                    info = dict(info or {}, terminal_observation=obs)
+                    obs, _ = env.reset()
+                    visibility = VisibilityTracker()
+                    visibility.changed(obs)
+                    tiles = obs.tiles
+                write_row(row, obs)
+                conn.send(('ok', (reward, done, info, tiles, visibility.changed(obs))))
+            elif command == 'close':
+                conn.send(('ok', None))
+                break
+            else:
+                raise ValueError(f"Unknown command {command}")
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        logging.exception("Environment worker %s failed.", index)
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        # views into the block have to be released before closing it
+        row = None
+        if shm is not None:
+            shm.close()
+        if env is not None:
+            env.close()
+        conn.close()
+
+class _WorkerEnvs:
+    """Worker processes with their envs and the shared observations block.
+
+    Each env owns a row of the block, all fields are exposed as stacked
+    (num_envs, num_players, *field_shape) views into it.
+    """
+
+    def __init__(self,
+                 env_fns: Sequence[Callable[[], Age2Env]],
+                 auto_reset: bool,
+                 context: Optional[str]):
+        assert env_fns, "At least one environment is required"
+        self.num_envs = len(env_fns)
+        self._closed = False
+        self._shm = None
+        self._fields = None
+        self._tiles = [None] * self.num_envs
+        ctx = mp.get_context(context)
+        self._conns, self._procs = [], []
+        for index, env_fn in enumerate(env_fns):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(
+                target=_worker,
+                args=(index, env_fn, child_conn, auto_reset),
+                name=f"Age2EnvWorker-{index}",
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+
+        try:
+            specs = self._recv_all()
+            self._observation_spec, self._action_spec, self.num_players = specs[0]
+            for spec in specs[1:]:
+                assert spec[2] == self.num_players, "All environments should have the same number of players"
+            self._layout = ObservationLayout(self._observation_spec)
+            size = row_size(self._layout, self.num_players)
+            self._shm = shared_memory.SharedMemory(create=True, size=size * self.num_envs * 4)
+            self._block = np.ndarray((self.num_envs, size), dtype=np.int32, buffer=self._shm.buf)
+            self._block[:] = 0
+            self._fields = self._stacked_fields()
+            self._send_all('attach', [(self._shm.name, size)] * self.num_envs)
+            self._recv_all()
+        except BaseException:
+            self.close()
+            raise
+
+    def _stacked_fields(self) -> Dict[str, np.ndarray]:
+        fields = {}
+        n = self.num_players
+        for name, (offset, shape) in self._layout.fields.items():
+            start = offset * n
+            field_size = int(np.prod(shape)) * n
+            field_shape = (self.num_envs, n) if shape == (1,) else (self.num_envs, n) + shape
+            # each field is contiguous within the row, so this is a view
+            fields[name] = self._block[:, start:start+field_size].reshape(field_shape)
+        extras = self._layout.size * n
+        for i, name in enumerate(EXTRA_FIELDS):
+            fields[name] = self._block[:, extras+i*n:extras+(i+1)*n]
+        return fields
+
+    def _send_all(self, command: str, data: Sequence[Any]):
+        for conn, payload in zip(self._conns, data):
+            conn.send((command, payload))
+
+    def _recv(self, index: int) -> Any:
+        try:
+            status, payload = self._conns[index].recv()
+        except EOFError:
+            status, payload = 'error', "worker exited unexpectedly"
+        if status == 'error':
+            raise Age2ProcessError(f"Environment worker failed:\nenv {index}: {payload}")
+        return payload
+
+    def _recv_all(self) -> List[Any]:
+        results, errors = [], []
+        for index in range(len(self._conns)):
+            try:
+                results.append(self._recv(index))
+            except Age2ProcessError as e:
+                errors.append(str(e).split("\n", 1)[1])
+                results.append(None)
+        if errors:
+            raise Age2ProcessError("Environment workers failed:\n" + "\n".join(errors))
+        return results
+
+    def _update_tiles(self, index: int, tiles, visibility: Optional[np.ndarray]):
+        if tiles is not None:
+            self._tiles[index] = tiles
+        elif visibility is not None and self._tiles[index] is not None:
+            self._tiles[index].update_visibility(visibility)
+
+    def observation_spec(self):
+        return self._observation_spec
+
+    def action_spec(self):
+        return self._action_spec
+
+    def _drain(self):
+        """Receives responses that are still in flight before shutdown."""
+        pass
+
+    def close(self):
+        """Stops workers (closing their environments) and frees shared memory."""
+        if self._closed: return
+        self._closed = True
+        try:
+            self._drain()
+        except Age2ProcessError:
+            pass
+        for conn, proc in zip(self._conns, self._procs):
+            try:
+                if proc.is_alive():
+                    conn.send(('close', None))
+                    conn.recv()
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+            conn.close()
+        for proc in self._procs:
+            proc.join(timeout=30)
+            if proc.is_alive():
+                proc.terminate()
+        if self._shm is not None:
+            self._fields = None
+            self._block = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _exception_traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+class Age2VecEnv(_WorkerEnvs):
+    """Runs `Age2Env` instances created by `env_fns` in worker processes.
+
+    Workers write observations into a single shared memory block laid out
+    from `observation_spec()`, each field is returned as a stacked array of
+    shape (num_envs, num_players, *field_shape) with no pickling involved.
+    Map tiles are sent through the pipe only when they change (on reset and
+    on visibility refresh), available as `observations['tiles']` list.
+
+    With `auto_reset` the finished game is restarted right away, `step`
+    returns the first observation of the new episode and the last one is
+    put into info as `terminal_observation`.
+
+    `env_fns` are sent to workers, so they have to be picklable, e.g.
+    `functools.partial(Age2Env, run_config, game_config)`. Environments
+    should not use delta encoding (`delta_snapshot_interval`).
+    """
+
+    def __init__(self,
+                 env_fns: Sequence[Callable[[], Age2Env]],
+                 *,
+                 auto_reset: bool = True,
+                 copy: bool = True,
+                 context: Optional[str] = "spawn"):
+        self._copy = copy
+        self._waiting = False
+        super().__init__(env_fns, auto_reset, context)
+
+    def _observations(self) -> Dict[str, Any]:
+        if self._copy:
+            obs = {name: values.copy() for name, values in self._fields.items()}
+        else:
+            obs = dict(self._fields)
+        obs['tiles'] = list(self._tiles)
+        return obs
+
+    def reset(self):
+        """Resets all environments, returns stacked observations and infos."""
+        self._send_all('reset', [None] * self.num_envs)
+        results = self._recv_all()
+        infos = []
+        for index, (info, tiles) in enumerate(results):
+            self._update_tiles(index, tiles, None)
+            infos.append(info)
+        return self._observations(), infos
+
+    def step_async(self, actions: Sequence[Any]):
+        """Sends actions to all environments without waiting for results."""
+        assert len(actions) == self.num_envs, "Actions are expected for each environment"
+        assert not self._waiting, "step_wait should be called before the next step_async"
+        self._send_all('step', actions)
+        self._waiting = True
+
+    def step_wait(self):
+        """Waits for all environments to step, returns stacked observations,
+        rewards, dones and infos."""
+        assert self._waiting, "step_async should be called first"
+        self._waiting = False
+        results = self._recv_all()
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos = []
+        for index, (reward, done, info, tiles, visibility) in enumerate(results):
+            rewards[index] = reward
+            dones[index] = done
+            infos.append(info)
+            self._update_tiles(index, tiles, visibility)
+        return self._observations(), rewards, dones, infos
+
+    def step(self, actions: Sequence[Any]):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def _drain(self):
+        if getattr(self, '_waiting', False):
+            self._waiting = False
+            self._recv_all()
+
+class Age2EnvPool(_WorkerEnvs):
+    """Asynchronous pool of environments in the style of EnvPool.
+
+    Rather than waiting for all games to step (and stalling on the slowest
+    one), `recv` returns results from the first `batch_size` environments
+    that are ready, together with their ids. `send` dispatches actions to
+    just those environments:
+
+        pool.async_reset()
+        while True:
+            obs, rewards, dones, infos, env_ids = pool.recv()
+            pool.send(policy(obs), env_ids)
+
+    Observations are stacked along the first axis in the order of `env_ids`
+    (copied out of the shared block). Finished games are reset by workers
+    automatically (see `Age2VecEnv` for details).
+    """
+
+    def __init__(self,
+                 env_fns: Sequence[Callable[[], Age2Env]],
+                 batch_size: Optional[int] = None,
+                 *,
+                 auto_reset: bool = True,
+                 context: Optional[str] = "spawn"):
+        super().__init__(env_fns, auto_reset, context)
+        self.batch_size = batch_size or self.num_envs
+        assert 0 < self.batch_size <= self.num_envs, "batch_size should be within [1, num_envs]"
+        # env_id -> command that is in flight
+        self._pending = {}
+        # results that were received, but not yet returned from `recv`
+        self._ready = collections.deque()
+
+    def _dispatch(self, env_id: int, command: str, payload: Any):
+        assert env_id not in self._pending, f"Env {env_id} is still running"
+        assert all(env_id != ready[0] for ready in self._ready), f"Env {env_id} result was not received yet"
+        self._conns[env_id].send((command, payload))
+        self._pending[env_id] = command
+
+    def async_reset(self, env_ids: Optional[Sequence[int]] = None):
+        """Starts resetting given (or all) environments, use `recv` to get
+        initial observations."""
+        for env_id in (range(self.num_envs) if env_ids is None else env_ids):
+            self._dispatch(int(env_id), 'reset', None)
+
+    def send(self, actions: Sequence[Any], env_ids: Sequence[int]):
+        """Sends actions to given environments without waiting for results."""
+        assert len(actions) == len(env_ids), "Actions are expected for each env id"
+        for env_actions, env_id in zip(actions, env_ids):
+            self._dispatch(int(env_id), 'step', env_actions)
+
+    def _collect(self, timeout: Optional[float]):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self._ready) < self.batch_size:
+            assert self._pending, "Not enough environments running to fill the batch"
+            conns = {self._conns[env_id]: env_id for env_id in self._pending}
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready = mp.connection.wait(list(conns), remaining)
+            if not ready:
+                raise TimeoutError(f"Less than {self.batch_size} environments are ready within {timeout}s")
+            for conn in ready:
+                env_id = conns[conn]
+                command = self._pending.pop(env_id)
+                if command == 'reset':
+                    info, tiles = self._recv(env_id)
+                    reward, done, visibility = 0, False, None
+                else:
+                    reward, done, info, tiles, visibility = self._recv(env_id)
+                self._update_tiles(env_id, tiles, visibility)
+                self._ready.append((env_id, reward, done, info))
+
+    def recv(self, timeout: Optional[float] = None):
+        """Waits for the first `batch_size` environments to be ready. Returns
+        stacked observations, rewards, dones, infos and env ids."""
+        self._collect(timeout)
+        results = [self._ready.popleft() for _ in range(self.batch_size)]
+        env_ids = np.array([env_id for env_id, _, _, _ in results], dtype=np.int64)
+        # fancy indexing copies rows, so the envs could be stepped right away
+        obs = {name: values[env_ids] for name, values in self._fields.items()}
+        obs['tiles'] = [self._tiles[env_id] for env_id in env_ids]
+        rewards = np.array([reward for _, reward, _, _ in results], dtype=np.float32)
+        dones = np.array([done for _, _, done, _ in results], dtype=bool)
+        infos = [info for _, _, _, info in results]
+        return obs, rewards, dones, infos, env_ids
+
+    def step(self, actions: Sequence[Any], env_ids: Sequence[int]):
+        self.send(actions, env_ids)
+        return self.recv()
+
+    def _drain(self):
+        for env_id in list(getattr(self, '_pending', {})):
+            self._pending.pop(env_id)
+            self._recv(env_id)
@@ -12,4 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .winapi import LibraryInjector
\ No newline at end of file
+import sys
+
+# DLL injection relies on Windows API
+if sys.platform == "win32":
+    from .winapi import LibraryInjector
\ No newline at end of file
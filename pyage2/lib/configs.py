@@ -31,7 +31,12 @@ DEFAULT_AIMODULE_PORT = 37412
 # this is a hack to avoid problems with Game struct
 # initialization in the game process
 DEFAULT_AIMODULE_LOAD_DELAY_SECONDS = 2
-DEFAULT_AUTOGAME_CONNECT_DELAY_SECONDS = 3
+# autogame readiness is checked by active probing, the delay
+# is only applied on top of that when explicitly configured
+DEFAULT_AUTOGAME_CONNECT_DELAY_SECONDS = 0
+DEFAULT_STARTUP_TIMEOUT_SECONDS = 60
+DEFAULT_PROBE_INITIAL_DELAY_SECONDS = 0.05
+DEFAULT_PROBE_MAX_DELAY_SECONDS = 1.0
 DEFAULT_AUTOGAME_TIMEOUT_SECONDS = 2
 DEFAULT_AUTOGAME_RECONNECT_LIMIT = 30
 
@@ -41,18 +46,32 @@ PACKAGE_FOLDER = Path(__file__).parent.parent
 
 @dataclass
 class RunConfig:
-    """All configuration options necessary to run Age of Empires II process."""
+    """All configuration options necessary to run Age of Empires II process.
+
+    Autogame port is passed to the game with `-autogameport`. AI Module DLL
+    does not accept a port and always listens on `aimodule_port`, so only
+    a single game could run on a host until it does.
+    """
 
     exec_path: str
     autogame_dll: str
     aimodule_dll: str
-    autogame_port: int
+    # `None` means a free port is reserved for each launched process
+    autogame_port: Optional[int]
     aimodule_port: int
     autogame_connect_delay: int = DEFAULT_AUTOGAME_CONNECT_DELAY_SECONDS
     autogame_timeout: int = DEFAULT_AUTOGAME_TIMEOUT_SECONDS
     autogame_reconnect_limit: int = DEFAULT_AUTOGAME_RECONNECT_LIMIT
     aimodule_load_delay: int = DEFAULT_AIMODULE_LOAD_DELAY_SECONDS
+    # overall deadline for the game process to become ready
+    startup_timeout: float = DEFAULT_STARTUP_TIMEOUT_SECONDS
+    probe_initial_delay: float = DEFAULT_PROBE_INITIAL_DELAY_SECONDS
+    probe_max_delay: float = DEFAULT_PROBE_MAX_DELAY_SECONDS
     host: str = "127.0.0.1"
+    # directory to cache decoded map tiles of scenarios, `None` disables caching
+    map_cache_dir: Optional[str] = None
+    # directory to persist resolved game constants, `None` keeps them in memory only
+    const_cache_dir: Optional[str] = None
 
     @classmethod
     def create(cls,
@@ -60,10 +79,14 @@ class RunConfig:
                exec_path: Optional[str] = None,
                autogame_dll: Optional[str] = None,
                aimodule_dll: Optional[str] = None,
+               autogame_port: Optional[int] = None,
                autogame_connect_delay: int = DEFAULT_AUTOGAME_CONNECT_DELAY_SECONDS,
                autogame_timeout: int = DEFAULT_AUTOGAME_TIMEOUT_SECONDS,
                autogame_reconnect_limit: int = DEFAULT_AUTOGAME_RECONNECT_LIMIT,
-               aimodule_load_delay: int = DEFAULT_AIMODULE_LOAD_DELAY_SECONDS) -> 'RunConfig':
+               aimodule_load_delay: int = DEFAULT_AIMODULE_LOAD_DELAY_SECONDS,
+               startup_timeout: float = DEFAULT_STARTUP_TIMEOUT_SECONDS,
+               map_cache_dir: Optional[str] = None,
+               const_cache_dir: Optional[str] = None) -> 'RunConfig':
         # exec path resolution order:
         # * explicit param from the launcher script
         # * PYAGE2PATH env variable
@@ -95,13 +118,16 @@ class RunConfig:
         return cls(
             exec_path=exec_path,
             autogame_dll=os.path.expanduser(autogame_dll),
-            autogame_port=DEFAULT_AUTOGAME_PORT, # xxx(okachaiev): is it possible to use a free one?
+            autogame_port=autogame_port,
             aimodule_dll=os.path.expanduser(aimodule_dll),
             aimodule_port=DEFAULT_AIMODULE_PORT, # xxx(okachaiev): find free port if necessary
             aimodule_load_delay=aimodule_load_delay,
             autogame_connect_delay=autogame_connect_delay,
             autogame_timeout=autogame_timeout,
             autogame_reconnect_limit=autogame_reconnect_limit,
+            startup_timeout=startup_timeout,
+            map_cache_dir=map_cache_dir,
+            const_cache_dir=const_cache_dir,
         )
 
 class PlayerType(Enum):
@@ -0,0 +1,151 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Resolves symbolic game constants through AI Module with in-process and on-disk caching."""
+
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+from pyage2.lib.expert import (AGE, ExpertAPIUnsupportedError, ExpertClient, ObjectType, Resource,
+                               StrategicNumber, TechType)
+
+DEFAULT_CONST_CACHE_SIZE = 4096
+# hardcoded constants, used when AI Module does not support `ResolveConst`
+FALLBACK_ENUMS = (ObjectType, TechType, StrategicNumber, Resource, AGE)
+# AI script prefixes of constant names, e.g. "ri-loom" or "sn-cap-civilian-builders"
+FALLBACK_PREFIXES = {'ri-': TechType, 'sn-': StrategicNumber}
+
+def version_fingerprint(*paths: str) -> str:
+    """Identifies game/DLL version by hashing content of the given files."""
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def fallback_const(name: str) -> int:
+    """Looks up the name in hardcoded enums (e.g. "villager" is `ObjectType.VILLAGER`)."""
+    key, enums = name.strip().lower(), FALLBACK_ENUMS
+    for prefix, enum_cls in FALLBACK_PREFIXES.items():
+        if key.startswith(prefix):
+            key, enums = key[len(prefix):], (enum_cls,)
+            break
+    member = key.upper().replace('-', '_').replace(' ', '_')
+    for enum_cls in enums:
+        if member in enum_cls.__members__:
+            return int(enum_cls[member].value)
+    raise KeyError(f"Unknown constant '{name}'.")
+
+class ConstResolver:
+    """Looks up symbolic names (e.g. "villager") using `ExpertAPI.ResolveConst`.
+
+    Resolved values are memoized in LRU cache and, when `cache_dir` is given,
+    persisted into a file per `version` (see `version_fingerprint`), so only
+    names that were never seen for a given game version trigger RPCs.
+
+    `ResolveConst` is documented as experimental and unsupported, when AI
+    Module does not implement it, names are looked up in hardcoded enums
+    instead (see `fallback_const`). Such values are never persisted.
+    """
+
+    def __init__(self,
+                 client: ExpertClient,
+                 version: str,
+                 cache_dir: Optional[str] = None,
+                 maxsize: int = DEFAULT_CONST_CACHE_SIZE):
+        self._client = client
+        self._maxsize = maxsize
+        self._lru = OrderedDict()
+        self._persisted = {}
+        self._dirty = False
+        self._supported = True
+        self._path = None
+        if cache_dir is not None:
+            directory = Path(os.path.expanduser(cache_dir))
+            directory.mkdir(parents=True, exist_ok=True)
+            self._path = directory.joinpath(f"consts-{version}.json")
+            self._persisted = self._load()
+
+    def _load(self) -> Dict[str, int]:
+        if not self._path.is_file():
+            return {}
+        try:
+            with self._path.open("r") as f:
+                return {name: int(value) for name, value in json.load(f).items()}
+        except (OSError, ValueError):
+            logging.warning("Failed to load constants cache %s.", self._path)
+            return {}
+
+    def _remember(self, name: str, value: int):
+        self._lru[name] = value
+        self._lru.move_to_end(name)
+        if len(self._lru) > self._maxsize:
+            self._lru.popitem(last=False)
+
+    def resolve(self, name: str) -> int:
+        return self.resolve_many([name])[name]
+
+    def resolve_many(self, names: Iterable[str]) -> Dict[str, int]:
+        """Resolves all names, issuing a single batch of RPCs for cache misses."""
+        resolved, missing = {}, []
+        for name in dict.fromkeys(names):
+            if name in self._lru:
+                self._lru.move_to_end(name)
+                resolved[name] = self._lru[name]
+            elif name in self._persisted:
+                resolved[name] = self._persisted[name]
+                self._remember(name, resolved[name])
+            else:
+                missing.append(name)
+        if missing:
+            for name, value in self._resolve_missing(missing).items():
+                resolved[name] = value
+                self._remember(name, value)
+        return resolved
+
+    def _resolve_missing(self, names: List[str]) -> Dict[str, int]:
+        if self._supported:
+            logging.debug("Resolving %s constants through AI Module.", len(names))
+            try:
+                values = self._client.resolve_consts(names)
+            except ExpertAPIUnsupportedError:
+                logging.warning("AI Module does not support ResolveConst, using hardcoded constants.")
+                self._supported = False
+            else:
+                self._persisted.update(values)
+                self._dirty = True
+                self.save()
+                return values
+        return {name: fallback_const(name) for name in names}
+
+    def save(self):
+        """Writes all resolved constants to disk (if caching is enabled)."""
+        if self._path is None or not self._dirty:
+            return
+        fd, tmp_path = tempfile.mkstemp(suffix=".json", dir=self._path.parent)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._persisted, f, sort_keys=True)
+            os.replace(tmp_path, self._path)
+            self._dirty = False
+        except OSError:
+            logging.exception("Failed to store constants cache.")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -13,23 +13,31 @@
 # limitations under the License.
 """Client to communicate with AI Module gRPC server."""
 
+import asyncio
 from dataclasses import dataclass
 from enum import Enum, IntEnum
 from google.protobuf.any_pb2 import Any
 import grpc
-from typing import Any as AnyType, List, Optional, Tuple
+import grpc.aio
+import numpy as np
+from typing import Any as AnyType, Dict, List, Optional, Tuple
 
 from pyage2.lib.utils import enum_ordering
 
 import pyage2.expert.fact.fact_pb2 as fact
 import pyage2.protos.expert.expert_api_pb2_grpc as expert_grpc
 import pyage2.protos.expert.expert_api_pb2 as expert
+import pyage2.protos.ai_module_api_pb2_grpc as aimodule_grpc
+import pyage2.protos.ai_module_api_pb2 as aimodule
 
 Actions = List[AnyType]
 
 class ExpertAPIError(Exception):
     pass
 
+class ExpertAPIUnsupportedError(ExpertAPIError):
+    """AI Module does not implement the request."""
+
 @dataclass
 class Tile:
     x: int
@@ -38,14 +46,59 @@ class Tile:
     terrain: Optional[int]
     visibility: int
 
-@dataclass
+@dataclass(eq=False)
 class MapTiles:
-    width: int
-    height: int
-    tiles: List[Tile]
+    """Spatial information about the map.
+
+    Each attribute is 2-D array of shape (map_height, map_width) indexed
+    as [y, x]. Note that `height` stands for tiles elevation (same as in
+    `Tile`), use `shape` to get dimensions of the map.
+    """
+    height: np.ndarray
+    terrain: np.ndarray
+    visibility: np.ndarray
+
+    def __post_init__(self):
+        self._tiles = None
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.terrain.shape
+
+    @property
+    def width(self) -> int:
+        return self.terrain.shape[1]
+
+    @property
+    def tiles(self) -> List[Tile]:
+        """List of `Tile`s, kept for compatibility. Built lazily on first access."""
+        if self._tiles is None:
+            map_height, map_width = self.shape
+            self._tiles = [
+                Tile(x=x, y=y,
+                     height=int(self.height[y, x]),
+                     terrain=int(self.terrain[y, x]),
+                     visibility=int(self.visibility[y, x]))
+                for y in range(map_height) for x in range(map_width)
+            ]
+        return self._tiles
+
+    def update_visibility(self, visibility: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Merges fresh visibility grid in place, returns (ys, xs) of tiles
+        that changed since the previous update."""
+        ys, xs = np.nonzero(self.visibility != visibility)
+        if len(ys):
+            self.visibility[ys, xs] = visibility[ys, xs]
+            self._tiles = None
+        return ys, xs
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tiles'] = None
+        return state
 
     def __str__(self):
-        return f"MapTiles[w={self.width}, h={self.height}, tiles={len(self.tiles)}]"
+        return f"MapTiles[w={self.shape[1]}, h={self.shape[0]}]"
 
     def __repr__(self):
         return str(self)
@@ -56,6 +109,237 @@ def _unpack(result, result_type):
     # xxx(okachaiev): not sure if we have any use case where type != int
     return int(unpacked_result.result)
 
+# per tile attributes in the order they are decoded
+TILE_FIELDS = ('x', 'y', 'height', 'terrain', 'visibility')
+
+def _decode_map_tiles(response) -> MapTiles:
+    unpacked_response = fact.ModMapTilesResult()
+    response.results[0].Unpack(unpacked_response)
+    tiles = unpacked_response.tiles
+    # single pass over repeated field, everything else is vectorized
+    values = np.fromiter(
+        (value for t in tiles for value in (t.x, t.y, t.height, t.terrain, t.visibility)),
+        dtype=np.int32,
+        count=len(TILE_FIELDS)*len(tiles),
+    ).reshape(-1, len(TILE_FIELDS))
+    grids = np.zeros((3, unpacked_response.mapHeight, unpacked_response.mapWidth), dtype=np.int32)
+    grids[:, values[:, 1], values[:, 0]] = values[:, 2:].T
+    return MapTiles(height=grids[0], terrain=grids[1], visibility=grids[2])
+
+def _decode_visibility(response) -> np.ndarray:
+    """Decodes only visibility channel of `ModMapTilesResult`."""
+    unpacked_response = fact.ModMapTilesResult()
+    response.results[0].Unpack(unpacked_response)
+    tiles = unpacked_response.tiles
+    values = np.fromiter(
+        (value for t in tiles for value in (t.x, t.y, t.visibility)),
+        dtype=np.int32,
+        count=3*len(tiles),
+    ).reshape(-1, 3)
+    visibility = np.zeros((unpacked_response.mapHeight, unpacked_response.mapWidth), dtype=np.int32)
+    visibility[values[:, 1], values[:, 0]] = values[:, 2]
+    return visibility
+
+def _command_list(player_id, commands):
+    request = expert.CommandList()
+    request.playerNumber = player_id
+    for cmd in commands:
+        request.commands.add().Pack(cmd)
+    return request
+
+def _read_result(value: bytes) -> int:
+    """Reads `result` field (#1, varint) directly from serialized fact result
+    message, skipping allocation of the message and `Any.Unpack` call."""
+    pos, size = 0, len(value)
+    while pos < size:
+        key, pos = _read_varint(value, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            field_value, pos = _read_varint(value, pos)
+            if field_number == 1:
+                # int32 values are encoded as 64-bit two's complement
+                if field_value & (1 << 63):
+                    field_value -= 1 << 64
+                return field_value
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _read_varint(value, pos)
+            pos += length
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ExpertAPIError(f"Unexpected wire type {wire_type} in fact result.")
+    # default value is not serialized
+    return 0
+
+def _read_varint(value: bytes, pos: int) -> Tuple[int, int]:
+    result, shift = 0, 0
+    while True:
+        byte = value[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+class ObservationLayout:
+    """Maps observation spec onto a single flat int32 array.
+
+    Each field with a shape tuple gets a contiguous slice of the array.
+    Fields of shape (1,) are treated as scalars. Fields that are not
+    defined by shape (e.g. `tiles`) are not part of the layout."""
+
+    def __init__(self, spec: Dict[str, AnyType]):
+        self.fields = {}
+        self.size = 0
+        self._batch_index = {}
+        for name, shape in spec.items():
+            if not isinstance(shape, tuple): continue
+            field_size = int(np.prod(shape))
+            self.fields[name] = (self.size, shape)
+            self.size += field_size
+
+    def __getstate__(self):
+        # batch index is a cache, no need to ship it to other processes
+        state = self.__dict__.copy()
+        state['_batch_index'] = {}
+        return state
+
+    def offset(self, result_key: str) -> int:
+        """Finds position of the fact in the flat array, following `{field}.{index}`
+        naming convention for array fields."""
+        if "." in result_key:
+            name, index = result_key.split(".", 1)
+            return self.fields[name][0] + int(index)
+        return self.fields[result_key][0]
+
+    def allocate(self) -> np.ndarray:
+        return np.zeros(self.size, dtype=np.int32)
+
+    def batch_index(self, num_players: int) -> np.ndarray:
+        """Maps (player, flat offset) into position within the batch buffer,
+        where fields are laid out one after another and each field is
+        contiguous array of shape (num_players, *field_shape)."""
+        index = self._batch_index.get(num_players)
+        if index is None:
+            index = np.empty((num_players, self.size), dtype=np.intp)
+            for offset, shape in self.fields.values():
+                field_size = int(np.prod(shape))
+                for player in range(num_players):
+                    start = offset*num_players + player*field_size
+                    index[player, offset:offset+field_size] = np.arange(start, start+field_size)
+            self._batch_index[num_players] = index
+        return index
+
+    def unflatten(self, flat: np.ndarray) -> Dict[str, AnyType]:
+        """Splits flat array into dict of fields. Arrays are views into
+        the original buffer, no data is copied."""
+        obs = {}
+        for name, (offset, shape) in self.fields.items():
+            if shape == (1,):
+                obs[name] = flat[offset]
+            else:
+                obs[name] = flat[offset:offset+int(np.prod(shape))].reshape(shape)
+        return obs
+
+def _actions_by_player(actions: List[Tuple[int, Actions]]) -> Dict[int, Actions]:
+    actions_by_player = {}
+    for player_id, player_actions in actions:
+        player_actions = list(filter(None, player_actions))
+        if player_actions:
+            actions_by_player.setdefault(player_id, []).extend(player_actions)
+    return actions_by_player
+
+def _with_actions(plan, player_actions: Actions) -> bytes:
+    """Prepends actions to pre-built request from the plan. Repeated fields of
+    concatenated messages are merged, so actions go first and facts follow."""
+    if not player_actions:
+        return plan.request
+    return _command_list(plan.player_id, player_actions).SerializeToString() + plan.request
+
+def _strip_actions(response, num_actions: int):
+    """Drops results of the actions, so the response matches the plan."""
+    if num_actions:
+        del response.results[:num_actions]
+    return response
+
+# (result_key, fact, fact_result_type)
+Facts = List[Tuple[str, AnyType, AnyType]]
+
+EXECUTE_COMMAND_LIST_METHOD = '/protos.expert.ExpertAPI/ExecuteCommandList'
+
+class QueryPlan:
+    """Pre-compiled list of facts to be executed for a given player.
+
+    Facts are packed into `CommandList` and serialized only once, when
+    the plan is created. Each execution of the plan sends pre-built bytes
+    instead of re-creating ~1k protobuf messages on each step.
+    """
+
+    def __init__(self, player_id: int, commands: Facts, layout: Optional[ObservationLayout] = None):
+        self.player_id = player_id
+        self.keys = [result_key for result_key, _, _ in commands]
+        # xxx(okachaiev): this one could be drastically simplified
+        # if we follow the convention (factType, factTypeResult)
+        self.result_types = [result_type for _, _, result_type in commands]
+        self.request = _command_list(player_id, [cmd for _, cmd, _ in commands]).SerializeToString()
+        self.layout = layout
+        if layout is not None:
+            self.offsets = np.array([layout.offset(key) for key in self.keys], dtype=np.intp)
+
+    def __add__(self, other: 'QueryPlan') -> 'QueryPlan':
+        """Concatenates two plans for the same player without re-packing facts:
+        serialized `CommandList` messages are merged by simply appending bytes."""
+        assert self.player_id == other.player_id, "Plans are compiled for different players."
+        assert self.layout is other.layout, "Plans are compiled with different layouts."
+        plan = QueryPlan(self.player_id, [], self.layout)
+        plan.keys = self.keys + other.keys
+        plan.result_types = self.result_types + other.result_types
+        plan.request = self.request + other.request
+        if self.layout is not None:
+            plan.offsets = np.concatenate([self.offsets, other.offsets])
+        return plan
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return f"QueryPlan[player={self.player_id}, facts={len(self.keys)}, bytes={len(self.request)}]"
+
+    def decode(self, response):
+        """Unpacks `CommandResultList` received for this plan into observations dict."""
+        if self.layout is not None:
+            return self.layout.unflatten(self.decode_into(response, self.layout.allocate()))
+        response_keys = {}
+        for i, (result_key, result_type) in enumerate(zip(self.keys, self.result_types)):
+            raw_result = _unpack(response.results[i], result_type)
+            # check if it's array or not
+            if "." in result_key:
+                result_key, _ = result_key.split(".", 1)
+                if result_key in response_keys:
+                    response_keys[result_key].append(raw_result)
+                else:
+                    # xxx(okachaiev): allocations are pretty slow,
+                    # better would be to use statically defined spec
+                    # to allocate arrays with proper length hint
+                    response_keys[result_key] = [raw_result]
+            else:
+                response_keys[result_key] = raw_result
+        return response_keys
+
+    def decode_into(self, response, out: np.ndarray) -> np.ndarray:
+        """Writes results into flat int32 array by offsets known from the layout."""
+        assert self.layout is not None, "Plan was compiled without observation layout."
+        out[self.offsets] = self.results(response)
+        return out
+
+    def results(self, response) -> List[int]:
+        """Reads raw results in the same order facts were given to the plan."""
+        if len(response.results) != len(self.keys):
+            raise ExpertAPIError(f"Expected {len(self.keys)} results, got {len(response.results)}.")
+        return [_read_result(result.value) for result in response.results]
+
 class ExpertClient:
 
     def __init__(self, host: str, port: int):
@@ -63,6 +347,14 @@ class ExpertClient:
         self._port = port
         self._channel = grpc.insecure_channel(f"{host}:{port}")
         self._api = expert_grpc.ExpertAPIStub(self._channel)
+        self._aimodule = aimodule_grpc.AIModuleAPIStub(self._channel)
+        # same RPC as `ExpertAPIStub.ExecuteCommandList` but takes
+        # already serialized `CommandList` (see `QueryPlan`)
+        self._execute_serialized = self._channel.unary_unary(
+            EXECUTE_COMMAND_LIST_METHOD,
+            request_serializer=None,
+            response_deserializer=expert.CommandResultList.FromString,
+        )
 
     def __call__(self, player_id, commands):
         request = expert.CommandList()
@@ -82,40 +374,64 @@ class ExpertClient:
         As the result type is signifintly different from other facts,
         unpacking from grpc message into Python dataclass is done manually
         withih the function."""
-        response = self(1, [fact.ModMapTiles()])
-        unpacked_response = fact.ModMapTilesResult()
-        response.results[0].Unpack(unpacked_response)
-        return MapTiles(
-            width=unpacked_response.mapWidth,
-            height=unpacked_response.mapHeight,
-            tiles=[
-                Tile(x=t.x, y=t.y, height=t.height, terrain=t.terrain, visibility=t.visibility)
-                for t in unpacked_response.tiles
-            ],
-        )
+        return _decode_map_tiles(self(1, [fact.ModMapTiles()]))
 
-    def player_facts(self, player_id, commands):
-        request = [cmd for _, cmd, _ in commands]
-        # xxx(okachaiev): this one could be drastically simplified
-        # if we follow the convention (factType, factTypeResult)
-        response_types = [(result_key, result_type) for result_key, _, result_type in commands]
-        response = self(player_id, request)
-        response_keys = {}
-        for i, (result_key, result_type) in enumerate(response_types):
-            raw_result = _unpack(response.results[i], result_type)
-            # check if it's array or not
-            if "." in result_key:
-                result_key, _ = result_key.split(".", 1)
-                if result_key in response_keys:
-                    response_keys[result_key].append(raw_result)
-                else:
-                    # xxx(okachaiev): allocations are pretty slow,
-                    # better would be to use statically defined spec
-                    # to allocate arrays with proper length hint
-                    response_keys[result_key] = [raw_result]
+    def visibility(self) -> np.ndarray:
+        """Fetches visibility grid of the map (skipping decoding of other tile attributes)."""
+        return _decode_visibility(self(1, [fact.ModMapTiles()]))
+
+    def compile(self, player_id: int, commands: Facts, layout: Optional[ObservationLayout] = None) -> QueryPlan:
+        """Compiles facts into a reusable plan. Compile once per (player, facts)
+        and pass the plan to `query` on each step."""
+        return QueryPlan(player_id, commands, layout)
+
+    def execute(self, plan: QueryPlan):
+        """Sends pre-built request from the plan, returns raw `CommandResultList`."""
+        try:
+            return self._execute_serialized(plan.request)
+        except grpc.RpcError as e:
+            raise ExpertAPIError() from e
+
+    def execute_many(self, plans: List[QueryPlan], actions: Optional[List[Tuple[int, Actions]]] = None):
+        """Issues all plans concurrently and waits for all of them to finish,
+        so the latency is close to a single round trip rather than N.
+
+        When `actions` are given, each player's actions are sent within the
+        same `CommandList` right before the facts from the plan, so acting
+        and observing takes a single round trip per player. Results for
+        actions are dropped from the responses."""
+        actions_by_player = _actions_by_player(actions or [])
+        futures = []
+        for plan in plans:
+            player_actions = actions_by_player.pop(plan.player_id, [])
+            # plans without facts (e.g. nothing is due for polling) are not sent
+            if plan.keys or player_actions:
+                future = self._execute_serialized.future(_with_actions(plan, player_actions))
+                futures.append((future, len(player_actions)))
             else:
-                response_keys[result_key] = raw_result
-        return response_keys
+                futures.append((None, 0))
+        # players who act but are not observed
+        self.actions(list(actions_by_player.items()))
+        try:
+            return [
+                _strip_actions(future.result(), num_actions) if future is not None else expert.CommandResultList()
+                for future, num_actions in futures
+            ]
+        except grpc.RpcError as e:
+            for future, _ in futures:
+                if future is None: continue
+                future.cancel()
+            raise ExpertAPIError() from e
+
+    def query(self, plan: QueryPlan):
+        return plan.decode(self.execute(plan))
+
+    def query_many(self, plans: List[QueryPlan]):
+        responses = self.execute_many(plans)
+        return [plan.decode(response) for plan, response in zip(plans, responses)]
+
+    def player_facts(self, player_id, commands):
+        return self.query(self.compile(player_id, commands))
 
     def actions(self, actions: List[Tuple[int, Actions]]):
         for player_id, player_actions in actions:
@@ -123,11 +439,107 @@ class ExpertClient:
             if player_actions:
                 self(player_id, player_actions)
 
+    def ready(self, timeout: float) -> bool:
+        """Checks if AI Module server accepts connections and responds to requests."""
+        try:
+            grpc.channel_ready_future(self._channel).result(timeout=timeout)
+            self._aimodule.IsMatchInProgress(aimodule.IsMatchInProgressRequest(), timeout=timeout)
+        except (grpc.FutureTimeoutError, grpc.RpcError):
+            return False
+        return True
+
+    def resolve_consts(self, names: List[str]) -> Dict[str, int]:
+        """Resolves symbolic constant names (all requests are issued concurrently)."""
+        futures = [self._api.ResolveConst.future(expert.ResolveConstRequest(name=name)) for name in names]
+        try:
+            return {name: int(future.result().value) for name, future in zip(names, futures)}
+        except grpc.RpcError as e:
+            for future in futures:
+                future.cancel()
+            if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+                raise ExpertAPIUnsupportedError("ResolveConst is not supported by AI Module.") from e
+            raise ExpertAPIError() from e
+
     def close(self):
         if self._channel is not None:
             self._channel.close()
             self._channel = None
 
+class AsyncExpertClient:
+    """`grpc.aio` counterpart of `ExpertClient`.
+
+    All calls are coroutines, so a single event loop could drive many game
+    processes at the same time. The client should be created from within
+    the event loop it is going to be used with."""
+
+    def __init__(self, host: str, port: int):
+        self._host = host
+        self._port = port
+        self._channel = grpc.aio.insecure_channel(f"{host}:{port}")
+        self._api = expert_grpc.ExpertAPIStub(self._channel)
+        self._execute_serialized = self._channel.unary_unary(
+            EXECUTE_COMMAND_LIST_METHOD,
+            request_serializer=None,
+            response_deserializer=expert.CommandResultList.FromString,
+        )
+
+    async def __call__(self, player_id, commands):
+        try:
+            return await self._api.ExecuteCommandList(_command_list(player_id, commands))
+        except grpc.RpcError as e:
+            raise ExpertAPIError() from e
+
+    async def map_tiles(self) -> MapTiles:
+        return _decode_map_tiles(await self(1, [fact.ModMapTiles()]))
+
+    async def visibility(self) -> np.ndarray:
+        return _decode_visibility(await self(1, [fact.ModMapTiles()]))
+
+    def compile(self, player_id: int, commands: Facts, layout: Optional[ObservationLayout] = None) -> QueryPlan:
+        return QueryPlan(player_id, commands, layout)
+
+    async def execute(self, plan: QueryPlan, player_actions: Optional[Actions] = None):
+        player_actions = player_actions or []
+        if not plan.keys and not player_actions:
+            return expert.CommandResultList()
+        try:
+            response = await self._execute_serialized(_with_actions(plan, player_actions))
+        except grpc.RpcError as e:
+            raise ExpertAPIError() from e
+        return _strip_actions(response, len(player_actions))
+
+    async def execute_many(self, plans: List[QueryPlan], actions: Optional[List[Tuple[int, Actions]]] = None):
+        actions_by_player = _actions_by_player(actions or [])
+        requests = [self.execute(plan, actions_by_player.pop(plan.player_id, [])) for plan in plans]
+        responses, _ = await asyncio.gather(
+            asyncio.gather(*requests),
+            self.actions(list(actions_by_player.items())),
+        )
+        return responses
+
+    async def query(self, plan: QueryPlan):
+        return plan.decode(await self.execute(plan))
+
+    async def query_many(self, plans: List[QueryPlan]):
+        responses = await self.execute_many(plans)
+        return [plan.decode(response) for plan, response in zip(plans, responses)]
+
+    async def player_facts(self, player_id, commands):
+        return await self.query(self.compile(player_id, commands))
+
+    async def actions(self, actions: List[Tuple[int, Actions]]):
+        requests = []
+        for player_id, player_actions in actions:
+            player_actions = list(filter(None, player_actions))
+            if player_actions:
+                requests.append(self(player_id, player_actions))
+        await asyncio.gather(*requests)
+
+    async def close(self):
+        if self._channel is not None:
+            await self._channel.close()
+            self._channel = None
+
 class Resource(IntEnum):
     FOOD = 0
     WOOD = 1
@@ -140,6 +552,12 @@ class AGE(IntEnum):
     CASTLE = 2
     IMPERIAL = 3
 
+class ResearchStatus(IntEnum):
+    UNAVAILABLE = 0
+    AVAILABLE = 1
+    PENDING = 2
+    COMPLETE = 3
+
 @enum_ordering
 class StrategicNumber(Enum):
     PERCENT_CIVILIAN_EXPLORERS = 0
@@ -0,0 +1,142 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Allocation of free TCP ports for game processes and RPC servers, safe across processes.
+
+Each reserved port is backed by an exclusively locked file, so concurrent
+launchers (even from different Python processes) never hand out the same
+port. The OS drops the lock when the holder dies, no stale locks are left.
+"""
+
+import errno
+import logging
+import os
+import os.path
+import socket
+import sys
+import tempfile
+from typing import List, Optional
+
+DEFAULT_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'pyage2-ports')
+DEFAULT_MAX_ATTEMPTS = 64
+
+if sys.platform == "win32":
+    import msvcrt
+
+    def _lock(fd: int) -> bool:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(fd: int):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(fd: int) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+
+    def _unlock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+class PortReservation:
+    """Ports held by lock files until `release` is called."""
+
+    def __init__(self, ports: List[int], fds: List[int]):
+        self.ports = ports
+        self._fds = fds
+
+    @property
+    def released(self) -> bool:
+        return not self._fds
+
+    def release(self):
+        for fd in self._fds:
+            try:
+                _unlock(fd)
+            finally:
+                os.close(fd)
+        self._fds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _exception_traceback):
+        self.release()
+
+    def __repr__(self):
+        return f"PortReservation(ports={self.ports})"
+
+def _free_port(host: str) -> int:
+    """Asks OS for a port that is free right now."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+def _is_free(host: str, port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return False
+    return True
+
+def _lock_port(lock_dir: str, port: int) -> Optional[int]:
+    fd = os.open(os.path.join(lock_dir, f"{port}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    if _lock(fd):
+        return fd
+    os.close(fd)
+    return None
+
+def reserve_ports(num_ports: int,
+                  host: str = "127.0.0.1",
+                  lock_dir: Optional[str] = None,
+                  max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> PortReservation:
+    """Reserves `num_ports` distinct free ports. The caller should `release`
+    them once the server using them is shut down."""
+    lock_dir = lock_dir or DEFAULT_LOCK_DIR
+    os.makedirs(lock_dir, exist_ok=True)
+    ports, fds = [], []
+    for _ in range(max_attempts):
+        if len(ports) == num_ports:
+            break
+        port = _free_port(host)
+        if port in ports:
+            continue
+        fd = _lock_port(lock_dir, port)
+        if fd is None:
+            # reserved by another launcher, the server is not up yet
+            continue
+        # the lock might be taken just after the previous holder's server
+        # has started, re-check the port is still free under the lock
+        if not _is_free(host, port):
+            _unlock(fd)
+            os.close(fd)
+            continue
+        ports.append(port)
+        fds.append(fd)
+    reservation = PortReservation(ports, fds)
+    if len(ports) < num_ports:
+        reservation.release()
+        raise RuntimeError(f"Failed to reserve {num_ports} free ports in {max_attempts} attempts.")
+    logging.debug("Reserved ports %s", ports)
+    return reservation
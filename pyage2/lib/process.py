@@ -0,0 +1,370 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Game process lifecycle: launching, injecting DLLs, connecting and pooling."""
+
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+import logging
+import queue
+import subprocess
+import threading
+import time
+from typing import Optional
+
+import msgpackrpc
+
+from pyage2.lib.configs import RunConfig
+from pyage2.lib.expert import ExpertClient
+from pyage2.lib.ports import PortReservation, reserve_ports
+from pyage2.lib.utils import wait_until
+
+# command line option of aoc-auto-game.dll
+AUTOGAME_PORT_ARG = '-autogameport'
+
+class Age2LaunchError(Exception):
+    pass
+
+class Age2Process:
+    """Game process with both DLLs injected and clients connected to them."""
+
+    def __init__(self,
+                 proc,
+                 autogame_client,
+                 expert_client,
+                 host: str,
+                 autogame_port: int,
+                 aimodule_port: int,
+                 injector=None,
+                 ports: Optional[PortReservation] = None):
+        self.proc = proc
+        self.autogame_client = autogame_client
+        self.expert_client = expert_client
+        self.host = host
+        self.autogame_port = autogame_port
+        self.aimodule_port = aimodule_port
+        self._injector = injector
+        self._ports = ports
+
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def reset(self):
+        """Quits the game in progress (if any), so the process could host
+        another one."""
+        if self.autogame_client.call('GetGameInProgress'):
+            self.autogame_client.call('QuitGame')
+
+    def close(self):
+        """Disconnects clients and terminates the process."""
+        if self._injector is not None:
+            self._injector.close()
+            self._injector = None
+
+        if self.autogame_client is not None:
+            self.autogame_client.close()
+            self.autogame_client = None
+
+        if self.expert_client is not None:
+            self.expert_client.close()
+            self.expert_client = None
+
+        if self.running:
+            self.proc.terminate()
+        self.proc = None
+
+        if self._ports is not None:
+            self._ports.release()
+            self._ports = None
+
+class ProcessBackend:
+    """Knows how to get a ready-to-use `Age2Process`."""
+
+    # how many launched processes could be alive at once, `None` for no limit
+    max_processes: Optional[int] = None
+
+    def launch(self, run_config: RunConfig) -> Age2Process:
+        raise NotImplementedError
+
+class LocalProcessBackend(ProcessBackend):
+    """Runs the game executable on this machine and injects DLLs into it."""
+
+    # aimodule DLL listens on the fixed port (see `RunConfig`)
+    max_processes = 1
+
+    def launch(self, run_config: RunConfig) -> Age2Process:
+        deadline = time.monotonic() + run_config.startup_timeout
+        ports = None
+        if run_config.autogame_port is None:
+            ports = reserve_ports(1, run_config.host)
+            run_config = dataclasses.replace(run_config, autogame_port=ports.ports[0])
+        try:
+            proc, injector = self._launch_process(run_config)
+        except BaseException:
+            if ports is not None:
+                ports.release()
+            raise
+        process = Age2Process(proc, None, None, run_config.host,
+                              run_config.autogame_port, run_config.aimodule_port, injector, ports)
+        try:
+            # inject DLL for running game programmatically
+            process.autogame_client = self._init_autogame(injector, run_config, deadline)
+            # inject DLL to interact with expert facts and actions
+            process.expert_client = self._init_expert_api(injector, run_config, deadline)
+        except BaseException:
+            process.close()
+            raise
+        return process
+
+    # to run the game on one machine and drive it from a different one,
+    # serve environments with `pyage2.env.remote.Age2EnvServer`
+    def _launch_process(self, run_config: RunConfig):
+        # winapi is only available on Windows
+        from pyage2.lib.winapi import LibraryInjector
+
+        try:
+            logging.debug(f"Launching game process %s", run_config.exec_path)
+
+            # xxx(okachaiev): assume i also need to run a background thread
+            # to poll from it periodically to make sure we can close env
+            # properly if the process was killed externally
+            # curious if there's an API to just provide on_close callback or something
+            proc = subprocess.Popen([run_config.exec_path, AUTOGAME_PORT_ARG, str(run_config.autogame_port)])
+        except OSError:
+            logging.exception("Failed to launch game process.")
+            raise Age2LaunchError(f"Failed to launch {run_config.exec_path}")
+
+        logging.debug(f"Game process PID: %s", proc.pid)
+        try:
+            return proc, LibraryInjector(proc.pid)
+        except OSError:
+            proc.terminate()
+            logging.exception("Failed to attach to game process.")
+            raise Age2LaunchError(f"Failed to attach to {run_config.exec_path}")
+
+    def _init_autogame(self, injector, run_config: RunConfig, deadline: float):
+        injector.load_library(run_config.autogame_dll)
+
+        logging.debug("Connecting to autogame Msgpack RPC on %s:%s", run_config.host, run_config.autogame_port)
+
+        if run_config.autogame_connect_delay > 0:
+            time.sleep(run_config.autogame_connect_delay)
+        address = msgpackrpc.Address(run_config.host, run_config.autogame_port)
+        wait_ready("autogame", lambda: self._autogame_ready(address), run_config, deadline)
+        return msgpackrpc.Client(
+            address,
+            timeout=run_config.autogame_timeout,
+            reconnect_limit=run_config.autogame_reconnect_limit
+        )
+
+    def _autogame_ready(self, address) -> bool:
+        # separate short-lived client, so failed attempts do not
+        # leave the main one in reconnecting state
+        probe_client = msgpackrpc.Client(address, timeout=1, reconnect_limit=0)
+        try:
+            probe_client.call('GetGameInProgress')
+            return True
+        finally:
+            probe_client.close()
+
+    def _init_expert_api(self, injector, run_config: RunConfig, deadline: float):
+        # autogame responding doesn't guarantee that the Game struct is
+        # initialized, there's no way to probe for it from outside
+        if run_config.aimodule_load_delay > 0:
+            time.sleep(run_config.aimodule_load_delay)
+        injector.load_library(run_config.aimodule_dll)
+
+        logging.debug("Connecting to aimodule gRPC on %s:%s", run_config.host, run_config.aimodule_port)
+
+        expert_client = ExpertClient(run_config.host, run_config.aimodule_port)
+        try:
+            wait_ready(
+                "aimodule",
+                lambda: expert_client.ready(timeout=run_config.probe_max_delay),
+                run_config,
+                deadline,
+            )
+        except Age2LaunchError:
+            expert_client.close()
+            raise
+        return expert_client
+
+def wait_ready(name: str, probe, run_config: RunConfig, deadline: float):
+    """Probes the server with exponential backoff until it responds or
+    the startup deadline passes."""
+    start = time.monotonic()
+    try:
+        wait_until(
+            probe,
+            deadline,
+            initial_delay=run_config.probe_initial_delay,
+            max_delay=run_config.probe_max_delay,
+        )
+    except TimeoutError as e:
+        raise Age2LaunchError(f"{name} did not become ready within {run_config.startup_timeout}s") from e
+    logging.debug("%s is ready in %.2fs.", name, time.monotonic() - start)
+
+class Age2ProcessPool:
+    """Keeps `size` idle game processes launched and connected in background.
+
+    `lease` hands out a ready process (launching a replacement right away),
+    `release` brings it back to the main menu and returns it to the pool.
+    Processes that died or do not fit into the pool anymore are terminated.
+
+    Leased processes count towards `max_processes` of the backend. With
+    `LocalProcessBackend` only a single game runs per host, so the pool
+    size should be 1 and no replacement is launched while the process is
+    leased, `lease` waits for it to be released instead.
+    """
+
+    def __init__(self,
+                 run_config: RunConfig,
+                 size: int,
+                 backend: Optional[ProcessBackend] = None):
+        assert size > 0, "Pool size should be positive"
+        backend = backend or LocalProcessBackend()
+        assert backend.max_processes is None or size <= backend.max_processes, \
+            f"Backend runs at most {backend.max_processes} processes at once"
+        self._run_config = run_config
+        self._size = size
+        self._backend = backend
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._launching = 0
+        self._leased = 0
+        self._closed = False
+        # extra workers, so recycling is not stuck behind slow launches
+        self._executor = ThreadPoolExecutor(max_workers=2*size, thread_name_prefix="age2-pool")
+        for _ in range(size):
+            self._spawn()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def num_ready(self) -> int:
+        return self._ready.qsize()
+
+    def _spawn(self):
+        # submitting under the lock, so `close` never shuts the executor
+        # down in between the check and the submit
+        with self._lock:
+            num_idle = self._ready.qsize() + self._launching
+            if self._closed or num_idle >= self._size:
+                return
+            limit = self._backend.max_processes
+            if limit is not None and num_idle + self._leased >= limit:
+                return
+            self._launching += 1
+            self._executor.submit(self._launch)
+
+    def _launch(self):
+        try:
+            process = self._backend.launch(self._run_config)
+        except Exception as e:
+            logging.exception("Failed to launch pooled game process.")
+            # handed over to `lease` to be re-raised there
+            process = e
+        with self._lock:
+            self._launching -= 1
+        self._offer(process)
+
+    def _offer(self, process, returned: bool = False):
+        with self._lock:
+            if returned:
+                self._leased -= 1
+            keep = not self._closed and self._ready.qsize() < self._size
+            if keep:
+                self._ready.put(process)
+        if not keep and isinstance(process, Age2Process):
+            process.close()
+
+    def lease(self, timeout: Optional[float] = None) -> Age2Process:
+        """Takes a ready process out of the pool, waiting for one to be
+        launched if necessary."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._closed:
+                raise Age2LaunchError("Process pool is closed.")
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                process = self._ready.get(timeout=remaining)
+            except queue.Empty:
+                raise Age2LaunchError(f"No game process became ready within {timeout}s")
+            if isinstance(process, Exception):
+                self._spawn()
+                raise Age2LaunchError("Pooled game process failed to launch.") from process
+            if process.running:
+                # counted before spawning, so the replacement respects backend limit
+                with self._lock:
+                    self._leased += 1
+                self._spawn()
+                logging.debug("Leased game process PID: %s", process.pid)
+                return process
+            logging.warning("Pooled game process PID %s died while idle.", process.pid)
+            process.close()
+            self._spawn()
+
+    def release(self, process: Age2Process):
+        """Returns a process to the pool. Resetting happens in background."""
+        with self._lock:
+            closed = self._closed
+            if closed:
+                self._leased -= 1
+            else:
+                self._executor.submit(self._recycle, process)
+        if closed:
+            process.close()
+
+    def _recycle(self, process: Age2Process):
+        # the process counts as leased until it is back in the pool or closed
+        if not process.running:
+            logging.warning("Released game process PID %s is not running.", process.pid)
+        else:
+            try:
+                process.reset()
+            except Exception:
+                logging.exception("Failed to recycle game process PID %s.", process.pid)
+            else:
+                self._offer(process, returned=True)
+                return
+        process.close()
+        with self._lock:
+            self._leased -= 1
+        self._spawn()
+
+    def close(self):
+        """Terminates all idle processes. Leased ones are terminated when
+        released."""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                process = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(process, Age2Process):
+                process.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _exception_traceback):
+        self.close()
@@ -0,0 +1,93 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""msgpack-rpc serving loop and helpers shared by all servers."""
+
+import threading
+from typing import Optional
+
+import msgpackrpc
+
+from pyage2.lib.ports import reserve_ports
+
+# how often the serving loop checks if it has to stop
+STOP_POLL_INTERVAL_MS = 100
+
+def decode_strings(value):
+    """msgpack-rpc unpacks strings as raw bytes, decodes them back (within
+    dicts and lists as well)."""
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, dict):
+        return {decode_strings(k): decode_strings(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [decode_strings(v) for v in value]
+    return value
+
+class RpcServer:
+    """Serves `dispatcher` over msgpack-rpc, every public method of the
+    dispatcher is an RPC.
+
+    The loop runs in the current thread with `serve_forever` or in a
+    background one with `start`. When `port` is not given, a free one is
+    reserved (see `reserve_ports`).
+    """
+
+    def __init__(self, dispatcher, host: str = "127.0.0.1", port: Optional[int] = None):
+        self._ports = None
+        if port is None:
+            self._ports = reserve_ports(1, host)
+            port = self._ports.ports[0]
+        self.host = host
+        self.port = port
+        self._stopped = threading.Event()
+        self._thread = None
+        self._loop = msgpackrpc.Loop()
+        self._server = msgpackrpc.Server(dispatcher, loop=self._loop)
+        self._server.listen(msgpackrpc.Address(host, port))
+        self._loop.attach_periodic_callback(self._check_stopped, STOP_POLL_INTERVAL_MS)
+
+    def _check_stopped(self):
+        if self._stopped.is_set():
+            self._loop.stop()
+
+    def serve_forever(self):
+        """Runs the serving loop in the current thread until `stop`."""
+        self._server.start()
+
+    def start(self):
+        """Runs the serving loop in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Stops serving and releases the port."""
+        self.stop()
+        self._server.close()
+        if self._ports is not None:
+            self._ports.release()
+            self._ports = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _exception_traceback):
+        self.close()
@@ -0,0 +1,190 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stand-in implementations of game servers, useful for local testing and
+benchmarking without running the game process."""
+
+from concurrent import futures
+import itertools
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from google.protobuf.any_pb2 import Any
+import grpc
+import msgpackrpc.error
+
+import pyage2.protos.expert.expert_api_pb2_grpc as expert_grpc
+import pyage2.protos.expert.expert_api_pb2 as expert
+from pyage2.lib.configs import RunConfig
+from pyage2.lib.expert import ExpertClient
+from pyage2.lib.process import Age2Process, ProcessBackend
+
+RESULT_TYPE_SUFFIX = "Result"
+
+def _encode_result(value: int) -> bytes:
+    """Encodes `{result: value}` message (int32 field #1) by hand, so the
+    servicer does not need to know concrete result types."""
+    if value == 0:
+        return b""
+    value &= (1 << 64) - 1
+    encoded = bytearray(b"\x08")
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            encoded.append(bits | 0x80)
+        else:
+            encoded.append(bits)
+            return bytes(encoded)
+
+def random_result(type_url: str) -> int:
+    return random.randint(0, 1)
+
+class FakeExpertServicer(expert_grpc.ExpertAPIServicer):
+    """Responds to each fact with `{fact}Result` message after artificial delay."""
+
+    def __init__(self, latency: float = 0.0, result_fn: Optional[Callable[[str], int]] = None):
+        self.latency = latency
+        self.result_fn = result_fn or random_result
+        self.num_requests = 0
+
+    def ExecuteCommandList(self, request, context):
+        self.num_requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        response = expert.CommandResultList()
+        for command in request.commands:
+            response.results.append(Any(
+                type_url=command.type_url + RESULT_TYPE_SUFFIX,
+                value=_encode_result(self.result_fn(command.type_url)),
+            ))
+        return response
+
+def serve_fake_expert(servicer: FakeExpertServicer, host: str = "127.0.0.1", port: int = 0, max_workers: int = 8):
+    """Starts gRPC server with a given servicer. Returns (server, port)."""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    expert_grpc.add_ExpertAPIServicer_to_server(servicer, server)
+    port = server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server, port
+
+class _Result:
+    """Mimics `msgpackrpc.future.Future` for results known upfront."""
+
+    def __init__(self, value=None, error=None):
+        self._value = value
+        self._error = error
+
+    def get(self):
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+class FakeAutogameClient:
+    """In-memory stand-in for autogame msgpack-rpc client. Game time runs
+    `speed` times faster than the wall clock once the game is started."""
+
+    def __init__(self, num_players: int = 8, speed: float = 1.0):
+        self.num_players = num_players
+        self.speed = speed
+        self.settings = {}
+        self.in_progress = False
+        self.started_at = None
+        self.num_calls = 0
+        self._lock = threading.Lock()
+
+    def call(self, method: str, *args):
+        with self._lock:
+            self.num_calls += 1
+            if method.startswith('Set'):
+                self.settings[method] = args
+                return True
+            if method == 'ResetGameSettings':
+                self.settings = {}
+                return True
+            if method in ('StartGame', 'RestartGame'):
+                self.in_progress = True
+                self.started_at = time.monotonic()
+                return True
+            if method == 'QuitGame':
+                self.in_progress = False
+                return True
+            if method == 'GetGameInProgress':
+                return self.in_progress
+            if method == 'GetGameTime':
+                if self.started_at is None:
+                    return 0.0
+                return (time.monotonic() - self.started_at) * self.speed
+            if method == 'GetWinningPlayers':
+                return []
+            if method == 'GetPlayerAlive':
+                return self.in_progress
+            raise msgpackrpc.error.RPCError(f"Unknown method {method}")
+
+    def call_async(self, method: str, *args):
+        try:
+            return _Result(self.call(method, *args))
+        except msgpackrpc.error.RPCError as e:
+            return _Result(error=e)
+
+    def close(self):
+        pass
+
+class FakeProc:
+    """Mimics `subprocess.Popen` of the game process."""
+
+    _pids = itertools.count(1)
+
+    def __init__(self, on_terminate: Optional[Callable[[], None]] = None):
+        self.pid = next(self._pids)
+        self.returncode = None
+        self._on_terminate = on_terminate
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        if self.returncode is None:
+            self.returncode = -15
+            if self._on_terminate is not None:
+                self._on_terminate()
+
+class FakeProcessBackend(ProcessBackend):
+    """Launches "processes" backed by `FakeAutogameClient` and a local fake
+    Expert API server, after `launch_delay` seconds of pretended startup."""
+
+    def __init__(self,
+                 launch_delay: float = 0.0,
+                 servicer_fn: Optional[Callable[[], FakeExpertServicer]] = None,
+                 speed: float = 1.0):
+        self.launch_delay = launch_delay
+        self.servicer_fn = servicer_fn or FakeExpertServicer
+        self.speed = speed
+        self.num_launched = 0
+
+    def launch(self, run_config: RunConfig) -> Age2Process:
+        if self.launch_delay > 0:
+            time.sleep(self.launch_delay)
+        self.num_launched += 1
+        server, port = serve_fake_expert(self.servicer_fn(), run_config.host)
+        proc = FakeProc(on_terminate=lambda: server.stop(None))
+        return Age2Process(
+            proc,
+            FakeAutogameClient(speed=self.speed),
+            ExpertClient(run_config.host, port),
+            run_config.host,
+            run_config.autogame_port,
+            port,
+        )
\ No newline at end of file
@@ -0,0 +1,91 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""On-disk cache of decoded map tiles."""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from pyage2.lib.expert import MapTiles
+
+SCENARIO_FOLDER = 'Scenario'
+SCENARIO_EXTENSIONS = ('', '.scx', '.scn')
+
+def find_scenario(exec_path: str, scenario_name: str) -> Optional[Path]:
+    """Looks up scenario file in the game installation folder."""
+    # the executable lives in a sub-folder, e.g. Age2_x1
+    folder = Path(exec_path).parent.parent.joinpath(SCENARIO_FOLDER)
+    for extension in SCENARIO_EXTENSIONS:
+        path = folder.joinpath(scenario_name + extension)
+        if path.is_file():
+            return path
+    return None
+
+class MapTilesCache:
+    """Content-addressed cache of decoded tile grids stored as `.npy` files.
+
+    Entries are keyed by the scenario (its name and file content), so
+    repeated scenarios are loaded by memory-mapping the file rather than
+    through RPC. Random maps are generated anew every game and never cached.
+    Grids are mapped copy-on-write, in-place updates (e.g. visibility)
+    never touch the file.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(os.path.expanduser(directory))
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        digest = hashlib.sha1()
+        for part in parts:
+            if not isinstance(part, bytes):
+                part = repr(part).encode("utf-8")
+            digest.update(len(part).to_bytes(4, "little"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(f"{key}.npy")
+
+    def load(self, key: str) -> Optional[MapTiles]:
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        try:
+            grids = np.load(path, mmap_mode='c')
+        except (OSError, ValueError):
+            logging.warning("Failed to load map tiles from cache %s.", path)
+            return None
+        logging.debug("Map tiles are loaded from cache %s.", path)
+        return MapTiles(height=grids[0], terrain=grids[1], visibility=grids[2])
+
+    def store(self, key: str, tiles: MapTiles):
+        grids = np.stack([tiles.height, tiles.terrain, tiles.visibility])
+        # write to a temp file first, so concurrent readers never
+        # see partially written entry
+        fd, tmp_path = tempfile.mkstemp(suffix=".npy", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, grids)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            logging.exception("Failed to store map tiles into cache.")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
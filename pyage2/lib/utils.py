@@ -12,8 +12,37 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+from typing import Callable, Tuple, Type
+
 def enum_ordering(cls):
     """Takes in Enum class and injects index to have quick access to
     a positional index of a given member."""
     setattr(cls, '__members_position__', {member:i for (i, member) in enumerate(cls)})
-    return cls
\ No newline at end of file
+    return cls
+
+def wait_until(probe: Callable[[], bool],
+               deadline: float,
+               *,
+               initial_delay: float = 0.05,
+               max_delay: float = 1.0,
+               backoff: float = 2.0,
+               exceptions: Tuple[Type[BaseException], ...] = (Exception,)):
+    """Calls `probe` until it returns truthy value, sleeping in between with
+    exponential backoff. Exceptions raised by the probe are treated as "not
+    ready yet". `deadline` is given in terms of `time.monotonic()`.
+
+    Raises `TimeoutError` when the deadline has passed."""
+    delay = initial_delay
+    last_error = None
+    while True:
+        try:
+            if probe():
+                return
+        except exceptions as e:
+            last_error = e
+        now = time.monotonic()
+        if now >= deadline:
+            raise TimeoutError("Deadline exceeded while waiting for readiness.") from last_error
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * backoff, max_delay)
\ No newline at end of file
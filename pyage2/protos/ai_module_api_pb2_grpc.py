@@ -2,7 +2,7 @@
 """Client and server classes corresponding to protobuf-defined services."""
 import grpc
 
-from protos import ai_module_api_pb2 as protos_dot_ai__module__api__pb2
+from pyage2.protos import ai_module_api_pb2 as protos_dot_ai__module__api__pb2
 
 
 class AIModuleAPIStub(object):
@@ -0,0 +1,36 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from pyage2.lib.configs import (DEFAULT_AIMODULE, DEFAULT_AIMODULE_PORT, DEFAULT_AUTOGAME, DEFAULT_AUTOGAME_PORT,
+                                GameConfig, PlayerConfig, RunConfig)
+
+@pytest.fixture
+def run_config():
+    # fake backends never launch the executable
+    return RunConfig(
+        exec_path="age2_x1.5.exe",
+        autogame_dll=DEFAULT_AUTOGAME,
+        aimodule_dll=DEFAULT_AIMODULE,
+        autogame_port=DEFAULT_AUTOGAME_PORT,
+        aimodule_port=DEFAULT_AIMODULE_PORT,
+    )
+
+@pytest.fixture
+def game_config():
+    game_config = GameConfig()
+    game_config.add_player(PlayerConfig.create(agent="pyage2.agents.BaseAgent"))
+    game_config.add_player(PlayerConfig.create(agent="pyage2.agents.BaseAgent"))
+    return game_config.validate()
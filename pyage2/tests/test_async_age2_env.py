@@ -0,0 +1,103 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import dataclasses
+
+from google.protobuf.any_pb2 import Any
+import numpy as np
+import pytest
+
+import pyage2.expert.fact.fact_pb2 as fact
+from pyage2.env.async_age2_env import AsyncAge2Env
+from pyage2.lib.configs import GameType
+from pyage2.lib.testing import FakeExpertServicer, FakeProcessBackend
+
+MAP_SIZE = (3, 4)
+SCENARIO_NAME = "arena"
+
+class _MapServicer(FakeExpertServicer):
+    """Answers `ModMapTiles` with a small map and counts such requests."""
+
+    def __init__(self):
+        super().__init__()
+        self.map_requests = 0
+
+    def ExecuteCommandList(self, request, context):
+        response = super().ExecuteCommandList(request, context)
+        for command, result in zip(request.commands, response.results):
+            if command.type_url.split('.')[-1] == 'ModMapTiles':
+                self.map_requests += 1
+                result.Pack(_map_tiles_result())
+        return response
+
+def _map_tiles_result():
+    map_height, map_width = MAP_SIZE
+    result = fact.ModMapTilesResult(mapHeight=map_height, mapWidth=map_width)
+    for y in range(map_height):
+        for x in range(map_width):
+            result.tiles.add(x=x, y=y, height=y, terrain=x, visibility=1)
+    return result
+
+@pytest.fixture
+def servicers():
+    return []
+
+@pytest.fixture
+def backend(servicers):
+    def servicer_fn():
+        servicer = _MapServicer()
+        servicers.append(servicer)
+        return servicer
+    return FakeProcessBackend(servicer_fn=servicer_fn)
+
+@pytest.fixture
+def cached_run_config(run_config, tmp_path):
+    # executable lives in a sub-folder, scenarios are next to it
+    exec_path = tmp_path / "game" / "Age2_x1" / "age2_x1.5.exe"
+    exec_path.parent.mkdir(parents=True)
+    exec_path.touch()
+    scenario = tmp_path / "game" / "Scenario" / f"{SCENARIO_NAME}.scx"
+    scenario.parent.mkdir()
+    scenario.write_bytes(b"scenario")
+    return dataclasses.replace(run_config, exec_path=str(exec_path), map_cache_dir=str(tmp_path / "cache"))
+
+async def _play(env, num_episodes: int):
+    tiles = []
+    for _ in range(num_episodes):
+        obs, _ = await env.reset()
+        await env.step([])
+        tiles.append(obs.tiles)
+    await env.aclose()
+    return tiles
+
+def test_scenario_map_tiles_are_cached(cached_run_config, game_config, backend, servicers, tmp_path):
+    game_config = dataclasses.replace(game_config, game_type=GameType.SCENARIO, scenario_name=SCENARIO_NAME)
+    with AsyncAge2Env(cached_run_config, game_config, process_backend=backend) as env:
+        tiles = asyncio.run(_play(env, 2))
+    with AsyncAge2Env(cached_run_config, game_config, process_backend=backend) as env:
+        tiles += asyncio.run(_play(env, 1))
+    # fetched once, the following episodes are served from the cache
+    assert sum(servicer.map_requests for servicer in servicers) == 1
+    assert len(list((tmp_path / "cache").glob("*.npy"))) == 1
+    for episode_tiles in tiles:
+        assert episode_tiles.shape == MAP_SIZE
+        np.testing.assert_array_equal(episode_tiles.terrain, np.tile(np.arange(MAP_SIZE[1]), (MAP_SIZE[0], 1)))
+
+def test_random_map_tiles_are_not_cached(cached_run_config, game_config, backend, servicers, tmp_path):
+    with AsyncAge2Env(cached_run_config, game_config, process_backend=backend) as env:
+        tiles = asyncio.run(_play(env, 2))
+    assert sum(servicer.map_requests for servicer in servicers) == 2
+    assert list((tmp_path / "cache").glob("*.npy")) == []
+    assert all(episode_tiles.shape == MAP_SIZE for episode_tiles in tiles)
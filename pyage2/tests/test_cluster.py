@@ -0,0 +1,234 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from pyage2.env.age2_env import Age2Env
+from pyage2.env.cluster import (ClusterCoordinator, ClusterWorker, ClusterWorkerServer, EpisodeResult,
+                                EpisodeSpec, RemoteClusterWorker, WorkerStatus)
+from pyage2.lib.configs import GameConfig, PlayerConfig
+from pyage2.lib.testing import FakeProcessBackend
+
+TIMEOUT_SECONDS = 30
+
+class _ScriptedWorker:
+    """Worker that reports progress and results given by the test."""
+
+    def __init__(self, worker_id: str, capacity: int, accept: bool = True):
+        self.worker_id = worker_id
+        self.capacity = capacity
+        self.accept = accept
+        self.submitted = []
+        self.cancelled = []
+        self.running = {}
+        self.step_rate = 0.0
+        self.results = []
+        self.error = None
+
+    def submit(self, spec):
+        if not self.accept:
+            return False
+        self.submitted.append(spec)
+        self.running[spec.episode_id] = 0
+        return True
+
+    def cancel(self, episode_id):
+        self.cancelled.append(episode_id)
+        self.running.pop(episode_id, None)
+
+    def progress(self, steps, step_rate):
+        """Sets steps played for each running episode (in submit order)."""
+        for episode_id, episode_steps in zip(list(self.running), steps):
+            self.running[episode_id] = episode_steps
+        self.step_rate = step_rate
+
+    def finish(self, episode_id, error=None):
+        steps = self.running.pop(episode_id)
+        self.results.append(EpisodeResult(episode_id, self.worker_id, steps=steps, error=error))
+
+    def poll(self):
+        if self.error is not None:
+            raise self.error
+        results, self.results = self.results, []
+        return WorkerStatus(self.worker_id, self.capacity, dict(self.running), self.step_rate, results)
+
+    def close(self):
+        pass
+
+def _specs(num_episodes):
+    return [EpisodeSpec(GameConfig()) for _ in range(num_episodes)]
+
+def _coordinator(*workers, **kwargs):
+    coordinator = ClusterCoordinator(**kwargs)
+    for worker in workers:
+        coordinator.register(worker.worker_id, worker, worker.capacity)
+    return coordinator
+
+def test_assigns_episodes_to_free_slots():
+    first, second = _ScriptedWorker('first', 2), _ScriptedWorker('second', 1)
+    coordinator = _coordinator(first, second)
+    for spec in _specs(4):
+        coordinator.submit(spec)
+    coordinator.tick()
+    assert len(first.submitted) == 2
+    assert len(second.submitted) == 1
+    assert coordinator.num_unfinished == 4
+
+def test_prefers_faster_worker():
+    fast, slow = _ScriptedWorker('fast', 2), _ScriptedWorker('slow', 2)
+    coordinator = _coordinator(fast, slow)
+    for spec in _specs(2):
+        coordinator.submit(spec)
+    coordinator.tick()
+    assert len(fast.submitted) == len(slow.submitted) == 1
+    fast.progress([50], step_rate=10.0)
+    slow.progress([5], step_rate=1.0)
+    coordinator.submit(EpisodeSpec(GameConfig()))
+    coordinator.tick()
+    assert len(fast.submitted) == 2
+    assert len(slow.submitted) == 1
+
+def test_streams_results():
+    worker = _ScriptedWorker('worker', 2)
+    coordinator = _coordinator(worker)
+    specs = _specs(2)
+    for spec in specs:
+        coordinator.submit(spec)
+    coordinator.tick()
+    for spec in specs:
+        worker.finish(spec.episode_id)
+    coordinator.tick()
+    results = list(coordinator.results(timeout=1))
+    assert sorted(r.episode_id for r in results) == sorted(spec.episode_id for spec in specs)
+    assert all(r.ok for r in results)
+    assert coordinator.num_unfinished == 0
+
+def test_failed_episode_is_retried_up_to_max_attempts():
+    worker = _ScriptedWorker('worker', 1)
+    coordinator = _coordinator(worker, max_attempts=2)
+    spec = EpisodeSpec(GameConfig())
+    coordinator.submit(spec)
+    coordinator.tick()
+    worker.finish(spec.episode_id, error="boom")
+    coordinator.tick()
+    # re-submitted right away
+    assert [s.episode_id for s in worker.submitted] == [spec.episode_id] * 2
+    assert spec.attempts == 1
+    worker.finish(spec.episode_id, error="boom")
+    coordinator.tick()
+    result = next(coordinator.results(timeout=1))
+    assert result.error == "boom"
+    assert coordinator.num_unfinished == 0
+    assert len(worker.submitted) == 2
+
+def test_busy_worker_is_skipped():
+    busy, free = _ScriptedWorker('busy', 2, accept=False), _ScriptedWorker('free', 1)
+    coordinator = _coordinator(busy, free)
+    for spec in _specs(2):
+        coordinator.submit(spec)
+    coordinator.tick()
+    assert len(free.submitted) == 1
+    busy.accept = True
+    free.finish(free.submitted[0].episode_id)
+    coordinator.tick()
+    assert len(busy.submitted) + len(free.submitted) == 2
+
+def _slow_worker_setup(**kwargs):
+    fast, slow = _ScriptedWorker('fast', 4), _ScriptedWorker('slow', 4)
+    coordinator = _coordinator(fast, slow, **kwargs)
+    for spec in _specs(8):
+        coordinator.submit(spec)
+    coordinator.tick()
+    assert len(fast.submitted) == len(slow.submitted) == 4
+    fast.progress([10, 10, 10, 10], step_rate=40.0)
+    slow.progress([5, 1, 3, 2], step_rate=4.0)
+    coordinator.tick()
+    return coordinator, fast, slow
+
+def test_slow_worker_moves_least_advanced_episodes():
+    coordinator, fast, slow = _slow_worker_setup(min_episode_seconds=0)
+    # 1 step/s per episode against 10 on the fast one, capacity is reduced to 1
+    moved = [spec.episode_id for spec in slow.submitted[1:]]
+    assert sorted(slow.cancelled) == sorted(moved)
+    assert list(slow.running) == [slow.submitted[0].episode_id]
+    assert coordinator.num_unfinished == 8
+    # moved episodes go to the first free slot
+    fast.finish(fast.submitted[0].episode_id)
+    coordinator.tick()
+    assert len(slow.submitted) == 4
+    assert fast.submitted[-1].episode_id in moved
+
+def test_young_episodes_are_not_moved():
+    _, _, slow = _slow_worker_setup(min_episode_seconds=60)
+    assert slow.cancelled == []
+
+def test_slow_worker_recovers_capacity():
+    coordinator, fast, slow = _slow_worker_setup(min_episode_seconds=0)
+    slow_state = coordinator._workers['slow']
+    assert slow_state.limit == 1
+    # the rate is smoothed, so capacity comes back after a few polls
+    slow.progress([10], step_rate=10.0)
+    coordinator.tick()
+    assert slow_state.limit == 1
+    for _ in range(10):
+        coordinator.tick()
+        if slow_state.limit is None:
+            break
+    assert slow_state.limit is None
+
+def test_dead_worker_episodes_are_moved():
+    dying, alive = _ScriptedWorker('dying', 2), _ScriptedWorker('alive', 2)
+    coordinator = _coordinator(dying, alive, heartbeat_timeout=0)
+    for spec in _specs(4):
+        coordinator.submit(spec)
+    coordinator.tick()
+    lost = [spec.episode_id for spec in dying.submitted]
+    assert len(lost) == 2
+    dying.error = ConnectionError("worker is gone")
+    for spec in alive.submitted:
+        alive.finish(spec.episode_id)
+    coordinator.tick()
+    assert 'dying' not in coordinator._workers
+    assert sorted(spec.episode_id for spec in alive.submitted[2:]) == sorted(lost)
+    assert all(spec.attempts == 1 for spec in alive.submitted[2:])
+    assert coordinator.num_unfinished == 2
+
+def _game_config():
+    game_config = GameConfig()
+    game_config.add_player(PlayerConfig.create(agent="pyage2.agents.BaseAgent"))
+    game_config.add_player(PlayerConfig.create(agent="pyage2.agents.BaseAgent"))
+    return game_config.validate()
+
+def test_plays_episodes_on_fake_backend(run_config):
+    backend = FakeProcessBackend()
+    env_fn = lambda game_config: Age2Env(run_config, game_config, process_backend=backend)
+    local = ClusterWorker('local', env_fn, capacity=2)
+    server = ClusterWorkerServer(ClusterWorker('remote', env_fn, capacity=1)).start()
+    remote = RemoteClusterWorker(server.host, server.port)
+    coordinator = ClusterCoordinator(poll_interval=0.05)
+    coordinator.register('local', local, 2)
+    coordinator.register('remote', remote, 1)
+    specs = [EpisodeSpec(_game_config(), max_steps=3) for _ in range(5)]
+    try:
+        with coordinator.start():
+            results = list(coordinator.run(specs, timeout=TIMEOUT_SECONDS))
+    finally:
+        remote.close()
+        server.close()
+        local.close()
+    assert sorted(r.episode_id for r in results) == sorted(spec.episode_id for spec in specs)
+    assert all(r.ok for r in results), [r.error for r in results]
+    assert all(r.steps == 3 for r in results)
+    assert {r.worker_id for r in results} <= {'local', 'remote'}
+    assert backend.num_launched == len(specs)
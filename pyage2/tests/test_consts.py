@@ -0,0 +1,134 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import grpc
+import pytest
+
+import pyage2.protos.expert.expert_api_pb2 as expert
+from pyage2.lib.consts import ConstResolver, fallback_const, version_fingerprint
+from pyage2.lib.expert import ExpertClient, ObjectType, StrategicNumber, TechType
+from pyage2.lib.testing import FakeExpertServicer, serve_fake_expert
+
+CONSTS = {'villager': 83, 'archer': 4, 'militiaman': 74, 'loom': 22}
+
+class _ConstServicer(FakeExpertServicer):
+    """Resolves names from `CONSTS` and counts requests."""
+
+    def __init__(self):
+        super().__init__()
+        self.resolved = []
+
+    def ResolveConst(self, request, context):
+        self.resolved.append(request.name)
+        if request.name not in CONSTS:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Unknown constant {request.name}")
+        return expert.ResolveConstResponse(value=CONSTS[request.name])
+
+class _UnsupportedServicer(FakeExpertServicer):
+    """Same as AI Module, leaves `ResolveConst` unimplemented."""
+
+    def __init__(self):
+        super().__init__()
+        self.num_resolve_requests = 0
+
+    def ResolveConst(self, request, context):
+        self.num_resolve_requests += 1
+        return super().ResolveConst(request, context)
+
+def _serve(servicer):
+    server, port = serve_fake_expert(servicer)
+    client = ExpertClient("127.0.0.1", port)
+    return server, client
+
+@pytest.fixture
+def servicer():
+    return _ConstServicer()
+
+@pytest.fixture
+def client(servicer):
+    server, client = _serve(servicer)
+    yield client
+    client.close()
+    server.stop(None)
+
+def test_resolves_misses_only(servicer, client):
+    resolver = ConstResolver(client, "v1")
+    assert resolver.resolve_many(['villager', 'archer', 'villager']) == {'villager': 83, 'archer': 4}
+    assert sorted(servicer.resolved) == ['archer', 'villager']
+    assert resolver.resolve('archer') == 4
+    assert resolver.resolve_many(['archer', 'loom']) == {'archer': 4, 'loom': 22}
+    assert sorted(servicer.resolved) == ['archer', 'loom', 'villager']
+
+def test_lru_eviction(servicer, client):
+    resolver = ConstResolver(client, "v1", maxsize=2)
+    resolver.resolve('villager')
+    resolver.resolve('archer')
+    # hit makes `villager` the most recently used one, `archer` is evicted
+    resolver.resolve('villager')
+    resolver.resolve('loom')
+    del servicer.resolved[:]
+    resolver.resolve('villager')
+    resolver.resolve('loom')
+    assert servicer.resolved == []
+    resolver.resolve('archer')
+    assert servicer.resolved == ['archer']
+
+def test_persisted_per_version(servicer, client, tmp_path):
+    exec_path, dll_path = tmp_path / "age2_x1.5.exe", tmp_path / "aimodule-aoc.dll"
+    exec_path.write_bytes(b"game")
+    dll_path.write_bytes(b"dll")
+    version = version_fingerprint(str(exec_path), str(dll_path))
+    cache_dir = tmp_path / "consts"
+
+    first = ConstResolver(client, version, str(cache_dir))
+    first.resolve_many(['villager', 'loom'])
+    assert (cache_dir / f"consts-{version}.json").is_file()
+
+    del servicer.resolved[:]
+    second = ConstResolver(client, version, str(cache_dir))
+    assert second.resolve_many(['loom', 'villager']) == {'loom': 22, 'villager': 83}
+    assert servicer.resolved == []
+
+    # a different build of the DLL resolves everything anew
+    dll_path.write_bytes(b"patched dll")
+    patched = version_fingerprint(str(exec_path), str(dll_path))
+    assert patched != version
+    ConstResolver(client, patched, str(cache_dir)).resolve('loom')
+    assert servicer.resolved == ['loom']
+
+def test_falls_back_to_hardcoded_enums(tmp_path):
+    servicer = _UnsupportedServicer()
+    server, client = _serve(servicer)
+    try:
+        resolver = ConstResolver(client, "v1", str(tmp_path))
+        assert resolver.resolve('villager') == ObjectType.VILLAGER
+        assert resolver.resolve_many(['ri-loom', 'sn-cap-civilian-builders']) == {
+            'ri-loom': TechType.LOOM,
+            'sn-cap-civilian-builders': StrategicNumber.CAP_CIVILIAN_BUILDERS.value,
+        }
+        # AI Module is asked only once
+        assert servicer.num_resolve_requests == 1
+        with pytest.raises(KeyError):
+            resolver.resolve('no-such-thing')
+        assert list(tmp_path.iterdir()) == []
+    finally:
+        client.close()
+        server.stop(None)
+
+def test_fallback_const():
+    assert fallback_const('villager') == ObjectType.VILLAGER
+    assert fallback_const('ARCHER') == ObjectType.ARCHER
+    assert fallback_const('ri-loom') == TechType.LOOM
+    with pytest.raises(KeyError):
+        fallback_const('ri-villager')
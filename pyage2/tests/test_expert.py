@@ -0,0 +1,85 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+
+from google.protobuf import wrappers_pb2
+import numpy as np
+import pytest
+
+from pyage2.lib.expert import ExpertAPIError, MapTiles, ObservationLayout, _read_result, _read_varint
+
+@pytest.mark.parametrize("data, expected", [
+    (b"\x01", (1, 1)),
+    (b"\x7f", (127, 1)),
+    (b"\xac\x02", (300, 2)),
+    (b"\xff\xff\xff\xff\x07", (2**31 - 1, 5)),
+])
+def test_read_varint(data, expected):
+    assert _read_varint(data, 0) == expected
+
+def test_read_varint_from_position():
+    assert _read_varint(b"\x08\xac\x02\x01", 1) == (300, 3)
+
+@pytest.mark.parametrize("value", [0, 1, 150, -1, -150, 2**31 - 1, -2**31])
+def test_read_result_matches_protobuf(value):
+    # any message with int32 field #1 is encoded the same way as fact results
+    data = wrappers_pb2.Int32Value(value=value).SerializeToString()
+    assert _read_result(data) == value
+
+def test_read_result_default_value():
+    assert _read_result(b"") == 0
+
+def test_read_result_skips_other_fields():
+    data = b"".join([
+        b"\x10\x05",                # field 2, varint
+        b"\x1a\x02ab",              # field 3, length-delimited
+        b"\x21" + b"\x00" * 8,      # field 4, fixed64
+        b"\x2d" + b"\x00" * 4,      # field 5, fixed32
+        b"\x08\x07",                # field 1, varint
+    ])
+    assert _read_result(data) == 7
+
+def test_read_result_unexpected_wire_type():
+    # field 1, deprecated start group
+    with pytest.raises(ExpertAPIError):
+        _read_result(b"\x0b")
+
+def _layout():
+    return ObservationLayout({'score': (1,), 'resources': (4,), 'tiles': MapTiles})
+
+def test_layout_offsets():
+    layout = _layout()
+    assert layout.size == 5
+    assert layout.offset('score') == 0
+    assert layout.offset('resources.2') == 3
+
+def test_batch_index_groups_fields():
+    index = _layout().batch_index(2)
+    assert index.shape == (2, 5)
+    # scores of both players go first, then resources of each player
+    np.testing.assert_array_equal(index[0], [0, 2, 3, 4, 5])
+    np.testing.assert_array_equal(index[1], [1, 6, 7, 8, 9])
+
+def test_batch_index_is_permutation():
+    index = _layout().batch_index(3)
+    np.testing.assert_array_equal(np.sort(index.ravel()), np.arange(15))
+
+def test_batch_index_is_cached_per_num_players():
+    layout = _layout()
+    assert layout.batch_index(2) is layout.batch_index(2)
+    assert layout.batch_index(3).shape == (3, 5)
+    restored = pickle.loads(pickle.dumps(layout))
+    assert restored._batch_index == {}
+    np.testing.assert_array_equal(restored.batch_index(2), layout.batch_index(2))
@@ -0,0 +1,88 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from pyage2.env.observations import DeltaDecoder, DeltaEncoder, ObservationBatch
+from pyage2.lib.expert import MapTiles, ObservationLayout
+
+NUM_PLAYERS = 2
+
+@pytest.fixture
+def layout():
+    return ObservationLayout({'score': (1,), 'resources': (4,), 'tiles': MapTiles})
+
+def _batch(layout, score, resources, alive=(1, 1)):
+    batch = ObservationBatch(layout, NUM_PLAYERS)
+    batch['score'][:] = score
+    batch['resources'][:] = resources
+    batch['alive'][:] = alive
+    return batch
+
+def _assert_same(left, right):
+    np.testing.assert_array_equal(left.data, right.data)
+    for name in left.fields:
+        np.testing.assert_array_equal(left[name], right[name])
+
+def test_snapshot_every_interval(layout):
+    encoder = DeltaEncoder(snapshot_interval=3)
+    deltas = [encoder.encode(_batch(layout, [step, 0], 0)) for step in range(7)]
+    assert [delta.is_snapshot for delta in deltas] == [True, False, False, True, False, False, True]
+    assert [delta.step for delta in deltas] == list(range(7))
+
+def test_delta_contains_only_changes(layout):
+    encoder = DeltaEncoder(snapshot_interval=100)
+    encoder.encode(_batch(layout, [1, 2], 5))
+    batch = _batch(layout, [1, 3], 5)
+    batch['resources'][0, 2] = 7
+    delta = encoder.encode(batch)
+    assert not delta.is_snapshot
+    np.testing.assert_array_equal(delta.indices, [1, 4])
+    np.testing.assert_array_equal(delta.values, [3, 7])
+    changes = delta.changes(layout, NUM_PLAYERS)
+    assert sorted(changes) == ['resources', 'score']
+    np.testing.assert_array_equal(changes['score'][0], [1])
+    np.testing.assert_array_equal(changes['resources'][0], [2])
+
+def test_decoder_reconstructs_batches(layout):
+    encoder = DeltaEncoder(snapshot_interval=4)
+    decoder = DeltaDecoder()
+    rng = np.random.default_rng(0)
+    for step in range(10):
+        batch = _batch(layout, rng.integers(0, 3, NUM_PLAYERS), rng.integers(0, 3, (NUM_PLAYERS, 4)),
+                       alive=(1, step < 5))
+        _assert_same(decoder.apply(encoder.encode(batch)), batch)
+
+def test_decoder_does_not_modify_returned_batches(layout):
+    encoder = DeltaEncoder(snapshot_interval=100)
+    decoder = DeltaDecoder()
+    first = decoder.apply(encoder.encode(_batch(layout, [1, 1], 0)))
+    decoder.apply(encoder.encode(_batch(layout, [2, 2], 1, alive=(0, 0))))
+    _assert_same(first, _batch(layout, [1, 1], 0))
+
+def test_decoder_requires_snapshot(layout):
+    encoder = DeltaEncoder(snapshot_interval=100)
+    encoder.encode(_batch(layout, [1, 1], 0))
+    delta = encoder.encode(_batch(layout, [2, 2], 0))
+    with pytest.raises(ValueError):
+        DeltaDecoder().apply(delta)
+
+def test_encoder_reset_starts_with_snapshot(layout):
+    encoder = DeltaEncoder(snapshot_interval=100)
+    encoder.encode(_batch(layout, [1, 1], 0))
+    encoder.reset()
+    delta = encoder.encode(_batch(layout, [1, 1], 0))
+    assert delta.is_snapshot
+    assert delta.step == 0
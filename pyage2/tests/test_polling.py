@@ -0,0 +1,65 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from pyage2.env.polling import PollSchedule
+
+FIELDS = ['score', 'can_build', 'current_age']
+
+def test_all_fields_due_on_first_step():
+    schedule = PollSchedule(steps={'can_build': 10}, game_seconds={'current_age': 5.0})
+    assert schedule.due(FIELDS, 0, 0.0) == frozenset(FIELDS)
+
+def test_step_period():
+    schedule = PollSchedule(steps={'can_build': 3})
+    due = [schedule.due(FIELDS, step, 0.0) for step in range(7)]
+    assert [step for step, fields in enumerate(due) if 'can_build' in fields] == [0, 3, 6]
+    # fields that are not listed are polled on each step
+    assert all('score' in fields for fields in due)
+
+def test_game_seconds_period():
+    schedule = PollSchedule(game_seconds={'current_age': 5.0})
+    times = [0.0, 2.0, 4.9, 5.0, 9.0, 10.5]
+    polled = [t for step, t in enumerate(times) if 'current_age' in schedule.due(FIELDS, step, t)]
+    assert polled == [0.0, 5.0, 10.5]
+
+def test_either_period_makes_field_due():
+    schedule = PollSchedule(steps={'current_age': 10}, game_seconds={'current_age': 5.0})
+    assert 'current_age' in schedule.due(FIELDS, 0, 0.0)
+    assert 'current_age' not in schedule.due(FIELDS, 1, 1.0)
+    assert 'current_age' in schedule.due(FIELDS, 2, 6.0)
+    assert 'current_age' in schedule.due(FIELDS, 12, 7.0)
+
+def test_age():
+    schedule = PollSchedule(steps={'can_build': 10})
+    schedule.due(FIELDS, 0, 0.0)
+    schedule.due(FIELDS, 1, 0.0)
+    assert schedule.age('can_build', 4) == 4
+    assert schedule.age('score', 4) == 3
+    # never polled fields are fresh
+    assert schedule.age('resources', 4) == 0
+
+def test_reset():
+    schedule = PollSchedule(steps={'can_build': 10})
+    schedule.due(FIELDS, 0, 0.0)
+    assert 'can_build' not in schedule.due(FIELDS, 1, 0.0)
+    schedule.reset()
+    assert 'can_build' in schedule.due(FIELDS, 0, 0.0)
+
+def test_period_should_be_positive():
+    with pytest.raises(AssertionError):
+        PollSchedule(steps={'can_build': 0})
+    with pytest.raises(AssertionError):
+        PollSchedule(game_seconds={'current_age': -1.0})
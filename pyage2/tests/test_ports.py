@@ -0,0 +1,72 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+
+import pytest
+
+from pyage2.lib import ports
+from pyage2.lib.ports import reserve_ports
+
+HOST = "127.0.0.1"
+
+def _can_bind(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind((HOST, port))
+        except OSError:
+            return False
+    return True
+
+def test_reserves_distinct_free_ports(tmp_path):
+    with reserve_ports(3, HOST, str(tmp_path)) as reservation:
+        assert len(set(reservation.ports)) == 3
+        assert all(_can_bind(port) for port in reservation.ports)
+    assert reservation.released
+
+def test_reservations_do_not_overlap(tmp_path):
+    first = reserve_ports(4, HOST, str(tmp_path))
+    second = reserve_ports(4, HOST, str(tmp_path))
+    try:
+        assert not set(first.ports) & set(second.ports)
+    finally:
+        first.release()
+        second.release()
+
+def test_reserved_port_is_skipped(tmp_path, monkeypatch):
+    with reserve_ports(1, HOST, str(tmp_path)) as reservation:
+        port = reservation.ports[0]
+        monkeypatch.setattr(ports, '_free_port', lambda host: port)
+        with pytest.raises(RuntimeError):
+            reserve_ports(1, HOST, str(tmp_path), max_attempts=3)
+
+def test_port_in_use_is_skipped(tmp_path, monkeypatch):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((HOST, 0))
+        sock.listen()
+        port = sock.getsockname()[1]
+        monkeypatch.setattr(ports, '_free_port', lambda host: port)
+        with pytest.raises(RuntimeError):
+            reserve_ports(1, HOST, str(tmp_path), max_attempts=3)
+    # lock taken during the failed attempt is released
+    with reserve_ports(1, HOST, str(tmp_path)) as reservation:
+        assert reservation.ports == [port]
+
+def test_release_makes_port_available_again(tmp_path, monkeypatch):
+    reservation = reserve_ports(1, HOST, str(tmp_path))
+    port = reservation.ports[0]
+    reservation.release()
+    monkeypatch.setattr(ports, '_free_port', lambda host: port)
+    with reserve_ports(1, HOST, str(tmp_path), max_attempts=1) as again:
+        assert again.ports == [port]
@@ -0,0 +1,211 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import dataclasses
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from pyage2.lib import ports
+from pyage2.lib.process import AUTOGAME_PORT_ARG, Age2LaunchError, Age2ProcessPool, LocalProcessBackend
+from pyage2.lib.testing import FakeProc, FakeProcessBackend
+from pyage2.lib.utils import wait_until
+
+TIMEOUT_SECONDS = 10
+
+def _wait_for(probe):
+    wait_until(probe, time.monotonic() + TIMEOUT_SECONDS, max_delay=0.1)
+
+class _GatedBackend(FakeProcessBackend):
+    """Launches only as many processes as allowed so far and keeps track
+    of all of them."""
+
+    def __init__(self, allowed: int):
+        super().__init__()
+        self.allowed = threading.Semaphore(allowed)
+        self.processes = []
+
+    def launch(self, run_config):
+        self.allowed.acquire()
+        process = super().launch(run_config)
+        self.processes.append(process)
+        return process
+
+    def open(self, num_launches: int = 100):
+        for _ in range(num_launches):
+            self.allowed.release()
+
+class _FailingBackend(FakeProcessBackend):
+
+    def launch(self, run_config):
+        raise RuntimeError("no game here")
+
+class _SingleProcessBackend(FakeProcessBackend):
+    """Same limit as `LocalProcessBackend` has."""
+    max_processes = 1
+
+def test_pool_launches_processes_upfront(run_config):
+    backend = FakeProcessBackend()
+    with Age2ProcessPool(run_config, 2, backend) as pool:
+        _wait_for(lambda: pool.num_ready == 2)
+        assert backend.num_launched == 2
+
+def test_lease_launches_replacement(run_config):
+    backend = FakeProcessBackend()
+    with Age2ProcessPool(run_config, 2, backend) as pool:
+        process = pool.lease(timeout=TIMEOUT_SECONDS)
+        try:
+            assert process.running
+            _wait_for(lambda: pool.num_ready == 2)
+            assert backend.num_launched == 3
+        finally:
+            process.close()
+
+def test_release_resets_process(run_config):
+    # replacement is not launched, so the released process fits into the pool
+    backend = _GatedBackend(allowed=1)
+    pool = Age2ProcessPool(run_config, 1, backend)
+    try:
+        process = pool.lease(timeout=TIMEOUT_SECONDS)
+        process.autogame_client.call('StartGame')
+        pool.release(process)
+        _wait_for(lambda: pool.num_ready == 1)
+        leased = pool.lease(timeout=TIMEOUT_SECONDS)
+        assert leased is process
+        assert not leased.autogame_client.call('GetGameInProgress')
+        leased.close()
+    finally:
+        backend.open()
+        pool.close()
+    assert len(backend.processes) == 2
+
+def test_dead_idle_process_is_replaced(run_config):
+    backend = _GatedBackend(allowed=100)
+    with Age2ProcessPool(run_config, 1, backend) as pool:
+        _wait_for(lambda: pool.num_ready == 1)
+        dead = backend.processes[0]
+        dead.proc.terminate()
+        process = pool.lease(timeout=TIMEOUT_SECONDS)
+        try:
+            assert process is not dead
+            assert process.running
+            assert not dead.running
+        finally:
+            process.close()
+
+def test_dead_released_process_is_not_reused(run_config):
+    backend = _GatedBackend(allowed=100)
+    with Age2ProcessPool(run_config, 1, backend) as pool:
+        process = pool.lease(timeout=TIMEOUT_SECONDS)
+        process.proc.terminate()
+        pool.release(process)
+        _wait_for(lambda: process.proc is None)
+        replacement = pool.lease(timeout=TIMEOUT_SECONDS)
+        try:
+            assert replacement is not process
+            assert replacement.running
+        finally:
+            replacement.close()
+
+def test_launch_failure_is_raised_on_lease(run_config):
+    with Age2ProcessPool(run_config, 1, _FailingBackend()) as pool:
+        with pytest.raises(Age2LaunchError) as e:
+            pool.lease(timeout=TIMEOUT_SECONDS)
+        assert isinstance(e.value.__cause__, RuntimeError)
+
+def test_lease_timeout(run_config):
+    backend = _GatedBackend(allowed=0)
+    pool = Age2ProcessPool(run_config, 1, backend)
+    try:
+        with pytest.raises(Age2LaunchError):
+            pool.lease(timeout=0.1)
+    finally:
+        backend.open()
+        pool.close()
+
+def test_pool_respects_backend_limit(run_config):
+    with pytest.raises(AssertionError):
+        Age2ProcessPool(run_config, 2, _SingleProcessBackend())
+    with pytest.raises(AssertionError):
+        Age2ProcessPool(run_config, 2)
+
+def test_no_replacement_while_leased(run_config):
+    backend = _SingleProcessBackend()
+    with Age2ProcessPool(run_config, 1, backend) as pool:
+        process = pool.lease(timeout=TIMEOUT_SECONDS)
+        # the only process allowed is leased, nothing to wait for
+        with pytest.raises(Age2LaunchError):
+            pool.lease(timeout=0.2)
+        assert backend.num_launched == 1
+        pool.release(process)
+        assert pool.lease(timeout=TIMEOUT_SECONDS) is process
+        assert backend.num_launched == 1
+        process.close()
+
+def test_replacement_after_leased_process_died(run_config):
+    backend = _SingleProcessBackend()
+    with Age2ProcessPool(run_config, 1, backend) as pool:
+        process = pool.lease(timeout=TIMEOUT_SECONDS)
+        process.proc.terminate()
+        pool.release(process)
+        replacement = pool.lease(timeout=TIMEOUT_SECONDS)
+        try:
+            assert replacement is not process
+            assert backend.num_launched == 2
+        finally:
+            replacement.close()
+
+def test_closed_pool(run_config):
+    backend = FakeProcessBackend()
+    pool = Age2ProcessPool(run_config, 1, backend)
+    process = pool.lease(timeout=TIMEOUT_SECONDS)
+    pool.close()
+    with pytest.raises(Age2LaunchError):
+        pool.lease(timeout=TIMEOUT_SECONDS)
+    # leased processes are terminated once returned to the closed pool
+    pool.release(process)
+    assert not process.running
+
+@pytest.fixture
+def launched(monkeypatch):
+    """Records command lines of launched games, attaching to them fails."""
+    launched = []
+    def popen(args):
+        launched.append(args)
+        return FakeProc()
+    def injector(pid):
+        raise OSError("not a Windows process")
+    monkeypatch.setattr(subprocess, 'Popen', popen)
+    monkeypatch.setitem(sys.modules, 'pyage2.lib.winapi', types.SimpleNamespace(LibraryInjector=injector))
+    return launched
+
+def test_local_backend_passes_reserved_autogame_port(run_config, launched, monkeypatch):
+    with pytest.raises(Age2LaunchError):
+        LocalProcessBackend().launch(dataclasses.replace(run_config, autogame_port=None))
+    (exec_path, arg, port), = launched
+    assert exec_path == run_config.exec_path
+    assert arg == AUTOGAME_PORT_ARG
+    # reservation is released once the launch has failed
+    monkeypatch.setattr(ports, '_free_port', lambda host: int(port))
+    with ports.reserve_ports(1, max_attempts=1) as reservation:
+        assert reservation.ports == [int(port)]
+
+def test_local_backend_passes_fixed_autogame_port(run_config, launched):
+    with pytest.raises(Age2LaunchError):
+        LocalProcessBackend().launch(run_config)
+    assert launched == [[run_config.exec_path, AUTOGAME_PORT_ARG, str(run_config.autogame_port)]]
@@ -0,0 +1,113 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from pyage2.env.age2_env import Age2Env
+from pyage2.env.remote import Age2EnvServer, RemoteAge2Env
+from pyage2.lib import actions
+from pyage2.lib.configs import GameConfig, PlayerConfig
+from pyage2.lib.expert import MapTiles, ObjectType
+from pyage2.lib.testing import FakeExpertServicer, FakeProcessBackend
+
+NUM_ENVS = 2
+
+class _RecordingServicer(FakeExpertServicer):
+    """Answers 1 to every fact (empty map for tiles) and remembers commands."""
+
+    def __init__(self):
+        super().__init__(result_fn=lambda type_url: 0 if type_url.endswith('ModMapTiles') else 1)
+        self.commands = []
+
+    def ExecuteCommandList(self, request, context):
+        self.commands.extend(command.type_url for command in request.commands)
+        return super().ExecuteCommandList(request, context)
+
+def _game_config():
+    game_config = GameConfig()
+    game_config.add_player(PlayerConfig.create(agent="pyage2.agents.BaseAgent"))
+    game_config.add_player(PlayerConfig.create(agent="pyage2.agents.BaseAgent"))
+    return game_config.validate()
+
+@pytest.fixture
+def servicers():
+    return []
+
+@pytest.fixture
+def envs(run_config, servicers):
+    def servicer_fn():
+        servicer = _RecordingServicer()
+        servicers.append(servicer)
+        return servicer
+    backend = FakeProcessBackend(servicer_fn=servicer_fn)
+    return [Age2Env(run_config, _game_config(), process_backend=backend) for _ in range(NUM_ENVS)]
+
+@pytest.fixture
+def server(envs):
+    server = Age2EnvServer(envs).start()
+    yield server
+    server.close()
+
+@pytest.fixture
+def client(server):
+    client = RemoteAge2Env(server.host, server.port)
+    yield client
+    client.close()
+
+def test_spec(client, envs):
+    assert client.num_envs == NUM_ENVS
+    assert client.num_players == 2
+    assert client.observation_spec() == envs[0].observation_spec()
+    assert client.action_spec() == envs[0].action_spec()
+
+def test_reset(client):
+    obs, info = client.reset()
+    assert obs.num_players == 2
+    assert np.all(obs.data == 1)
+    np.testing.assert_array_equal(obs['alive'], [1, 1])
+    np.testing.assert_array_equal(obs['winning'], [0, 0])
+    assert isinstance(obs.tiles, MapTiles)
+    assert info['episode'] == 1
+    assert info['episode_steps'] == 0
+
+def test_step_many(client, servicers):
+    results = client.reset_many(range(NUM_ENVS))
+    assert [info['episode'] for _, info in results] == [1, 1]
+    player_actions = [
+        [(1, [actions.train(ObjectType.VILLAGER)])],
+        [(2, [actions.no_op()])],
+    ]
+    for step in range(1, 4):
+        results = client.step_many(player_actions, range(NUM_ENVS))
+        for obs, reward, done, info in results:
+            assert np.all(obs.data == 1)
+            assert reward == 0
+            assert not done
+            assert info['episode_steps'] == step
+    # actions only reach the game of the first env
+    trained = [sum(url.split('.')[-1] == 'Train' for url in servicer.commands) for servicer in servicers]
+    assert sorted(trained) == [0, 3]
+
+def test_step_single_env(client):
+    client.reset()
+    obs, reward, done, info = client.step([(1, [actions.attack_now()])])
+    assert obs.num_players == 2
+    assert not done
+    assert info['episode_steps'] == 1
+
+def test_close_closes_envs(envs):
+    server = Age2EnvServer(envs).start()
+    server.close()
+    assert not any(env.process_running for env in envs)
@@ -0,0 +1,193 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+import pyage2.expert.fact.fact_pb2 as fact
+from pyage2.env.age2_env import Age2Env
+from pyage2.lib.expert import ObjectType, ResearchStatus, TechType
+from pyage2.lib.testing import FakeExpertServicer, FakeProcessBackend
+
+TECHS = list(TechType)
+TECH_INDEX = {tech.value: index for index, tech in enumerate(TECHS)}
+# positions of techs in `TECHS` with a given status at the start
+DONE, OPEN, QUEUED, LOCKED = 0, 1, 2, 3
+
+class _Game:
+    """Scripted state of the game, shared by all servicers. Tests change
+    it between steps, servicers answer facts from it."""
+
+    def __init__(self, num_players: int = 2):
+        self.status = np.full((num_players, len(TECHS)), ResearchStatus.UNAVAILABLE, dtype=np.int32)
+        self.age = [0] * num_players
+        self.buildings = [{} for _ in range(num_players)]
+
+    def result(self, player_id: int, name: str, command) -> int:
+        index = player_id - 1
+        if name == 'UpResearchStatus':
+            return int(self.status[index, TECH_INDEX[command.inConstTechId]])
+        if name == 'CanResearch':
+            return int(self.status[index, TECH_INDEX[command.inConstTechId]] == ResearchStatus.AVAILABLE)
+        if name == 'CurrentAge':
+            return self.age[index]
+        if name == 'UnitTypeCount':
+            return self.buildings[index].get(command.inConstUnitId, 0)
+        return 0
+
+class _ScriptedServicer(FakeExpertServicer):
+    """Answers research related facts from `_Game` and records techs
+    polled by each observation request."""
+
+    SCRIPTED = ('UpResearchStatus', 'CanResearch', 'CurrentAge', 'UnitTypeCount')
+
+    def __init__(self, game: _Game):
+        super().__init__(result_fn=lambda type_url: 0)
+        self.game = game
+        # player id -> list of (polled statuses, polled can_research) per step
+        self.polled = {}
+
+    def ExecuteCommandList(self, request, context):
+        response = super().ExecuteCommandList(request, context)
+        player_id = request.playerNumber
+        status_techs, can_research_techs, observed = set(), set(), False
+        for command, result in zip(request.commands, response.results):
+            name = command.type_url.split('.')[-1]
+            if name not in self.SCRIPTED:
+                continue
+            message = getattr(fact, name)()
+            command.Unpack(message)
+            result.Pack(getattr(fact, name + 'Result')(result=self.game.result(player_id, name, message)))
+            if name == 'UpResearchStatus':
+                status_techs.add(TECH_INDEX[message.inConstTechId])
+            elif name == 'CanResearch':
+                can_research_techs.add(TECH_INDEX[message.inConstTechId])
+            elif name == 'CurrentAge':
+                observed = True
+        # only observation requests query the age
+        if observed:
+            self.polled.setdefault(player_id, []).append((status_techs, can_research_techs))
+        return response
+
+@pytest.fixture
+def game():
+    game = _Game()
+    game.status[:, OPEN] = ResearchStatus.AVAILABLE
+    game.status[:, QUEUED] = ResearchStatus.PENDING
+    game.status[:, DONE] = ResearchStatus.COMPLETE
+    return game
+
+@pytest.fixture
+def servicers():
+    return []
+
+@pytest.fixture
+def backend(game, servicers):
+    def servicer_fn():
+        servicer = _ScriptedServicer(game)
+        servicers.append(servicer)
+        return servicer
+    return FakeProcessBackend(servicer_fn=servicer_fn)
+
+@pytest.fixture
+def env(run_config, game_config, backend):
+    with Age2Env(run_config, game_config, process_backend=backend, track_research=True) as env:
+        yield env
+
+def _last_polled(servicer, player_id: int = 1):
+    return servicer.polled[player_id][-1]
+
+def test_initial_scan(env, servicers):
+    obs, _ = env.reset()
+    status_techs, can_research_techs = _last_polled(servicers[0])
+    assert status_techs == set(range(len(TECHS)))
+    assert can_research_techs == set(range(len(TECHS)))
+    assert obs['research_status'][0, DONE] == ResearchStatus.COMPLETE
+    assert obs['research_status'][0, QUEUED] == ResearchStatus.PENDING
+    assert obs['can_research'][0, OPEN] == 1
+
+def test_complete_techs_are_dropped(env, game, servicers):
+    env.reset()
+    obs, *_ = env.step([])
+    status_techs, can_research_techs = _last_polled(servicers[0])
+    assert DONE not in status_techs and DONE not in can_research_techs
+    assert obs['research_status'][0, DONE] == ResearchStatus.COMPLETE
+    assert obs['can_research'][0, DONE] == 0
+
+    # pending research finishes and is no longer queried
+    game.status[0, QUEUED] = ResearchStatus.COMPLETE
+    obs, *_ = env.step([])
+    assert obs['research_status'][0, QUEUED] == ResearchStatus.COMPLETE
+    env.step([])
+    status_techs, can_research_techs = _last_polled(servicers[0])
+    assert QUEUED not in status_techs and QUEUED not in can_research_techs
+    # the other player still researches it
+    status_techs, _ = _last_polled(servicers[0], player_id=2)
+    assert QUEUED in status_techs
+
+def test_available_and_pending_techs_are_repolled(env, game, servicers):
+    env.reset()
+    for _ in range(3):
+        env.step([])
+        status_techs, can_research_techs = _last_polled(servicers[0])
+        assert status_techs == {OPEN, QUEUED}
+        assert can_research_techs == set(range(len(TECHS))) - {DONE}
+
+    # research started, status is picked up without a re-scan
+    game.status[0, OPEN] = ResearchStatus.PENDING
+    obs, *_ = env.step([])
+    assert obs['research_status'][0, OPEN] == ResearchStatus.PENDING
+    assert _last_polled(servicers[0])[0] == {OPEN, QUEUED}
+
+@pytest.mark.parametrize("change", ["age", "buildings"])
+def test_rescan_on_change(env, game, servicers, change):
+    env.reset()
+    env.step([])
+    game.status[0, LOCKED] = ResearchStatus.PENDING
+    if change == "age":
+        game.age[0] = 1
+    else:
+        game.buildings[0][ObjectType.BARRACKS.value] = 1
+    # change is observed on this step, unavailable techs are re-scanned on the next one
+    obs, *_ = env.step([])
+    assert obs['research_status'][0, LOCKED] == ResearchStatus.UNAVAILABLE
+    obs, *_ = env.step([])
+    assert _last_polled(servicers[0])[0] == set(range(len(TECHS))) - {DONE}
+    assert obs['research_status'][0, LOCKED] == ResearchStatus.PENDING
+    # nothing changed for the other player
+    assert _last_polled(servicers[0], player_id=2)[0] == {OPEN, QUEUED}
+    env.step([])
+    assert _last_polled(servicers[0])[0] == {OPEN, QUEUED, LOCKED}
+
+def test_observations_match_untracked(run_config, game_config, game, backend):
+    with Age2Env(run_config, game_config, process_backend=backend, track_research=True) as tracked, \
+            Age2Env(run_config, game_config, process_backend=backend) as untracked:
+        fields = [name for name in untracked.observation_spec() if name != 'tiles']
+
+        def assert_same(tracked_obs, untracked_obs):
+            for name in fields:
+                np.testing.assert_array_equal(tracked_obs[name], untracked_obs[name], err_msg=name)
+
+        assert_same(tracked.reset()[0], untracked.reset()[0])
+        for step in range(6):
+            if step == 1:
+                game.status[0, OPEN] = ResearchStatus.PENDING
+            elif step == 2:
+                game.status[0, QUEUED] = ResearchStatus.COMPLETE
+                game.status[1, LOCKED] = ResearchStatus.AVAILABLE
+            elif step == 3:
+                game.age[1] = 1
+            elif step == 4:
+                game.buildings[0][ObjectType.BARRACKS.value] = 1
+            assert_same(tracked.step([])[0], untracked.step([])[0])
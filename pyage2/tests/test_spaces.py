@@ -0,0 +1,157 @@
+# Copyright 2021 PyAge2, Oleksii Kachaiev <kachayev@gmail.com>. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from pyage2.env.observations import ObservationBatch
+from pyage2.env.spaces import (
+    ACTION_ARGS, INT32_MAX, INT32_MIN, TILE_PADDING, ActionDecoder, FlatObservationEncoder)
+from pyage2.lib.expert import MapTiles, ObservationLayout
+
+SPEC = {'score': (1,), 'resources': (4,), 'tiles': MapTiles}
+NUM_PLAYERS = 2
+MAX_MAP_SIZE = (4, 5)
+
+def _tiles(map_height, map_width):
+    size = map_height * map_width
+    return MapTiles(
+        height=np.arange(size, dtype=np.int32).reshape(map_height, map_width),
+        terrain=np.full((map_height, map_width), 2, dtype=np.int32),
+        visibility=np.ones((map_height, map_width), dtype=np.int32),
+    )
+
+def _batch(tiles=None):
+    batch = ObservationBatch(ObservationLayout(SPEC), NUM_PLAYERS, tiles)
+    batch['score'][:] = [10, 20]
+    batch['resources'][:] = [[1, 2, 3, 4], [5, 6, 7, 8]]
+    batch['alive'][:] = [1, 0]
+    batch['winning'][:] = [0, 1]
+    return batch
+
+def test_offsets():
+    encoder = FlatObservationEncoder(SPEC, NUM_PLAYERS, MAX_MAP_SIZE)
+    assert encoder.offsets == {
+        'score': (0, (2,)),
+        'resources': (2, (2, 4)),
+        'alive': (10, (2,)),
+        'winning': (12, (2,)),
+        'map_size': (14, (2,)),
+        'height': (16, (4, 5)),
+        'terrain': (36, (4, 5)),
+        'visibility': (56, (4, 5)),
+    }
+    assert encoder.size == 76
+
+def test_encode_decode():
+    encoder = FlatObservationEncoder(SPEC, NUM_PLAYERS, MAX_MAP_SIZE)
+    batch = _batch(_tiles(3, 2))
+    flat = encoder.encode(batch)
+    assert flat.shape == (encoder.size,)
+    assert flat.dtype == np.int32
+    fields = encoder.decode(flat)
+    for name in ('score', 'resources', 'alive', 'winning'):
+        np.testing.assert_array_equal(fields[name], batch[name])
+    np.testing.assert_array_equal(fields['map_size'], [3, 2])
+    for name in ('height', 'terrain', 'visibility'):
+        np.testing.assert_array_equal(fields[name][:3, :2], getattr(batch.tiles, name))
+        assert np.all(fields[name][3:, :] == TILE_PADDING)
+        assert np.all(fields[name][:, 2:] == TILE_PADDING)
+
+def test_encode_without_tiles():
+    encoder = FlatObservationEncoder(SPEC, NUM_PLAYERS, MAX_MAP_SIZE)
+    fields = encoder.decode(encoder.encode(_batch()))
+    np.testing.assert_array_equal(fields['map_size'], [0, 0])
+    assert np.all(fields['terrain'] == TILE_PADDING)
+
+def test_tiles_excluded():
+    encoder = FlatObservationEncoder(SPEC, NUM_PLAYERS, include_tiles=False)
+    assert encoder.size == 14
+    assert 'terrain' not in encoder.offsets
+    np.testing.assert_array_equal(encoder.encode(_batch(_tiles(3, 2)))[:10], _batch().data)
+
+def test_map_does_not_fit():
+    encoder = FlatObservationEncoder(SPEC, NUM_PLAYERS, MAX_MAP_SIZE)
+    with pytest.raises(AssertionError):
+        encoder.encode(_batch(_tiles(5, 5)))
+
+def test_encode_many():
+    encoder = FlatObservationEncoder(SPEC, NUM_PLAYERS, MAX_MAP_SIZE)
+    batches = [_batch(), _batch(_tiles(4, 5))]
+    flat = encoder.encode_many(batches)
+    assert flat.shape == (2, encoder.size)
+    np.testing.assert_array_equal(flat[1], encoder.encode(batches[1]))
+    assert encoder.decode(flat)['resources'].shape == (2, NUM_PLAYERS, 4)
+
+def test_bounds():
+    encoder = FlatObservationEncoder(SPEC, NUM_PLAYERS, MAX_MAP_SIZE)
+    fields_low, fields_high = encoder.decode(encoder.low), encoder.decode(encoder.high)
+    assert np.all(fields_low['score'] == INT32_MIN) and np.all(fields_high['score'] == INT32_MAX)
+    assert np.all(fields_low['alive'] == 0) and np.all(fields_high['alive'] == 1)
+    assert np.all(fields_low['terrain'] == TILE_PADDING)
+    flat = encoder.encode(_batch(_tiles(3, 2)))
+    assert np.all((encoder.low <= flat) & (flat <= encoder.high))
+
+def test_spaces():
+    pytest.importorskip("gymnasium")
+    encoder = FlatObservationEncoder(SPEC, NUM_PLAYERS, MAX_MAP_SIZE)
+    flat = encoder.encode(_batch(_tiles(3, 2)))
+    assert encoder.flat_space().contains(flat)
+    assert encoder.space().contains(encoder.decode(flat))
+
+# stand-ins for the action builders, decoder only looks at the names
+def no_op():
+    return ('no_op',)
+
+def set_strategic_number(sn, value):
+    return ('set_strategic_number', sn, value)
+
+def research(tech):
+    return ('research', tech)
+
+def build(building):
+    return ('build', building)
+
+ACTION_SPEC = [(no_op, []), (set_strategic_number, []), (research, []), (build, [])]
+
+def test_decode_no_aliasing():
+    decoder = ActionDecoder(ACTION_SPEC, [1, 2])
+    techs = ACTION_ARGS['research'][0]
+    assert list(decoder.arg_sizes[2]) == [len(techs), decoder.nvec[0, 2]]
+    decoded = set()
+    for index in range(len(techs)):
+        [(_, [action]), _] = decoder.decode([[2, index, 0], [0, 0, 0]])
+        decoded.add(action)
+    assert len(decoded) == len(techs)
+    # every index past the valid range is rejected rather than wrapped
+    for index in range(len(techs), decoder.nvec[0, 1]):
+        with pytest.raises(ValueError):
+            decoder.decode([[2, index, 0], [0, 0, 0]])
+
+def test_decode_ignores_unused_args():
+    decoder = ActionDecoder(ACTION_SPEC, [1])
+    last = decoder.nvec[0, 1:] - 1
+    assert decoder.decode([[0, *last]]) == [(1, [('no_op',)])]
+
+def test_masked_sample():
+    pytest.importorskip("gymnasium")
+    decoder = ActionDecoder(ACTION_SPEC, [1, 2])
+    space = decoder.space()
+    space.seed(0)
+    for _ in range(20):
+        choices = space.sample(mask=decoder.mask([2, 1]))
+        assert list(choices[:, 0]) == [2, 1]
+        assert choices[0, 1] < decoder.arg_sizes[2, 0]
+        [(_, [first]), (_, [second])] = decoder.decode(choices)
+        assert first[0] == 'research' and second[0] == 'set_strategic_number'
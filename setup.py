@@ -51,7 +51,11 @@ setup(
         'msgpack-rpc-python>=0.4.1',
         'protobuf>=3.17.3',
         'grpcio>=1.38.1',
+        'numpy>=1.19.0',
     ],
+    extras_require = {
+        'gym': ['gymnasium>=0.26.0'],
+    },
     entry_points = {
         'console_scripts': [
             'pyage2_play = pyage2.bin.play:entry_point',